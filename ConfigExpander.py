@@ -0,0 +1,98 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+
+def canonical_url(link:str) -> str:
+
+    """
+    Normalizes an expanded feature url: the query starts with '?' even if the first spec mod
+    was an '&' mod, and repeated identical parameters are dropped (the order is kept).
+    """
+
+    link = link.replace("/&", "/?")
+    parts = urlsplit(link)
+
+    params = []
+    for param in parts.query.split('&'):
+        if param and param not in params:
+            params.append(param)
+
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, '&'.join(params), parts.fragment))
+
+
+def dedup_key(url:str) -> bytes:
+
+    # the same parameters in another order are the same search
+    parts = urlsplit(url)
+    key = f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path}?{'&'.join(sorted(parts.query.split('&')))}"
+
+    # 8 bytes per url are enough to tell them apart, and keep huge expansions small in memory
+    return hashlib.blake2b(key.encode(), digest_size=8).digest()
+
+
+class ConfigExpander:
+
+    def __init__(self, config:dict):
+
+        """
+        Lazily expands a search config into feature urls.
+
+        Every link mod is appended to base_link; then, level by level, every spec mod key
+        (e.g. '?area=') is combined with its 'apply_to_all' values and the values listed for link
+        mods contained in the link. A link that no value of a level applies to skips that level.
+
+        The urls are generated depth first, so no intermediate list of links is built, and
+        duplicates (after canonical_url) are only yielded once.
+
+        Usage:
+            expander = ConfigExpander(config)
+            for url in expander: ...
+        """
+
+        self.base_link = config['base_link']
+        self.link_mods = config['link_mods']
+        self.levels = list(config.get('spec_mods', {}).items())
+
+        self.expanded = 0
+        self.duplicates = 0
+
+    def _expand(self, link:str, level:int):
+
+        if level == len(self.levels):
+            yield link
+            return
+
+        recur, apply_to_dict = self.levels[level]
+
+        # Apply global mods, then specific mods
+        mods = list(apply_to_dict.get("apply_to_all", []))
+        for link_mod, specific_mods in apply_to_dict.items():
+            if link_mod != "apply_to_all" and link_mod in link:
+                mods.extend(specific_mods)
+
+        # if the link is not targeted by this spec mod at all, it stays as it is
+        if not mods:
+            yield from self._expand(link, level + 1)
+            return
+
+        for mod in mods:
+            yield from self._expand(link + recur + mod, level + 1)
+
+    def __iter__(self):
+
+        self.expanded = 0
+        self.duplicates = 0
+        seen = set()
+
+        for link_mod in self.link_mods:
+            for link in self._expand(self.base_link + link_mod, 0):
+                url = canonical_url(link)
+                key = dedup_key(url)
+
+                if key in seen:
+                    self.duplicates += 1
+                    continue
+
+                seen.add(key)
+                self.expanded += 1
+                yield url
@@ -0,0 +1,341 @@
+import threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+
+    def __init__(self, rate:float, burst:int = 1):
+
+        """
+        Thread-safe token bucket. rate is in tokens (requests) per second, burst is the bucket size.
+        With burst = 1 two requests are never closer than 1 / rate seconds.
+        A rate of 0 (or less) means unlimited.
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+
+        """
+        Blocks until a token is available and takes it.
+
+        :return: Seconds spent waiting.
+        """
+
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+    def set_rate(self, rate:float) -> None:
+
+        # the tokens up to now still come at the old rate
+        with self.lock:
+            now = time.monotonic()
+            if self.rate > 0:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.rate = rate
+
+
+class AimdRate:
+
+    def __init__(self, bucket, min_rate:float = 0.2, max_rate:float = None, increase:float = 0.5,
+                 decrease:float = 0.7, latency_factor:float = 2.0, error_threshold:float = 0.05,
+                 cooldown:float = 2.0, base_drift:float = 0.01):
+
+        """
+        Adaptive request rate of one host (additive increase, multiplicative decrease), it sets
+        the rate of the host's token bucket after every response:
+
+        - a throttled, failed, timed out or empty response, or a latency above latency_factor
+          times the base latency, multiplies the rate by decrease (at most once per
+          cooldown seconds, the requests that were already in flight report the same congestion)
+        - every other response adds increase / rate, i.e. the rate grows by about `increase`
+          req/s per second, as long as the recent error rate is below error_threshold
+        - until the first slow-down (slow start) every good response adds `increase` instead,
+          so the rate grows exponentially towards what the server tolerates
+
+        The base latency follows a lower latency right away and drifts slowly (base_drift per
+        response) towards a higher one, so a server that got slower for good is not taken for a
+        congested one forever.
+
+        The rate stays between min_rate and max_rate (None = no upper limit). A bucket that
+        starts unlimited (rate 0) is only limited after the first congestion, to `decrease`
+        times the rate the requests were actually coming at.
+        """
+
+        self.bucket = bucket
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.base_drift = base_drift
+
+        self.latency = None  # moving average of the successful responses
+        self.base_latency = None  # the latency of an idle server, see base_drift
+        self.error_rate = 0.0  # moving average, over ~10 responses
+        self.last_decrease = 0.0
+        self.slow_start = True
+        self.recent = deque(maxlen=50)  # times of the last responses, for the actual request rate
+        self.decreases = 0
+        self.lock = threading.Lock()
+
+    def observed_rate(self) -> float:
+
+        if len(self.recent) < 2 or self.recent[-1] <= self.recent[0]:
+            return self.min_rate
+        return (len(self.recent) - 1) / (self.recent[-1] - self.recent[0])
+
+    def record(self, failure:str, latency:float) -> None:
+
+        """
+        :param failure: None for a good response, else 'throttled', 'error', 'timeout' or 'empty'.
+        :param latency: Seconds the response took, None if there was none.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            self.recent.append(now)
+            self.error_rate = 0.9 * self.error_rate + 0.1 * (failure is not None)
+
+            if failure is None and latency is not None:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                if len(self.recent) >= 5:
+                    if self.base_latency is None or self.latency < self.base_latency:
+                        self.base_latency = self.latency
+                    else:
+                        self.base_latency += self.base_drift * (self.latency - self.base_latency)
+
+            slow = self.base_latency is not None and self.latency > self.latency_factor * self.base_latency
+            rate = self.bucket.rate
+
+            if failure is not None or slow:
+                if now - self.last_decrease < self.cooldown:
+                    return
+                self.last_decrease = now
+                self.decreases += 1
+                self.slow_start = False
+                rate = (rate if rate > 0 else self.observed_rate()) * self.decrease
+                self.bucket.set_rate(max(self.min_rate, rate))
+
+            elif rate > 0 and self.error_rate < self.error_threshold:
+                rate += self.increase if self.slow_start else self.increase / rate
+                self.bucket.set_rate(min(self.max_rate, rate) if self.max_rate else rate)
+
+
+class HostLimiter:
+
+    def __init__(self, requests_per_second:float = 1.0, burst:int = 1, max_in_flight:int = 1,
+                 adaptive:dict = None):
+
+        """
+        Per-host politeness: every host gets its own token bucket (request rate) and semaphore
+        (requests in flight at the same time). With adaptive settings (see AimdRate) the rate of
+        every host follows its responses, reported with record().
+        """
+
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.adaptive = adaptive
+
+        self.buckets = {}
+        self.semaphores = {}
+        self.rate_controllers = {}
+        self.lock = threading.Lock()
+
+        self.requests = 0
+        self.seconds_waited = 0.0
+
+    def _host_state(self, host:str):
+
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_in_flight)
+            return self.buckets[host], self.semaphores[host]
+
+    @contextmanager
+    def slot(self, url:str):
+
+        """
+        Wrap every request in this context manager:
+
+            with limiter.slot(url):
+                session.fetch(url)
+        """
+
+        bucket, semaphore = self._host_state(urlsplit(url).netloc)
+
+        with semaphore:
+            waited = bucket.acquire()
+            with self.lock:
+                self.requests += 1
+                self.seconds_waited += waited
+            yield
+
+    def record(self, url:str, failure:str, latency:float) -> None:
+
+        """
+        Adaptive mode: reports the outcome of a request to the AimdRate of its host.
+        """
+
+        if self.adaptive is None:
+            return
+
+        host = urlsplit(url).netloc
+        bucket, _ = self._host_state(host)
+
+        with self.lock:
+            controller = self.rate_controllers.get(host)
+            if controller is None:
+                controller = self.rate_controllers[host] = AimdRate(bucket, **self.adaptive)
+
+        controller.record(failure, latency)
+
+    def rates(self) -> dict:
+        # host -> current request rate
+        with self.lock:
+            return {host: bucket.rate for host, bucket in self.buckets.items()}
+
+
+class CrawlScheduler:
+
+    def __init__(self, max_workers:int = 1, requests_per_second:float = 1.0, burst:int = 1,
+                 max_in_flight:int = 1, adaptive:dict = None):
+
+        """
+        Runs several features at once on a thread pool, while the shared HostLimiter keeps
+        every host below its request rate and in-flight limit.
+
+        functions:
+
+        map() - runs a function for every item, results are returned in input order.
+        """
+
+        self.max_workers = max_workers
+        self.limiter = HostLimiter(requests_per_second, burst, max_in_flight, adaptive)
+
+    @classmethod
+    def from_config(cls, config:dict, sleeper:float = 1):
+
+        """
+        Reads the 'politeness' block of a search config:
+
+            "politeness": {"max_concurrent_features": 4, "requests_per_second": 2,
+                           "burst": 1, "max_in_flight": 2,
+                           "adaptive": {"enabled": true, "min_requests_per_second": 0.2,
+                                        "max_requests_per_second": 8}}
+
+        Without it, the old behaviour is kept: one feature at a time and at most one request
+        per sleeper seconds. With 'adaptive', requests_per_second is the starting rate and, without
+        max_requests_per_second, also the highest one (unlimited if it is 0). See AimdRate for the
+        other keys (increase, decrease, latency_factor, error_threshold, cooldown, base_drift).
+        """
+
+        politeness = config.get("politeness", {})
+        default_rate = 1 / sleeper if sleeper else 0
+        requests_per_second = politeness.get("requests_per_second", default_rate)
+
+        # "adaptive": true or a block of settings
+        adaptive = politeness.get("adaptive", {})
+        if adaptive is True:
+            adaptive = {"enabled": True}
+
+        if adaptive and adaptive.get("enabled", True):
+            adaptive = {
+                "min_rate": adaptive.get("min_requests_per_second", 0.2),
+                # the configured rate is the ceiling, unless a higher one is asked for explicitly
+                "max_rate": adaptive.get("max_requests_per_second",
+                                         requests_per_second if requests_per_second > 0 else None),
+                **{key: adaptive[key] for key in ("increase", "decrease", "latency_factor", "error_threshold",
+                                                  "cooldown", "base_drift") if key in adaptive},
+            }
+        else:
+            adaptive = None
+
+        return cls(
+            max_workers=politeness.get("max_concurrent_features", 1),
+            requests_per_second=requests_per_second,
+            burst=politeness.get("burst", 1),
+            max_in_flight=politeness.get("max_in_flight", 1),
+            adaptive=adaptive,
+        )
+
+    @classmethod
+    def from_configs(cls, configs:list, sleeper:float = 1):
+
+        """
+        One scheduler for several configs that crawl together (see SharedCrawl): the most
+        concurrent feature setting, but the strictest per-host limits of all of them.
+        """
+
+        schedulers = [cls.from_config(config, sleeper=sleeper) for config in configs]
+
+        # a rate of 0 is unlimited, it only wins if every config is unlimited
+        rates = [scheduler.limiter.requests_per_second for scheduler in schedulers]
+        limited_rates = [rate for rate in rates if rate > 0]
+
+        # adaptive if one config is, with the lowest ceiling; a fixed rate is the ceiling of its config
+        ceilings = [scheduler.limiter.adaptive["max_rate"] if scheduler.limiter.adaptive
+                    else scheduler.limiter.requests_per_second or None for scheduler in schedulers]
+        adaptive = min((scheduler.limiter.adaptive for scheduler in schedulers if scheduler.limiter.adaptive),
+                       key=lambda adaptive: adaptive["max_rate"] or float("inf"), default=None)
+        if adaptive is not None and any(ceilings):
+            adaptive = {**adaptive, "max_rate": min(ceiling for ceiling in ceilings if ceiling)}
+
+        return cls(
+            max_workers=max(scheduler.max_workers for scheduler in schedulers),
+            requests_per_second=min(limited_rates) if limited_rates else 0,
+            burst=min(scheduler.limiter.burst for scheduler in schedulers),
+            max_in_flight=min(scheduler.limiter.max_in_flight for scheduler in schedulers),
+            adaptive=adaptive,
+        )
+
+    def map(self, function, items) -> list:
+
+        if self.max_workers <= 1:
+            return [function(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(function, items))
+
+    def print_report(self, elapsed:float) -> None:
+
+        rate = self.limiter.requests / elapsed if elapsed > 0 else 0.0
+        print(
+            f"\n --- Scheduler: {self.limiter.requests} requests in {elapsed:.1f}s ({rate:.2f} req/s, "
+            f"limit {self.limiter.requests_per_second} req/s per host), "
+            f"{self.limiter.seconds_waited:.1f}s spent waiting for the rate limit.\n"
+        )
+
+        if self.limiter.adaptive is not None:
+            for host, host_rate in self.limiter.rates().items():
+                controller = self.limiter.rate_controllers.get(host)
+                print(f" ---> Adaptive rate of {host}: {host_rate:.2f} req/s at the end, "
+                      f"{controller.decreases if controller else 0} slow-downs.")
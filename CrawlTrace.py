@@ -0,0 +1,196 @@
+import glob, json, os, statistics, threading, time
+from contextlib import contextmanager
+
+
+def trace_path(snapshot_folder:str) -> str:
+    # page_source_folder/<config>/2024-01-31-18/ -> page_source_folder/<config>/2024-01-31-18.trace.jsonl
+    return snapshot_folder.rstrip('/') + '.trace.jsonl'
+
+
+class CrawlTrace:
+
+    def __init__(self, path:str = None):
+
+        """
+        Machine-readable trace of a run: one json object per line in <yyyy-mm-dd-hh>.trace.jsonl
+        next to the snapshot folder, e.g.
+
+            {"event": "fetch", "time": 1706720400.1, "seconds": 0.41, "feature": "...", "page": 3, "bytes": 81234, ...}
+
+        span() times a block, event() records a point in time. Lines are written by several
+        threads, the file is only appended to (a resumed run continues its trace).
+        Without a path the trace is switched off and costs nothing.
+
+        functions:
+
+        span() - context manager, records the seconds a block took (plus the fields it was given).
+        event() - records one event.
+        merge() - appends the events of another trace file.
+        """
+
+        self.path = path
+        self.enabled = path is not None
+        self.lock = threading.Lock()
+        self.file = open(path, 'a') if self.enabled else None
+
+    def event(self, event:str, **fields) -> None:
+
+        if not self.enabled:
+            return
+
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **fields})
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    @contextmanager
+    def span(self, event:str, **fields):
+
+        """
+        Usage:
+            with trace.span("parse", feature=feat_mods) as fields:
+                links = ...
+                fields["listings"] = len(links)
+        """
+
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            if self.enabled:
+                self.event(event, seconds=round(time.perf_counter() - start, 4), **fields)
+
+    def merge(self, path:str) -> None:
+
+        # appends the events of another trace, e.g. the part of a run a queue worker did
+        if not self.enabled or not os.path.isfile(path):
+            return
+
+        with open(path, 'r') as f:
+            lines = [line for line in f if line.endswith("\n")]
+
+        with self.lock:
+            self.file.writelines(lines)
+            self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.enabled = False
+
+
+def read_trace(path:str) -> list[dict]:
+
+    events = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the last line of a killed run can be cut off
+                continue
+
+    return events
+
+
+def percentile(values:list, share:float) -> float:
+
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def summarize_trace(path:str) -> dict:
+
+    """
+    The key numbers of one run: time per phase, pages, bytes, latencies, retries.
+    """
+
+    events = read_trace(path)
+
+    def seconds(name:str) -> float:
+        return sum(event.get("seconds", 0) for event in events if event["event"] == name)
+
+    fetches = [event for event in events if event["event"] == "fetch"]
+    fetch_seconds = [event["fetch_seconds"] for event in fetches]
+    features = [event for event in events if event["event"] == "feature"]
+    runs = [event for event in events if event["event"] == "run"]
+
+    # a resumed run has several 'run' events, they add up
+    elapsed = sum(event["seconds"] for event in runs)
+    fetcher = {}
+    for event in runs:
+        for key, value in event.get("fetcher", {}).items():
+            fetcher[key] = fetcher.get(key, 0) + value
+
+    pages = len(fetches)
+    listings = sum(event.get("listings", 0) for event in fetches)
+
+    return {
+        "snapshot": os.path.basename(path).replace('.trace.jsonl', ''),
+        "elapsed": elapsed,
+        "features": len(features),
+        "pages": pages,
+        "pages_per_second": pages / elapsed if elapsed else 0.0,
+        "bytes": sum(event.get("bytes", 0) for event in fetches),
+        "listings_per_page": listings / pages if pages else 0.0,
+        "fetch_avg": statistics.mean(fetch_seconds) if fetch_seconds else 0.0,
+        "fetch_p95": percentile(fetch_seconds, 0.95),
+        "waiting": sum(max(0.0, event.get("seconds", 0) - event.get("fetch_seconds", 0)) for event in fetches),
+        "write": seconds("write"),
+        "parse": seconds("parse") + seconds("parse_files"),
+        "json": seconds("save_json"),
+        "link_handling": sum(event.get("seconds", 0) for event in events if event["event"].startswith("links_")),
+        "browser_startup": fetcher.get("browser_startup_seconds", 0.0),
+        # a browser crash is retried by RetryPolicy, it is one of the page retries
+        "retries": fetcher.get("retries", 0) + sum(event.get("page_retries", 0) for event in runs),
+        "failed_features": sum(1 for event in features if event.get("stop") == "failed"),
+    }
+
+
+def print_stats(config_folder_path:str, last:int = 20) -> list[dict]:
+
+    """
+    Prints one line per traced run of a config (the last `last` runs) and compares the newest
+    run with the median of the ones before it.
+
+    :return: The summaries, oldest first.
+    """
+
+    paths = sorted(glob.glob(os.path.join(config_folder_path, '*.trace.jsonl')))[-last:]
+    summaries = [summary for summary in map(summarize_trace, paths) if summary["pages"]]
+
+    print(f"\n--- Run statistics of {config_folder_path} ({len(summaries)} traced runs) ---\n")
+    if not summaries:
+        print("---> No traced runs yet.")
+        return summaries
+
+    print(f" {'snapshot':<14} {'time':>7} {'pages':>6} {'pg/s':>6} {'MiB':>7} {'ads/pg':>6} {'fetch':>6} "
+          f"{'p95':>6} {'wait':>7} {'write':>6} {'parse':>6} {'json':>5} {'browser':>7} {'retry':>5}")
+
+    for s in summaries:
+        print(f" {s['snapshot']:<14} {s['elapsed']:>6.1f}s {s['pages']:>6} {s['pages_per_second']:>6.2f} "
+              f"{s['bytes'] / 1048576:>7.1f} {s['listings_per_page']:>6.1f} {s['fetch_avg']:>5.2f}s "
+              f"{s['fetch_p95']:>5.2f}s {s['waiting']:>6.1f}s {s['write']:>5.1f}s {s['parse']:>5.1f}s "
+              f"{s['json']:>4.1f}s {s['browser_startup']:>6.1f}s {s['retries']:>5}")
+
+    if len(summaries) > 1:
+        latest, earlier = summaries[-1], summaries[:-1]
+        print()
+        for key, label, higher_is_better in [("pages_per_second", "pages/s", True),
+                                             ("fetch_avg", "avg. fetch latency", False),
+                                             ("fetch_p95", "p95 fetch latency", False),
+                                             ("parse", "parse time", False)]:
+            median = statistics.median(summary[key] for summary in earlier)
+            if not median:
+                continue
+
+            change = (latest[key] - median) / median
+            worse = change < -0.25 if higher_is_better else change > 0.25
+            print(f" ---> {label}: {latest[key]:.2f} vs. median {median:.2f} ({change:+.0%})"
+                  + ("   <-- REGRESSION" if worse else ""))
+
+    return summaries
@@ -0,0 +1,271 @@
+import gzip, hashlib, json, os, re, sqlite3, threading, time
+
+from CrawlScheduler import CrawlScheduler
+from PageFetcher import RetryPolicy, make_fetcher
+from RunJournal import write_atomic
+from SeenIndex import ad_id_from_link, in_chunks
+
+
+# ad ids that can be used as file names as they are, others are hashed
+SAFE_AD_ID = re.compile(r'^[0-9A-Za-z_-]{1,100}$')
+
+
+def detail_file_name(ad_id:str) -> str:
+
+    if SAFE_AD_ID.match(ad_id):
+        return ad_id + ".html.gz"
+
+    return hashlib.blake2b(ad_id.encode(), digest_size=16).hexdigest() + ".html.gz"
+
+
+class DetailCache:
+
+    def __init__(self, config_folder_path:str, max_age_days:float = None, max_cache_mb:float = None):
+
+        """
+        Cache of listing detail pages, keyed by ad id:
+
+        - page_source_folder/<config>/item_html_files/<ad id>.html.gz - the gzipped detail pages
+        - page_source_folder/<config>/details.sqlite - the ledger of every ad id that was ever
+          fetched. Evicting a page only deletes its file, the ledger row stays, so an evicted ad
+          is not fetched again either.
+
+        functions:
+
+        is_fetched() - True if the ad was fetched in any earlier run.
+        store() - writes a detail page and records it in the ledger.
+        load() - the cached detail page of an ad, None if it is not (or no longer) cached.
+        evict() - deletes cached pages older than max_age_days, then the oldest ones until the
+        cache is below max_cache_mb.
+        """
+
+        self.folder = os.path.join(config_folder_path, "item_html_files")
+        os.makedirs(self.folder, exist_ok=True)
+
+        self.max_age_days = max_age_days
+        self.max_cache_mb = max_cache_mb
+
+        # stores happen on the fetch threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(config_folder_path, "details.sqlite"),
+                                          check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS details (
+                ad_id TEXT PRIMARY KEY,
+                link TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                cached INTEGER NOT NULL
+            );
+        """)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def path(self, ad_id:str) -> str:
+        return os.path.join(self.folder, detail_file_name(ad_id))
+
+    def fetched_ad_ids(self, ad_ids:list) -> set:
+
+        fetched = set()
+        with self.lock:
+            for chunk, placeholders in in_chunks(ad_ids):
+                fetched.update(row[0] for row in self.connection.execute(
+                    f"SELECT ad_id FROM details WHERE ad_id IN ({placeholders})", chunk
+                ))
+
+        return fetched
+
+    def is_fetched(self, ad_id:str) -> bool:
+        return bool(self.fetched_ad_ids([ad_id]))
+
+    def store(self, ad_id:str, link:str, page_source:str) -> str:
+
+        path = self.path(ad_id)
+        data = gzip.compress(page_source.encode(), compresslevel=6)
+
+        write_atomic(path, data)
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO details (ad_id, link, fetched_at, size, cached) VALUES (?, ?, ?, ?, 1)",
+                (ad_id, link, time.time(), len(data))
+            )
+
+        return path
+
+    def load(self, ad_id:str) -> str:
+
+        path = self.path(ad_id)
+        if not os.path.isfile(path):
+            return None
+
+        with gzip.open(path, 'rt') as f:
+            return f.read()
+
+    def evict(self) -> int:
+
+        """
+        :return: Number of cached pages that were deleted.
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT ad_id, fetched_at, size FROM details WHERE cached = 1 ORDER BY fetched_at"
+            ).fetchall()
+
+        to_evict = []
+
+        if self.max_age_days is not None:
+            oldest_allowed = time.time() - self.max_age_days * 86400
+            to_evict = [ad_id for ad_id, fetched_at, _ in rows if fetched_at < oldest_allowed]
+            rows = [row for row in rows if row[1] >= oldest_allowed]
+
+        if self.max_cache_mb is not None:
+            total = sum(size for _, _, size in rows)
+            limit = self.max_cache_mb * 1024 * 1024
+            for ad_id, _, size in rows:
+                if total <= limit:
+                    break
+                to_evict.append(ad_id)
+                total -= size
+
+        for ad_id in to_evict:
+            try:
+                os.remove(self.path(ad_id))
+            except FileNotFoundError:
+                pass
+
+        with self.lock, self.connection:
+            self.connection.executemany("UPDATE details SET cached = 0 WHERE ad_id = ?",
+                                        [(ad_id,) for ad_id in to_evict])
+
+        return len(to_evict)
+
+
+class DetailFetcher:
+
+    def __init__(self, config_file_path:str, sleeper:int = 1, headless:bool = True, fetcher:str = None):
+
+        """
+        Fetches the detail pages of listings into the DetailCache of a config. Only ads that were
+        never fetched before are requested, so a 'new listings with details' run costs one
+        request per new ad. The pages are fetched concurrently, under the same 'politeness'
+        limits as the search pages.
+
+        Reads the optional 'details' block of a search config:
+
+            "details": {"enabled": true, "max_age_days": 30, "max_cache_mb": 500}
+
+        'enabled' makes -run fetch the details of the new links at the end of a run,
+        generic_jacker.py -details does it for the last snapshot on demand.
+        """
+
+        self.config_folder_name = os.path.basename(config_file_path).replace('.json', '')
+        self.config_folder_path = os.path.join("page_source_folder", self.config_folder_name)
+
+        with open(config_file_path, 'r') as file:
+            config = json.load(file)
+
+        details = config.get("details", {})
+        self.enabled = details.get("enabled", False)
+
+        # 'auto' decides by the listing cards of a search page, detail pages have none
+        kind = fetcher or details.get("fetcher") or config.get("fetcher", "selenium")
+        lean_browser = config.get("lean_browser")
+        self.fetcher = make_fetcher(
+            "http" if kind == "auto" else kind,
+            headless=headless,
+            selenium_url_patterns=config.get("selenium_url_patterns", []),
+            # a detail page is ready with its DOM, there are no listing cards to wait for
+            lean_browser=dict(lean_browser, wait_selector="body") if lean_browser else None,
+        )
+        self.scheduler = CrawlScheduler.from_config(config, sleeper=sleeper)
+        self.retry = RetryPolicy.from_config(config)
+
+        # created on first use, configs without details get no cache folder
+        self.cache_settings = {"max_age_days": details.get("max_age_days"), "max_cache_mb": details.get("max_cache_mb")}
+        self._cache = None
+
+        self.local = threading.local()
+        self.sessions = []
+        self.sessions_lock = threading.Lock()
+        self.used = False
+
+    @property
+    def cache(self) -> DetailCache:
+        if self._cache is None:
+            self._cache = DetailCache(self.config_folder_path, **self.cache_settings)
+        return self._cache
+
+    def _session(self):
+
+        # one fetcher session per worker thread
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = self.fetcher.session()
+            with self.sessions_lock:
+                self.sessions.append(session)
+
+        return session
+
+    def _fetch_detail(self, ad_id_and_link:tuple) -> bool:
+
+        ad_id, link = ad_id_and_link
+
+        # retried with backoff, one broken listing must not stop the other detail pages
+        result = self.retry.fetch(self._session(), link, self.scheduler.limiter)
+
+        # failed pages are not recorded, the next run tries them again
+        if result.failure is not None:
+            print(f' -- > Failed to retrieve {link} ({result.failure}). Status code: {result.status}')
+            return False
+
+        self.cache.store(ad_id, link, result.page_source)
+        return True
+
+    def fetch_details(self, link_dict:dict) -> dict:
+
+        """
+        :param link_dict: Dictionary with features as keys and lists of links as values.
+        :return: Dictionary with the ad ids of the links as keys and the paths of their cached
+                 detail pages as values (None for failed or evicted pages).
+        """
+
+        links = {}
+        for feature_links in link_dict.values():
+            for link in feature_links:
+                links.setdefault(ad_id_from_link(link), link)
+
+        already_fetched = self.cache.fetched_ad_ids(links)
+        to_fetch = [(ad_id, link) for ad_id, link in links.items() if ad_id not in already_fetched]
+
+        print(f"\n --- Detail pages: {len(links)} listings, {len(already_fetched)} already fetched, "
+              f"{len(to_fetch)} to fetch --- \n")
+
+        self.used = True
+        start = time.time()
+        try:
+            fetched = self.scheduler.map(self._fetch_detail, to_fetch)
+        finally:
+            for session in self.sessions:
+                session.release()
+            self.sessions = []
+            self.local = threading.local()
+
+        print(f" ---> {sum(fetched)} detail pages fetched, {len(fetched) - sum(fetched)} failed.")
+        self.scheduler.print_report(time.time() - start)
+
+        evicted = self.cache.evict()
+        if evicted:
+            print(f" ---> {evicted} old detail pages evicted from the cache.")
+
+        return {ad_id: (self.cache.path(ad_id) if os.path.isfile(self.cache.path(ad_id)) else None)
+                for ad_id in links}
+
+    def close(self) -> None:
+        # only report on a fetcher that fetched something
+        if self.used:
+            self.fetcher.close()
+        if self._cache is not None:
+            self._cache.close()
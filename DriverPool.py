@@ -0,0 +1,242 @@
+import json, threading, time
+from urllib.parse import quote
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.firefox.options import Options
+
+
+# requests the lean browser sends nowhere: heavy files and the usual ad / tracking hosts.
+# Firefox hands https urls to the proxy script without their path, so the file patterns only
+# catch plain http; images and fonts are switched off by preferences anyway.
+LEAN_BLOCK_PATTERNS = [
+    "*.jpg*", "*.jpeg*", "*.png*", "*.gif*", "*.webp*", "*.svg*", "*.woff*", "*.ttf*", "*.mp4*", "*.webm*",
+    "*doubleclick.net*", "*googlesyndication.com*", "*googletagmanager.com*", "*google-analytics.com*",
+    "*facebook.net*", "*hotjar.com*", "*criteo.*", "*adservice.*",
+]
+
+
+def blocking_pac(patterns:list) -> str:
+
+    """
+    Proxy auto-config script that sends every url matching one of the shell patterns to a dead
+    local port (the request fails at once) and everything else direct.
+    """
+
+    conditions = " || ".join(f"shExpMatch(url, {json.dumps(pattern)})" for pattern in patterns) or "false"
+
+    return ("function FindProxyForURL(url, host) { "
+            f"if ({conditions}) return \"PROXY 127.0.0.1:9\"; "
+            "return \"DIRECT\"; }")
+
+
+class DriverPool:
+
+    def __init__(self, headless:bool = True, max_pages_per_driver:int = 200, lean:dict = None):
+
+        """
+        This class hands out warm Firefox sessions, so that a browser is not started for every
+        feature link. Sessions are reset between features and recycled after
+        max_pages_per_driver page loads or after a crash.
+
+        functions:
+
+        acquire() - returns an idle driver or starts a new one.
+        release() - resets a driver and puts it back into the pool.
+        discard() - quits a driver that crashed, the next acquire() starts a fresh one.
+        count_page() - counts a page load, recycles the driver once it served enough pages.
+        is_lean_sample() - True for every sample_every-th lean page of the run.
+        close() - quits all drivers and prints the startup report.
+
+        lean - settings of the lean browser ('lean_browser' config block, see SeleniumSession),
+        None for a default Firefox. A lean browser returns from get() once the DOM is ready
+        (eager page load), loads no images, fonts or autoplay media, and blocks the urls of
+        lean['block_patterns'] (default LEAN_BLOCK_PATTERNS) with a proxy auto-config script.
+        """
+
+        self.headless = headless
+        self.max_pages_per_driver = max_pages_per_driver
+        self.lean = lean
+
+        self.idle_drivers = []
+        self.page_counts = {}  # driver -> number of pages loaded with it
+        self.lock = threading.Lock()
+
+        # startup statistics, used for the report at the end of a run
+        self.launches = 0
+        self.reuses = 0
+        self.recycles = 0
+        self.crashes = 0
+        self.startup_seconds = 0.0
+
+        # lean browser statistics: pages, seconds until the listings were there, bytes
+        # transferred, and the time not spent waiting for the load event (sampled pages)
+        self.lean_pages = 0
+        self.lean_loads = 0  # lean pages started, over all sessions, for the sampling
+        self.lean_ready_seconds = 0.0
+        self.lean_bytes = 0
+        self.lean_samples = 0
+        self.lean_saved_seconds = 0.0
+
+
+    def _launch(self) -> webdriver.Firefox:
+
+        options = Options()
+        if self.headless == True:
+            options.add_argument("--headless")
+
+        if self.lean is not None:
+            options.page_load_strategy = "eager"
+            options.set_preference("permissions.default.image", 2)
+            options.set_preference("browser.display.use_document_fonts", 0)
+            options.set_preference("media.autoplay.default", 5)
+            options.set_preference("media.preload.default", 0)
+            options.set_preference("network.proxy.type", 2)
+            options.set_preference("network.proxy.autoconfig_url", "data:text/javascript," + quote(
+                blocking_pac(self.lean.get("block_patterns", LEAN_BLOCK_PATTERNS))))
+
+        start = time.perf_counter()
+        driver = webdriver.Firefox(options=options)
+
+        with self.lock:
+            self.launches += 1
+            self.startup_seconds += time.perf_counter() - start
+            self.page_counts[driver] = 0
+
+        return driver
+
+
+    def _quit(self, driver) -> None:
+
+        with self.lock:
+            self.page_counts.pop(driver, None)
+        try:
+            driver.quit()
+        except WebDriverException:
+            # the session is already gone, nothing left to clean up
+            pass
+
+
+    def acquire(self) -> webdriver.Firefox:
+
+        with self.lock:
+            if self.idle_drivers:
+                self.reuses += 1
+                return self.idle_drivers.pop()
+
+        return self._launch()
+
+
+    def release(self, driver) -> None:
+
+        """
+        Resets the session (cookies, current page) so the next feature starts from a clean state.
+        If the reset fails the session is treated as crashed.
+        """
+
+        with self.lock:
+            worn_out = self.page_counts.get(driver, 0) >= self.max_pages_per_driver
+            if worn_out:
+                self.recycles += 1
+
+        if worn_out:
+            self._quit(driver)
+            return
+
+        try:
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+        except WebDriverException:
+            self.discard(driver)
+            return
+
+        with self.lock:
+            self.idle_drivers.append(driver)
+
+
+    def discard(self, driver) -> None:
+
+        with self.lock:
+            self.crashes += 1
+        self._quit(driver)
+
+
+    def count_page(self, driver) -> webdriver.Firefox:
+
+        """
+        Call this after every page load. Returns the driver to keep using, which is a fresh one
+        if the old one reached max_pages_per_driver.
+        """
+
+        with self.lock:
+            self.page_counts[driver] = self.page_counts.get(driver, 0) + 1
+            worn_out = self.page_counts[driver] >= self.max_pages_per_driver
+
+            if worn_out:
+                self.recycles += 1
+
+        if not worn_out:
+            return driver
+
+        self._quit(driver)
+        return self._launch()
+
+
+    def is_lean_sample(self, sample_every:int) -> bool:
+
+        # counted here and not per session: a session only lives for one feature
+        with self.lock:
+            self.lean_loads += 1
+            return bool(sample_every) and self.lean_loads % sample_every == 0
+
+
+    def record_lean_page(self, ready_seconds:float, transferred_bytes:int, saved_seconds:float = None) -> None:
+
+        with self.lock:
+            self.lean_pages += 1
+            self.lean_ready_seconds += ready_seconds
+            self.lean_bytes += transferred_bytes
+            if saved_seconds is not None:
+                self.lean_samples += 1
+                self.lean_saved_seconds += saved_seconds
+
+
+    def saved_startup_seconds(self) -> float:
+
+        # every reuse would have cost one (average) cold start
+        if self.launches == 0:
+            return 0.0
+        return self.reuses * self.startup_seconds / self.launches
+
+
+    def close(self) -> None:
+
+        with self.lock:
+            drivers = self.idle_drivers
+            self.idle_drivers = []
+
+        for driver in drivers:
+            self._quit(driver)
+
+        self.print_report()
+
+
+    def print_report(self) -> None:
+
+        avg_startup = self.startup_seconds / self.launches if self.launches else 0.0
+
+        print(
+            f"\n --- Driver pool: {self.launches} browser launches "
+            f"(avg. {avg_startup:.2f}s), {self.reuses} reuses, {self.recycles} recycles, "
+            f"{self.crashes} crashes.\n"
+            f" ---> Startup time saved this run: ~{self.saved_startup_seconds():.1f}s\n"
+        )
+
+        if self.lean_pages:
+            saved_per_page = self.lean_saved_seconds / self.lean_samples if self.lean_samples else 0.0
+            print(
+                f" --- Lean browser: {self.lean_pages} pages, avg. {self.lean_ready_seconds / self.lean_pages:.2f}s "
+                f"until the listings were there, avg. {self.lean_bytes / self.lean_pages / 1024:.0f} KiB per page.\n"
+                f" ---> Not waiting for the load event saved ~{saved_per_page:.2f}s per page "
+                f"(measured on {self.lean_samples} pages), ~{saved_per_page * self.lean_pages:.1f}s this run.\n"
+            )
@@ -0,0 +1,211 @@
+import gzip, hashlib, random, sys, threading, time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from PageFetcher import NO_RESULTS_MARKER
+
+
+class FakeListingSite:
+
+    def __init__(self, listings_per_feature:int = 60, page_size:int = 20, port:int = 0,
+                 past_last_page:str = "reloop", show_total:bool = True, show_next_link:bool = True,
+                 latency:float = 0.0, latency_jitter:float = 0.0, error_rate:float = 0.0,
+                 max_requests_per_second:float = None):
+
+        """
+        Local stand-in for the listing site, used to try out fetchers and the pagination loop
+        without touching the real server.
+
+        Every path + query (without 'pag=') is a feature with listings_per_feature deterministic
+        listings, served page_size at a time as <li data-adid> cards. Like the real site, asking
+        for a page after the last one redirects back to page 1 (the url without 'pag='), and a
+        feature without listings shows the 'no results' marker. Paths containing 'empty' have
+        no listings.
+
+        past_last_page = "repeat" serves the last page again instead of the redirect. Pages show
+        the total number of results ("<n> anunțuri", show_total) and a rel="next" link on all but
+        the last page (show_next_link), so every pagination strategy can be tried.
+
+        latency (+ up to latency_jitter) seconds are added to every response, like a remote
+        server. add_listings() puts new listings on top of every feature, as between two runs
+        on the real site.
+
+        Failures to test retries and rate control: error_rate is the share of requests answered
+        with a 500, and above max_requests_per_second (counted over the last second) requests
+        get a 429 with "Retry-After: 1".
+
+        Usage:
+            site = FakeListingSite().start()
+            ... fetch site.base_url + "/apartamente-1-camera/?area=centru" ...
+            site.stop()
+        """
+
+        self.listings_per_feature = listings_per_feature
+        self.page_size = page_size
+        self.past_last_page = past_last_page
+        self.show_total = show_total
+        self.show_next_link = show_next_link
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.new_listings = 0  # listings added on top since the start, see add_listings()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.served = deque()  # times of the requests of the last second that were not throttled
+        self.lock = threading.Lock()
+
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            # keep-alive, so connection pooling can be observed
+            protocol_version = "HTTP/1.1"
+            # headers and body are separate writes, with Nagle every response waits for a delayed ack
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with site.lock:
+                    site.requests += 1
+                site.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_listings(self, count:int) -> None:
+        # the newest listings come first, the others move down (and the oldest off the last page)
+        self.new_listings += count
+
+    def listing_count(self, feature:str) -> int:
+        return 0 if "empty" in feature else self.listings_per_feature
+
+    def ad_id(self, feature:str, index:int) -> int:
+        digest = hashlib.blake2b(f"{feature}#{index}".encode(), digest_size=6).digest()
+        return int.from_bytes(digest, "big")
+
+    def render_listing(self, feature:str, index:int) -> str:
+        # a listing keeps its ad id and text when new ones push it down
+        number = index - self.new_listings
+        ad_id = self.ad_id(feature, number)
+        return (
+            f'<li data-adid="{ad_id}" class="card">'
+            f'<a href="{self.base_url}/anunt/apartament-{number}-ID{ad_id}.html">Apartament {number}</a>'
+            f'<span class="price">{300 + number % 200} €</span>'
+            f'<span class="surface">{30 + number % 40} mp</span>'
+            f'<span class="rooms">{1 + number % 4} camere</span>'
+            f'</li>'
+        )
+
+    def page_count(self, feature:str) -> int:
+        return max(1, -(-self.listing_count(feature) // self.page_size))
+
+    def render_page(self, feature:str, page:int) -> str:
+
+        count = self.listing_count(feature)
+        if count == 0:
+            body = f"<p>{NO_RESULTS_MARKER}</p>"
+        else:
+            first = (page - 1) * self.page_size
+            cards = "".join(self.render_listing(feature, i) for i in range(first, min(first + self.page_size, count)))
+            body = f'<ul class="results">{cards}</ul>'
+
+            if self.show_total:
+                body = f'<h1>{count} anunțuri</h1>' + body
+            if self.show_next_link and page < self.page_count(feature):
+                body += f'<a rel="next" href="{feature}&pag={page + 1}">Pagina următoare</a>'
+
+        return f"<html><head><title>Rezultate</title></head><body>{body}</body></html>"
+
+    def send_status(self, request:BaseHTTPRequestHandler, status:int, headers:dict = None) -> None:
+
+        # a response without a body
+        request.send_response(status)
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.send_header("Content-Length", "0")
+        request.end_headers()
+
+    def handle(self, request:BaseHTTPRequestHandler) -> None:
+
+        parts = urlsplit(request.path)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        page = int(dict(query).get("pag", 1))
+        query = [(key, value) for key, value in query if key != "pag"]
+        feature = parts.path + "?" + urlencode(query)
+
+        if self.max_requests_per_second is not None:
+            with self.lock:
+                now = time.monotonic()
+                while self.served and self.served[0] < now - 1:
+                    self.served.popleft()
+                throttled = len(self.served) >= self.max_requests_per_second
+                if throttled:
+                    self.throttled += 1
+                else:
+                    self.served.append(now)
+
+            if throttled:
+                self.send_status(request, 429, {"Retry-After": "1"})
+                return
+
+        if self.latency or self.latency_jitter:
+            time.sleep(self.latency + random.uniform(0, self.latency_jitter))
+
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            self.send_status(request, 500)
+            return
+
+        page_count = self.page_count(feature)
+        if page > page_count and self.past_last_page == "repeat":
+            page = page_count
+
+        elif page > page_count:
+            # same as the real site: past the last page we are sent back to page 1
+            self.send_status(request, 302, {"Location": parts.path + ("?" + urlencode(query) if query else "")})
+            return
+
+        body = self.render_page(feature, page).encode("utf-8")
+
+        request.send_response(200)
+        request.send_header("Content-Type", "text/html; charset=utf-8")
+        request.send_header("Set-Cookie", "session=fake; Path=/")
+        if "gzip" in (request.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body)
+            request.send_header("Content-Encoding", "gzip")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+if __name__ == "__main__":
+
+    # python FakeListingSite.py [port]  - serve the fake site until ctrl+c
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    site = FakeListingSite(port=port)
+    print(f"Fake listing site running on {site.base_url}")
+    try:
+        site.server.serve_forever()
+    except KeyboardInterrupt:
+        site.stop()
@@ -1,13 +1,168 @@
-import json, os, time
+import glob, json, os, threading, time
 
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.firefox.options import Options
+from ConfigExpander import ConfigExpander
+from CrawlScheduler import CrawlScheduler
+from CrawlTrace import CrawlTrace, trace_path
+from ListingExtractor import extract_links, extract_links_from_files
+from PageFetcher import NO_RESULTS_MARKER, RetryPolicy, make_fetcher
+from Paginator import AD_ID_ATTRIBUTE, PagePrefetcher, Paginator
+from RunJournal import RunJournal, journal_path, resumable_folder
+from SeenIndex import ad_id_from_link, snapshot_folders
+from SnapshotSidecar import write_sidecar
+from SnapshotStore import SnapshotStore, page_source_files, page_source_name
+
+
+# a feature with more pages is split into <feat_mods>-partN.html files
+PAGES_PER_PART = 25
+
+
+class PageSourceWriter:
+
+    def __init__(self, output_folder:str, feat_mods:str, streaming:bool = False, save_html:bool = True):
+
+        """
+        Writes the pages of one feature to <feat_mods>.html, or, once the feature has more than
+        PAGES_PER_PART - 1 pages, to <feat_mods>-part1.html (pages 1-24), -part2.html (25-49) ...
+
+        In streaming mode every page is written to disk as soon as it arrives and nothing is kept
+        in memory; otherwise the pages of the current part are buffered and written together.
+        With save_html = False no files are written at all (streaming mode only needs the links).
+        """
+
+        self.output_folder = output_folder
+        self.feat_mods = feat_mods
+        self.streaming = streaming
+        self.save_html = save_html
+
+        self.part_mode = False
+        self.part_counter = 1
+        self.page_counter = 0
+
+        self.buffered_pages = []
+        self.file = None
+        self.links = {}  # part name -> links found on its pages (streaming mode)
+        self.paths = []
+
+    def part_name(self) -> str:
+        if self.part_mode:
+            return f'{self.feat_mods}-part{self.part_counter}'
+        return self.feat_mods
+
+    def part_path(self) -> str:
+        return os.path.join(self.output_folder, self.part_name() + '.html')
+
+    def add_page(self, page_source:str, links:list = None) -> None:
+
+        self.page_counter += 1
+
+        if links is not None:
+            self.links.setdefault(self.part_name(), []).extend(links)
+
+        if self.save_html:
+            if self.streaming:
+                if self.file is None:
+                    self.file = open(self.part_path(), 'w')
+                self.file.write(page_source)
+            else:
+                self.buffered_pages.append(page_source)
+
+        # the first part ends after page 24, all other parts are 25 pages long
+        if (self.page_counter + 1) % PAGES_PER_PART == 0:
+            self._start_next_part()
+
+    def _start_next_part(self) -> None:
+
+        if not self.part_mode:
+            # we only learn now that the feature needs parts, the pages so far become part 1
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                os.rename(os.path.join(self.output_folder, self.feat_mods + '.html'), self.part_path_for(1))
+                self.paths.append(self.part_path_for(1))
+            if self.feat_mods in self.links:
+                self.links[f'{self.feat_mods}-part1'] = self.links.pop(self.feat_mods)
+            self.part_mode = True
+
+        self._flush()
+        self.part_counter += 1
+
+    def part_path_for(self, part_counter:int) -> str:
+        return os.path.join(self.output_folder, f'{self.feat_mods}-part{part_counter}.html')
+
+    def _flush(self) -> None:
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            if self.part_path() not in self.paths:
+                self.paths.append(self.part_path())
+
+        elif self.buffered_pages:
+            with open(self.part_path(), 'w') as f:
+                f.write(''.join(self.buffered_pages))
+            self.paths.append(self.part_path())
+            self.buffered_pages = []
+
+    def state(self) -> dict:
+
+        """
+        Checkpoint for the RunJournal: which part is being written and how many bytes of its
+        file are complete. Only meaningful in streaming mode, where every page is on disk.
+        """
+
+        offset = None
+        if self.file is not None:
+            self.file.flush()
+            offset = self.file.tell()
+
+        return {"part_mode": self.part_mode, "part_counter": self.part_counter, "page_counter": self.page_counter,
+                "paths": list(self.paths), "file": self.part_path() if self.file is not None else None,
+                "offset": offset}
+
+    def restore(self, state:dict, page_links:list = None) -> None:
+
+        """
+        Continues a feature of an interrupted run from a state() checkpoint. Whatever was written
+        to the current part after the checkpoint is cut off.
+
+        :param page_links: [(part name, links), ...] of the checkpointed pages (streaming mode).
+        """
+
+        self.part_mode = state["part_mode"]
+        self.part_counter = state["part_counter"]
+        self.page_counter = state["page_counter"]
+        self.paths = list(state["paths"])
+
+        if state["file"] is not None:
+            # interrupted while the pages so far were being renamed to part 1
+            if not os.path.isfile(state["file"]) and os.path.isfile(self.part_path_for(1)):
+                os.rename(self.part_path_for(1), state["file"])
+            with open(state["file"], 'r+b') as f:
+                f.truncate(state["offset"])
+            self.file = open(state["file"], 'a')
+
+        for part_name, links in page_links or []:
+            self.links.setdefault(part_name, []).extend(links)
+
+        # pages 1-24 were logged before the feature turned into parts
+        if self.part_mode and self.feat_mods in self.links:
+            self.links[f'{self.feat_mods}-part1'] = self.links.pop(self.feat_mods)
+
+    def close(self) -> list[str]:
+
+        """
+        Writes what is left and returns the paths of all files of this feature.
+        """
+
+        self._flush()
+        return self.paths
 
 
 class FeatPageScraper:
 
-    def __init__(self, config_file_path:str, sleeper:int = 1, headless:bool = True, testing:bool = False):
+    def __init__(self, config_file_path:str, sleeper:int = 1, headless:bool = True, testing:bool = False,
+                 max_pages_per_driver:int = 200, fetcher:str = None, streaming:bool = None,
+                 extractor:str = None, parse_workers:int = None):
         
         self.config_file_path = config_file_path
         self.config_folder_name = (os.path.basename(config_file_path)).replace('.json', '')
@@ -17,6 +172,73 @@ class FeatPageScraper:
         self.testing = testing
         self.headless = headless
         self.sleeper = sleeper # time to wait between page loads in seconds,
+
+        with open(config_file_path, 'r') as file:
+            config = json.load(file)
+
+        # fetcher backend: 'selenium' (default), 'http' or 'auto' (http with selenium fallback),
+        # the argument overrides the 'fetcher' key of the config
+        self.fetcher = make_fetcher(
+            fetcher or config.get("fetcher", "selenium"),
+            headless=headless,
+            max_pages_per_driver=max_pages_per_driver,
+            selenium_url_patterns=config.get("selenium_url_patterns", []),
+            lean_browser=config.get("lean_browser"),
+        )
+
+        # runs several features at once under a per-host rate limit ('politeness' config key),
+        # without that key: one feature at a time, at most one request per sleeper seconds
+        self.scheduler = CrawlScheduler.from_config(config, sleeper=sleeper)
+
+        # failed pages are retried with jittered exponential backoff ('retry' config key)
+        self.retry = RetryPolicy.from_config(config)
+
+        # pagination: page count / next link / repeated content detection and prefetching
+        self.paginator = Paginator.from_config(config)
+
+        # streaming mode: links are extracted from every page as it arrives, pages are written
+        # straight to disk (or not at all with "save_page_sources": false) and html files are not
+        # parsed a second time in get_links_from_html_folder
+        self.streaming = config.get("streaming", False) if streaming is None else streaming
+        self.save_page_sources = config.get("save_page_sources", True)
+        self.links_log_lock = threading.Lock()
+
+        # link extraction backend: 'bs4' (default), 'lxml' or 'stream', see ListingExtractor
+        self.extractor = extractor or config.get("extractor", "bs4")
+
+        # process pool for parsing the html files, 1 = no pool, 0 = one process per cpu core
+        self.parse_workers = config.get("parse_workers", 1) if parse_workers is None else parse_workers
+        self.parse_chunksize = config.get("parse_chunksize", 1)
+
+        # incremental mode: stop paginating a feature once its pages only contain listings that
+        # were already in the last snapshot(s), see known_ad_ids()
+        incremental = config.get("incremental", {})
+        self.incremental = incremental.get("enabled", False)
+        self.incremental_lookback = incremental.get("lookback_snapshots", 1)  # snapshots to compare with
+        self.incremental_threshold = incremental.get("known_threshold", 1.0)  # share of known ads on a page
+        self.incremental_known_pages = incremental.get("stop_after_known_pages", 1)  # K known pages in a row
+        self.incremental_min_pages = incremental.get("min_pages", 1)  # safety depth, always fetched
+        self.previous_ad_ids = None  # snapshot key -> set of ad ids, loaded on first use
+        self.previous_ad_ids_lock = threading.Lock()
+
+        # checkpoints: every saved page is recorded in <yyyy-mm-dd-hh>.journal, an interrupted run
+        # is resumed by the next -run instead of being deleted and started over
+        self.checkpoints = config.get("checkpoints", True)
+        self.journal = None
+        self.failed_features = []
+
+        # the watch daemon hands in a warm fetcher that has to stay open after the run
+        self.close_fetcher = True
+
+        # timings, bytes, pages and listings of the run in <yyyy-mm-dd-hh>.trace.jsonl, see CrawlTrace
+        self.tracing = config.get("trace", True)
+        self.trace = CrawlTrace()
+        self.expand_seconds = 0.0
+
+        # the .html files of a finished snapshot are moved into the compressed, deduplicated
+        # page_source_folder/<config>/objects/ store ('snapshot_store' config key), see SnapshotStore
+        self.store_pages = config.get("snapshot_store", {}).get("enabled", True)
+        self.store = SnapshotStore.from_config(self.config_folder_path, config)
         
         # feat links are the links which are generated from the config file
         self.feat_links = []  
@@ -29,6 +251,9 @@ class FeatPageScraper:
         """
         This function generates the links from the config file.
 
+        The expansion is done lazily by ConfigExpander: canonical urls, duplicate combinations
+        removed, no intermediate lists. The number of feature urls is printed before crawling.
+
         :param config_file_path: Path to the config file.
         :return: List of links.
         """
@@ -37,216 +262,414 @@ class FeatPageScraper:
         with open(self.config_file_path, 'r') as file:
             data = json.load(file)
 
-        base_link = data['base_link']
-        link_mods = data['link_mods']
-        spec_mods = data['spec_mods']
+        start = time.perf_counter()
+        expander = ConfigExpander(data)
+        self.feat_links = list(expander)
+        self.expand_seconds = time.perf_counter() - start
 
-        # Generate initial links (without special mods like area, price, commercial, etc.)
-        self.feat_links = [base_link + link_mod for link_mod in link_mods]
-        
-        # Iterate over all the spec_mods -> e.g. start with area [unirii, centru etc.]
-        for recur, apply_to_dict in spec_mods.items():
-            links_lv2 = []
-            leftover_yet_relevant_links = []
-
-            for link in self.feat_links:
-                # Apply global mods
-
-                for mod in apply_to_dict.get("apply_to_all", []):
-                    links_lv2.append(link + recur + mod)
-
-                # Apply specific mods
-                for link_mod, mods in apply_to_dict.items():
-                    if link_mod != "apply_to_all" and link_mod in link:
-                        for mod in mods:
-                            links_lv2.append(link + recur + mod)
-
-            
-            # if one of the link mods is not targeted in a spec mod at all, it will not be added to links_lv2
-            # in that case we need to add it to leftover_yet_relevant_links
-            for feat_link in self.feat_links:
-                if not any(x for x in links_lv2 if feat_link in x):
-                    leftover_yet_relevant_links.append(feat_link)
-
-            self.feat_links = links_lv2 + leftover_yet_relevant_links
-
-        self.feat_links = [link.replace("/&","/?") for link in self.feat_links]
+        print(f"\n --- {expander.expanded} feature URLs to crawl "
+              f"({expander.duplicates} duplicate combinations removed) --- \n")
         
         return self.feat_links
 
 
 
-    def scrape_and_save_search_sources(self) -> list[str]:
+    def start_snapshot(self) -> str:
 
         """
-        This function scrapes the page sources from the links generated from the config file.
-
-        :param feat_links: List of links to scrape.
-        :param sleeper: Time to sleep between requests.
-        :return: List of paths to folders that contain the page sources.
+        Creates the snapshot folder of this run (page_source_folder/<config>/<yyyy-mm-dd-hh>), or
+        picks up the folder of an interrupted run, and opens its journal.
 
+        :return: Path of the snapshot folder, None if this config already ran this hour.
         """
 
         # save ymdh to a variable
         ymdh = time.strftime("%Y-%m-%d-%H")
 
-        # make a subfolder with this ymdh variable as name
+        # make a subfolder with this ymdh variable as name, or continue an interrupted run
         output_folder = os.path.join(self.config_folder_path, ymdh)
-        try:
-            os.makedirs(output_folder)
-        except FileExistsError:
-            print(
-                f"\n --- Error: folder already exists. This means that the this particular config" 
-                " has already been run in the last hour. \n - If "
-                "you want to run it again, please wait until the next hour. Be gentle to the server. \n"
-            )
-
-            if not self.testing:
-                return
-            print('---> WE ARE TESTING, so we will continue...')
+        interrupted_folder = resumable_folder(self.config_folder_path) if self.checkpoints else None
+
+        if interrupted_folder is not None:
+            output_folder = interrupted_folder
+            print(f"\n --- Resuming the interrupted run {output_folder} --- \n")
+        else:
+            try:
+                os.makedirs(output_folder)
+            except FileExistsError:
+                print(
+                    f"\n --- Error: folder already exists. This means that the this particular config" 
+                    " has already been run in the last hour. \n - If "
+                    "you want to run it again, please wait until the next hour. Be gentle to the server. \n"
+                )
+
+                if not self.testing:
+                    return None
+                print('---> WE ARE TESTING, so we will continue...')
     
         self.current_config_folder_path = output_folder
+        self.journal = RunJournal(output_folder) if self.checkpoints else None
+        self.failed_features = []
 
+        if self.tracing:
+            self.trace = CrawlTrace(trace_path(output_folder))
+            self.trace.event("expand", seconds=round(self.expand_seconds, 4), feature_urls=len(self.feat_links))
 
-        def save_page_source(feat_url:str, sleeper:int) -> str:
+        return output_folder
 
-            feat_mods = feat_url.replace("area=","").replace("commercial=","commercial-").replace("?","")
-            
-            feat_mods = feat_mods.replace("//","/").split('/')[2:]
-            feat_mods = '-'.join(feat_mods)
 
-            # after reaching the final page for a feat link, we are sent back to the 1st page,
-            # so we need to check if we are on the 1st page again, if so, break the loop
-            reloop_breaker = 0
+    def feat_mods(self, feat_url:str) -> str:
 
-            page_counter = 2 # we start from pag=2, since page 1 does not contain "pag=1" 
-            
-            # part_mode is used when we have more than 25 pages for a given Feature
-            part_mode = 0
-            part_counter = 1
-
-            print_page_counter = 1 # only used for printing
-
-            # Add the path to the geckodriver executable to the system's PATH environment variable
-            #os.environ['PATH'] += os.pathsep + '/path/to/geckodriver'
-
-            # Set up the Firefox driver
-            all_page_sources = ""
-            options = Options()
-            options.add_argument("--headless")
-            if self.headless == True:
-                driver = webdriver.Firefox(options=options)
-            else: 
-                driver = webdriver.Firefox()
-
-            print(f'Checking pages...')
-            while True:
-                
+        # name of the html files (and .json keys) of a feature url
+        feat_mods = feat_url.replace("area=","").replace("commercial=","commercial-").replace("?","")
+        
+        feat_mods = feat_mods.replace("//","/").split('/')[2:]
+        return '-'.join(feat_mods)
+
+
+    def save_page_source(self, feat_url:str) -> list[str]:
+
+        """
+        Fetches all pages of one feature url into the snapshot folder of this run.
+
+        :return: Paths of the html files of the feature, None if it has no results or failed.
+        """
+
+        output_folder = self.current_config_folder_path
+        feat_mods = self.feat_mods(feat_url)
+
+        # decides which pages exist: page count, next link, repeated content or, as a
+        # fallback, the redirect back to the 1st page after the last page
+        paginator = self.paginator
+        last_page = None
+        first_fingerprint = previous_fingerprint = None
+        prefetcher = None
+
+        page = 1
+
+        # incremental mode: ad ids this feature had in the last snapshot(s), and the number of
+        # pages in a row that contained nothing new
+        known = self.known_ad_ids(feat_mods) if self.incremental else set()
+        known_pages_in_a_row = 0
+
+        journal = self.journal
+        journal_state, journal_entry = journal.feature_state(feat_url) if journal else (None, None)
+
+        if journal_state == "done":
+            print(f"--> Already scraped before the interruption. Moving on... ")
+            for part_name, links in journal_entry["links"].items():
+                self.link_dict[part_name] = links
+            return journal_entry["paths"]
+
+        # takes care of the <feat_mods>.html / -partN.html files; with checkpoints every page is
+        # written to disk right away, so the journal can point at it
+        writer = PageSourceWriter(output_folder, feat_mods, streaming=self.streaming or journal is not None,
+                                  save_html=self.save_page_sources or not self.streaming)
+
+        if journal_state == "partial":
+            writer.restore(journal_entry["writer"], journal.page_links.get(feat_url))
+            page = journal_entry["page"] + 1
+            last_page = journal_entry["last_page"]
+            first_fingerprint = journal_entry["first_fingerprint"]
+            previous_fingerprint = journal_entry["fingerprint"]
+            known_pages_in_a_row = journal_entry["known_pages_in_a_row"]
+            print(f"--> Resuming after page {journal_entry['page']} ")
+
+            if last_page is not None and last_page > page and paginator.prefetch_pages > 0:
+                prefetcher = PagePrefetcher(self.fetcher, self.scheduler.limiter, paginator.prefetch_pages, self.retry)
+
+        # Add the path to the geckodriver executable to the system's PATH environment variable
+        #os.environ['PATH'] += os.pathsep + '/path/to/geckodriver'
+
+        # Open a fetcher session (a warm browser or the shared http connections)
+        session = self.fetcher.session()
+
+        print(f'Checking pages...')
+        stop = None  # why the feature ended, for the trace
+        while True:
+
+            # a resumed feature can already be past its last page
+            if last_page is not None and page > last_page:
+                stop = "last_page"
+                break
+
+            page_url = paginator.page_url(feat_url, page)
+
+            fetch_start = time.perf_counter()
+            result = prefetcher.take(page) if prefetcher else None
+            prefetched = result is not None
+            if result is None:
+                # be gentle to the server, the limiter spaces out requests to the same host; a
+                # failed page is retried with backoff before the feature is given up
+                result = self.retry.fetch(session, page_url, self.scheduler.limiter, expect_listings=True)
+
+            page_source = result.page_source
+            current_url = result.current_url
+
+            # seconds = waiting for the limiter (or the prefetcher) + fetch_seconds (+ retry backoff)
+            self.trace.event("fetch", seconds=round(time.perf_counter() - fetch_start, 4), feature=feat_mods,
+                             page=page, fetch_seconds=round(result.elapsed, 4), bytes=result.size,
+                             status=result.status, prefetched=prefetched, attempts=result.attempts,
+                             failure=result.failure,
+                             listings=len(AD_ID_ATTRIBUTE.findall(page_source)) if self.trace.enabled else 0)
+
+            # the page still failed after its retries (empty, error page, timeout, throttled)
+            if result.failure is not None:
+                print(f'Error: Failed to retrieve page {page_url} after {result.attempts} attempts '
+                      f'({result.failure}). Status code: {result.status}')
+                # a queue worker gives the feature back to the queue, see QueueCrawl
+                self.failed_features.append(feat_url)
+                if journal:
+                    print(f'Failed attempt. Run -run again to resume from this page.')
+                else:
+                    print(f'Failed attempt. The pages before it are kept, the feature is incomplete.')
+
+                if prefetcher:
+                    prefetcher.close()
+                session.release()
+
+                # the pages fetched so far are not thrown away
+                output_paths = writer.close()
+                for part_name, links in writer.links.items():
+                    self.link_dict[part_name] = links
+
+                self.trace.event("feature", feature=feat_mods, pages=page - 1, stop="failed", failure=result.failure)
+                return output_paths
                 
-                driver.get(feat_url)
-                page_source = driver.page_source
-            
-                # wait for the page to load, be gentle to the server
-                time.sleep(sleeper)
-
-                # check driver.page_source and make an exception if it is empty
-                if page_source == "":
-                    print(f'Error: Failed to retrieve page {feat_url}. Status code: {driver.page_source}')
-                    print(f'Failed attempt. Please delete the folder {output_folder} and try again.')
-                    
-                    driver.quit()
-                    return
-                    
-                    
-                elif "Nu am găsit ceea ce cauți." in page_source:
-                    print("--> No results found. Moving on... ")
-                    # we may wanna ad some token to the page source to indicate that there are no results in scrape folder
-
-                    driver.quit()
-                    return 
                 
+            elif NO_RESULTS_MARKER in page_source:
+                print("--> No results found. Moving on... ")
+                # we may wanna ad some token to the page source to indicate that there are no results in scrape folder
+
+                if prefetcher:
+                    prefetcher.close()
+                writer.close()
+                session.release()
+                if journal:
+                    journal.record_feature(feat_url, None)
+                self.trace.event("feature", feature=feat_mods, pages=0, stop="no_results")
+                return 
+
+            # we are sent back to the 1st page after the last page is reached,
+            # i.e. neither the page count nor a next link told us earlier
+            if paginator.is_reloop(current_url, page):
+                print(
+                    f"\n\n--> Page-Counter-Reloop detected !!!\n" 
+                      "--> i.e. No more listings found for this Feature\n" 
+                      "--> Saving source file. Moving on... "
+                      )
+                stop = "reloop"
+                break
+
+            # same listings as the previous page or page 1: the site repeats itself
+            fingerprint = paginator.fingerprint(page_source)
+            if page > 1 and fingerprint is not None and fingerprint in (first_fingerprint, previous_fingerprint):
+                print(
+                    f"\n\n--> Page {page} repeats an earlier page !!!\n"
+                    "--> i.e. No more listings found for this Feature\n"
+                    "--> Saving source file. Moving on... "
+                )
+                stop = "repeat"
+                break
+
+            print(f' -- > Page {page} retrieved')
+
+            if page == 1:
+                first_fingerprint = fingerprint
+                last_page = paginator.page_count(page_source)
+
+                if last_page is not None and last_page > 1 and paginator.prefetch_pages > 0:
+                    prefetcher = PagePrefetcher(self.fetcher, self.scheduler.limiter, paginator.prefetch_pages, self.retry)
+
+            previous_fingerprint = fingerprint
+
+            if prefetcher:
+                # keep prefetch_pages pages in flight ahead of the current one
+                for next_page in range(page + 1, min(page + paginator.prefetch_pages, last_page) + 1):
+                    prefetcher.submit(next_page, paginator.page_url(feat_url, next_page))
+
+            part_name = writer.part_name()
+            links = None
+
+            if self.streaming:
+                # extract the links right away, the page does not have to be kept around
+                with self.trace.span("parse", feature=feat_mods, page=page) as fields:
+                    links = extract_links(page_source, self.extractor)
+                    fields["links"] = len(links)
+                self.log_page_links(part_name, page, links)
+                with self.trace.span("write", feature=feat_mods, page=page):
+                    writer.add_page(page_source, links)
+            else:
+                with self.trace.span("write", feature=feat_mods, page=page):
+                    writer.add_page(page_source)
+
+            if self.incremental and known:
+                if not self.streaming:
+                    links = extract_links(page_source, self.extractor)
+
+                page_ad_ids = {ad_id_from_link(link) for link in links if link}
+                known_ad_count = len(page_ad_ids & known)
+
+                if page_ad_ids and known_ad_count >= self.incremental_threshold * len(page_ad_ids):
+                    known_pages_in_a_row += 1
                 else:
-                    print(f' -- > Page {print_page_counter} retrieved')
-                    
-                
-                # the 1st url does not have a page number
-                # we are sent back to the 1st page after the last page is reached
-                # so we need to check if we are on the 1st page again, if so, break the loop
-
-                if "pag=" not in driver.current_url:
-                    reloop_breaker += 1
-                    feat_url = feat_url + f'&pag={page_counter}'
-
-                    if reloop_breaker > 1:  
-
-                        # save page source to a file
-                        if part_mode == 1:
-                            #there is a small bug here, i.e. output folder gets 2x featmods - fixed
-                            output_path = output_path.split(feat_mods)[0]
-                            output_path = os.path.join(output_folder, f'{feat_mods}-part{part_counter}.html')
-                        else:
-                            output_path = os.path.join(output_folder, f'{feat_mods}.html')
-
-                        with open(output_path, 'w') as f:
-                            f.write(all_page_sources)
-
-                        print(
-                            f"\n\n--> Page-Counter-Reloop detected !!!\n" 
-                              "--> i.e. No more listings found for this Feature\n" 
-                              "--> Saving source file. Moving on... "
-                              )
-                        break
+                    known_pages_in_a_row = 0
+
+            if journal:
+                # the page is on disk, an interrupted run continues with the next one
+                journal.record_page(feat_url, page, part_name, writer.state(),
+                                    links=links if self.streaming else None,
+                                    last_page=last_page, first_fingerprint=first_fingerprint,
+                                    fingerprint=fingerprint, known_pages_in_a_row=known_pages_in_a_row)
+
+            if self.incremental and known:
+                if (known_pages_in_a_row >= self.incremental_known_pages
+                        and page >= self.incremental_min_pages):
+                    print(
+                        f"\n\n--> {known_pages_in_a_row} page(s) in a row with only known listings !!!\n"
+                        "--> Incremental mode: the rest of this Feature was already scraped before\n"
+                        "--> Saving source file. Moving on... "
+                    )
+                    stop = "incremental"
+                    break
+
+            # the page count or a missing next link tell us this was the last page,
+            # no need to load one more page just to be sent back to the 1st one
+            if (last_page is not None and page >= last_page) or paginator.has_next_page(page_source) is False:
+                print(
+                    f"\n\n--> Last page ({page}) reached\n"
+                    "--> Saving source file. Moving on... "
+                )
+                stop = "last_page"
+                break
                 
-                else: 
-                    # prepare the next page url
-                    feat_url = feat_url.split('&pag')[0] + f'&pag={page_counter}'
+            page += 1
 
-                # save page source to all page sources
-                all_page_sources += page_source
 
-                if page_counter >= 25:
-                    part_mode = 1
+        if prefetcher:
+            prefetcher.close()
 
-                if part_mode == 1 and page_counter % 25 == 0:
+        session.release()
+
+        # save the remaining page sources to a file
+        with self.trace.span("write", feature=feat_mods, page=None):
+            output_paths = writer.close()
+
+        self.trace.event("feature", feature=feat_mods, pages=writer.page_counter, stop=stop)
+
+        for part_name, links in writer.links.items():
+            self.link_dict[part_name] = links
+
+        if journal:
+            journal.record_feature(feat_url, output_paths, writer.links)
+
+        return output_paths
+
+
+    def scrape_and_save_search_sources(self) -> list[str]:
+
+        """
+        This function scrapes the page sources from the links generated from the config file.
+
+        :param feat_links: List of links to scrape.
+        :return: List of paths to folders that contain the page sources.
+
+        """
+
+        if self.start_snapshot() is None:
+            return
 
-                    output_path = os.path.join(output_folder, f'{feat_mods}-part{part_counter}.html')
-                    part_counter += 1
-                
-                    # save page source to a file
-                    with open(output_path, 'w') as f:
-                        f.write(all_page_sources)
-                    
-                    all_page_sources = ""
-                    
-                page_counter += 1
-                print_page_counter += 1
-
-
-            driver.quit()
-            return output_path
-        
         feat_links_len = len(self.feat_links)
-        feat_link_counter = 1
-        
 
-        for feat_link in self.feat_links:
-            
+        def process_feat_link(numbered_feat_link) -> str:
+
+            feat_link_counter, feat_link = numbered_feat_link
+
             print(f" \n\n -----> Processing feature URL {feat_link_counter}/{feat_links_len}\n" 
                   f"Link : {feat_link}\n\n")
             
-            # save page source to a file and append the path to self.page_source_paths
-            page_source_path = save_page_source(feat_link,sleeper=self.sleeper)
+            # save page source to a file
+            page_source_paths = self.save_page_source(feat_link)
 
-            if page_source_path != None:
-                self.page_source_paths.append(page_source_path)
-            
             print(f' -----> Finished processing {feat_link}\n'+"-"*50)
-            
-            feat_link_counter += 1
+
+            return page_source_paths
+
+        start = time.perf_counter()
+        fetcher_stats = self.fetcher.stats()
+
+        # features run concurrently, the paths come back in feat_links order
+        page_source_paths = self.scheduler.map(process_feat_link, enumerate(self.feat_links, start=1))
+
+        for paths in page_source_paths:
+            if paths != None:
+                self.page_source_paths.extend(paths)
+
+        self.scheduler.print_report(time.perf_counter() - start)
+        self.trace_run(time.perf_counter() - start, fetcher_stats)
+
+        # quit warm browsers / close pooled connections and print the fetcher report
+        if self.close_fetcher:
+            self.fetcher.close()
 
         return self.page_source_paths
         
 
+    def trace_run(self, elapsed:float, fetcher_stats_before:dict) -> None:
+
+        # what the fetcher did during this run (a warm fetcher of the watch daemon counts on)
+        fetcher_stats = {key: value - fetcher_stats_before.get(key, 0) for key, value in self.fetcher.stats().items()}
+
+        self.trace.event("run", seconds=round(elapsed, 3), features=len(self.feat_links),
+                         requests=self.scheduler.limiter.requests,
+                         rate_limit_seconds=round(self.scheduler.limiter.seconds_waited, 3),
+                         max_workers=self.scheduler.max_workers, fetcher=fetcher_stats,
+                         page_retries=self.retry.retries, page_failures=self.retry.failures,
+                         rates=self.scheduler.limiter.rates() if self.scheduler.limiter.adaptive else None)
+
+
+    def known_ad_ids(self, feat_mods:str) -> set:
+
+        """
+        Incremental mode: the ad ids a feature had in the last incremental_lookback snapshots,
+        i.e. under the key <feat_mods> or <feat_mods>-partN of their .json files.
+        """
+
+        with self.previous_ad_ids_lock:
+            if self.previous_ad_ids is None:
+                json_files = glob.glob(os.path.join(self.config_folder_path, '*.json'))
+                json_files.sort(key=os.path.getmtime)
+
+                self.previous_ad_ids = {}
+                for json_file in json_files[-self.incremental_lookback:]:
+                    with open(json_file, 'r') as f:
+                        for key, links in json.load(f).items():
+                            self.previous_ad_ids.setdefault(key, set()).update(
+                                ad_id_from_link(link) for link in links if link
+                            )
+
+        known = set()
+        for key, ad_ids in self.previous_ad_ids.items():
+            if key == feat_mods or key.startswith(feat_mods + '-part'):
+                known |= ad_ids
+
+        return known
+
+
+    def log_page_links(self, part_name:str, page:int, links:list) -> None:
+
+        """
+        Streaming mode: appends the links of every page to links.jsonl in the snapshot folder as
+        soon as the page is parsed, so the result of a running scrape can be followed.
+        """
+
+        line = json.dumps({"feature": part_name, "page": page, "links": links})
+
+        with self.links_log_lock:
+            with open(os.path.join(self.current_config_folder_path, "links.jsonl"), 'a') as f:
+                f.write(line + "\n")
+
+
     def get_links_from_html_folder(self) -> dict():
         
         """
@@ -256,39 +679,39 @@ class FeatPageScraper:
         :return: Dictionary with links as values and html filenames (slightly modified) as keys.
         """
 
+        # no snapshot folder: this hour was already run (see scrape_and_save_search_sources), there
+        # is nothing to parse, and a .json path of "" would write '.json' into the working directory
+        if not self.current_config_folder_path:
+            print("\n --- No snapshot folder for this run, no links were extracted. --- \n")
+            return self.link_dict
+
+        # an incomplete run gets no .json, so the next -run resumes it (see RunJournal)
+        if self.failed_features and self.journal:
+            print(f"\n --- {len(self.failed_features)} feature(s) failed, the run is incomplete. "
+                  f"Run -run again to resume it. --- \n")
+            self.journal.close()
+            self.trace.close()
+            return self.link_dict
+
         # self.page_source_paths is a list of paths to folders that contain the page sources
         # this is used to generate the .json link file
         html_files = self.page_source_paths
 
-        def scrape_links_from_page_source(source_file):
-            # Read the HTML content from a file
-                        
-            with open(source_file, 'r') as file:
-                html_content = file.read()
-        
-            # Parse the HTML content
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            # Find all li tags with data-adid attribute
-            li_tags = soup.find_all('li', attrs={'data-adid': True})
-
-            # For each li tag, find the a tag within it and get the href attribute
-            urls = []
-
-            for li in li_tags:
-                a_tag = li.find('a')
-                if a_tag:
-                    url = a_tag.get('href')
-                    urls.append(url)
-
-            return urls
+        if self.streaming:
+            # the links were already extracted page by page during the scrape
+            print(f' \n --- Links were extracted while scraping (streaming mode) --- \n')
+            html_files = []
+        else:
+            print(f' \n --- Getting links from html files which contained results --- \n')
 
-        print(f' \n --- Getting links from html files which contained results --- \n')
         source_len = len(html_files)
         source_count = 1
 
-        for file in html_files:
-            links = scrape_links_from_page_source(file)
+        # the files are spread over self.parse_workers processes, results come back in order
+        with self.trace.span("parse_files", files=len(html_files), workers=self.parse_workers):
+            all_links = extract_links_from_files(html_files, self.extractor, self.parse_workers, self.parse_chunksize)
+
+        for file, links in zip(html_files, all_links):
             filename = file.split('/')[-1].replace('.html', '')  # Get filename without extension as key
             self.link_dict[filename] = links
             print(f" ---> {source_count}/{source_len} --- {len(links)} links found")
@@ -300,12 +723,81 @@ class FeatPageScraper:
 
         # save all_links to json
         all_links_json_file_name = self.current_config_folder_path+".json"
+        self.save_link_json(all_links_json_file_name, self.link_dict)
 
-        if all_links_json_file_name != "":
-            with open(all_links_json_file_name, 'w') as f:
-                json.dump(self.link_dict, f, indent=4)
+        # the snapshot is complete, its checkpoints are not needed any more
+        if self.journal:
+            self.journal.close(remove=True)
+            self.journal = None
 
-        else:
-            print("(Possible) Error: Empty output-json path Please check the code.")
-            
-        return self.link_dict
\ No newline at end of file
+        if self.store_pages:
+            with self.trace.span("pack") as fields:
+                fields.update(self.store.pack_folder(self.current_config_folder_path))
+
+        self.trace.close()
+
+        return self.link_dict
+
+
+    def save_link_json(self, json_path:str, link_dict:dict) -> None:
+
+        # LinkHandler orders the snapshots by mtime, so a re-written json keeps its old mtime
+        old_mtime_ns = os.stat(json_path).st_mtime_ns if os.path.isfile(json_path) else None
+
+        with self.trace.span("save_json", links=sum(len(links) for links in link_dict.values())):
+            with open(json_path, 'w') as f:
+                json.dump(link_dict, f, indent=4)
+
+        if old_mtime_ns is not None:
+            os.utime(json_path, ns=(old_mtime_ns, old_mtime_ns))
+
+        # compact .adids sidecar with the sorted ad keys, used by LinkHandler.timetable_keys
+        write_sidecar(json_path, link_dict)
+
+
+    def reparse_snapshots(self, folders:list = None) -> dict:
+
+        """
+        Re-extracts the links of already scraped snapshot folders (page_source_folder/<config>/<yyyy-mm-dd-hh>/)
+        and re-writes their .json files, without scraping anything. The html files of all
+        snapshots go through one process pool (see parse_workers).
+
+        :param folders: Snapshot folders to re-parse, default: all of this config. Folders that
+                        still have a .journal are skipped.
+        :return: Dictionary with the json paths as keys and the new link dictionaries as values.
+        """
+
+        if folders is None:
+            folders = snapshot_folders(self.config_folder_path)
+
+        # an interrupted (or running) snapshot gets its .json when its run is resumed and finished
+        unfinished = [folder for folder in folders if os.path.isfile(journal_path(folder))]
+        for folder in unfinished:
+            print(f" ---> {folder}: unfinished run, skipped")
+        folders = [folder for folder in folders if folder not in unfinished]
+
+        html_files = {folder: page_source_files(folder) for folder in folders}
+        all_files = [file for files in html_files.values() for file in files]
+
+        print(f"\n --- Re-parsing {len(all_files)} html files from {len(folders)} snapshot(s) "
+              f"of {self.config_folder_name} --- \n")
+
+        all_links = iter(extract_links_from_files(all_files, self.extractor, self.parse_workers, self.parse_chunksize))
+
+        link_dicts = {}
+        for folder, files in html_files.items():
+            if not files:
+                print(f" ---> {folder}: no page sources, skipped")
+                continue
+
+            link_dict = {}
+            for file in files:
+                link_dict[page_source_name(file)] = list(set(next(all_links)))
+
+            json_path = folder + ".json"
+            self.save_link_json(json_path, link_dict)
+            link_dicts[json_path] = link_dict
+
+            print(f" ---> {json_path}: {sum(len(links) for links in link_dict.values())} links")
+
+        return link_dicts
\ No newline at end of file
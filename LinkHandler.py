@@ -1,5 +1,12 @@
 import os, glob, json, time, shutil
-import webbrowser
+
+from CrawlTrace import CrawlTrace, trace_path
+from RunJournal import journal_path, resumable_folder
+from RunSummary import RunSummary
+from SeenIndex import SeenIndex, snapshot_folders, snapshot_name
+
+# webbrowser, RepostDetector / ListingStore (html parsing) and SnapshotSidecar (numpy) are
+# imported where they are used: the query flags answered from the RunSummary start without them
 
 class LinkHandler:
 
@@ -13,6 +20,15 @@ class LinkHandler:
         timetable() - counts the number of links in each .json file, but also the number of links
         that are not in the previous .json file.
 
+        timetable_keys() - the same counts from the .adids sidecars, without reading the json files.
+
+        get_current_diff() - links of the last .json file that were never seen before, answered
+        from the persistent SeenIndex (page_source_folder/<config>/seen_index.sqlite).
+
+        update_summary() - precomputes the timetable, the current diff and its reposts into the
+        RunSummary (page_source_folder/<config>/summary.idx) at the end of a run, the query
+        flags then only read that one file.
+
         """
         
         self.config_file_path = config_file_path
@@ -24,6 +40,20 @@ class LinkHandler:
         self.all_json_files.sort(key=os.path.getmtime)
 
         self.diff_dict = {}
+        self.summary = RunSummary(self.config_folder_path)
+
+        # switched off unless start_trace() is called, e.g. at the end of a -run
+        self.trace = CrawlTrace()
+
+    def start_trace(self) -> None:
+
+        """
+        Appends the timings of this handler to the trace of the newest snapshot
+        (<yyyy-mm-dd-hh>.trace.jsonl, see CrawlTrace).
+        """
+
+        if self.all_json_files:
+            self.trace = CrawlTrace(trace_path(self.all_json_files[-1][:-len('.json')]))
 
 
     def timetable(self) -> dict():
@@ -33,31 +63,120 @@ class LinkHandler:
         and a list of links as coresponding value.
 
         This function countes the number of links in each .json file, but also the number of links 
-        that are not in the previous .json file.
+        that are not in the previous .json file, and the number of links never seen before.
+
+        :return: self.diff_dict with the new links of every .json file.
         '''
+        from SnapshotSidecar import ad_key
+
+        for json_file, diff_keys in self.timetable_keys().items():
+            diff_keys = set(int(key) for key in diff_keys)
+            with open(json_file, 'r') as f:
+                current_links_dict = json.load(f)
+            self.diff_dict[json_file] = list({link for links in current_links_dict.values() for link in links
+                                              if ad_key(link) in diff_keys})
+
+        return self.diff_dict
+
+
+    def timetable_keys(self) -> dict():
+
+        """
+        Prints the same counts as timetable() without reading the json files: they come from the
+        compact .adids sidecar of every snapshot (sorted int64 ad keys, see SnapshotSidecar), so
+        the diffs are sorted-array set operations instead of python sets of url strings. Missing
+        sidecars are built from the json once.
+
+        :return: Dictionary with the .json files as keys and the ad keys that are not in the
+                 previous file as values.
+        """
+
+        from SnapshotSidecar import load_sidecar, count_new, merge_keys, new_keys, np
+
         print("\n\n--- Counting links and computing the diffs from all json files ---\n")
 
-        # initialize previous links as empty
-        prev_links = []
+        # initialize previous keys and the history of all keys as empty
+        prev_keys = np.zeros(0, dtype='<i8') if np is not None else []
+        history_keys = prev_keys
+
+        diff_keys_dict = {}
         for json_file in self.all_json_files:
             
-            with open(json_file, 'r') as f:
-                current_links_dict = json.load(f)
-                # Flatten list of lists, some semantic loss here.
-                current_links = [link for links in current_links_dict.values() for link in links]  
-                
-                diff_links = list(set(current_links) - set(prev_links))
-                print(f" {json_file}  :  {len(current_links)} total links."
-                      f"({len(diff_links)} new links compared to the previous file.)")
+            sidecar = load_sidecar(json_file)
+            current_keys = sidecar.all_keys()
+
+            diff_keys = new_keys(current_keys, prev_keys)
+            never_seen = count_new(current_keys, history_keys)
+
+            print(f" {json_file}  :  {sidecar.link_count} total links."
+                  f"({len(diff_keys)} new links compared to the previous file, {never_seen} never seen before.)")
 
-                self.diff_dict[json_file] = diff_links
+            diff_keys_dict[json_file] = diff_keys
 
-                # set current links to previous links for the next iteration
-                prev_links = current_links
+            # set current keys to previous keys for the next iteration
+            prev_keys = current_keys
+            history_keys = merge_keys(history_keys, current_keys)
         
         print("---> Done computing the diffs from all json files ---\n")
 
-        return self.diff_dict
+        return diff_keys_dict
+
+
+    def print_timetable(self) -> None:
+
+        # the counts of the summary if it is current, otherwise they are computed from the snapshots
+        if not self.summary.is_current(self.all_json_files):
+            self.timetable_keys()
+            return
+
+        print("\n\n--- Counting links and computing the diffs from all json files ---\n")
+
+        for json_file, row in zip(self.all_json_files, self.summary.data["timetable"]):
+            print(f" {json_file}  :  {row['links']} total links."
+                  f"({row['new']} new links compared to the previous file, {row['never_seen']} never seen before.)")
+
+        print("---> Done computing the diffs from all json files ---\n")
+
+
+    def update_summary(self) -> None:
+
+        """
+        Writes the RunSummary of this config. Called at the end of a run, after the seen-listing
+        and repost indexes were updated. Only the timetable rows of new snapshots are counted.
+        """
+
+        from SnapshotSidecar import load_sidecar, new_keys
+
+        if not self.all_json_files:
+            return
+
+        with self.trace.span("links_summary") as fields:
+            cached_rows = self.summary.timetable_rows(self.all_json_files)
+
+            seen_index = SeenIndex(self.config_folder_path)
+            seen_index.update(self.all_json_files)
+            never_seen = seen_index.first_seen_counts()
+            seen_index.close()
+
+            timetable = []
+            for counter, json_file in enumerate(self.all_json_files):
+                name = os.path.basename(json_file)
+                if name in cached_rows:
+                    timetable.append(cached_rows[name])
+                    continue
+
+                sidecar = load_sidecar(json_file)
+                current_keys = sidecar.all_keys()
+                prev_keys = load_sidecar(self.all_json_files[counter - 1]).all_keys() if counter else current_keys[:0]
+
+                timetable.append({"links": sidecar.link_count, "new": len(new_keys(current_keys, prev_keys)),
+                                  "never_seen": never_seen.get(snapshot_name(json_file), 0)})
+                fields["counted"] = fields.get("counted", 0) + 1
+
+            current_diff = self.get_current_diff()
+            reposts = self.get_reposts(current_diff)
+
+            self.summary.save(self.all_json_files, timetable, current_diff, reposts)
 
 
     def open_links(self, link_dict: dict, opening_delay: int = 1) -> None:
@@ -73,6 +192,8 @@ class LinkHandler:
 
         time.sleep(3)
     
+        import webbrowser
+
         for i in range(len(to_open)):
             webbrowser.open(to_open[i])
             time.sleep(opening_delay)
@@ -80,7 +201,10 @@ class LinkHandler:
         
         # count the number of links in the last json file
             
-    def print_links(self, link_dict: dict):
+    def print_links(self, link_dict: dict, reposts: dict = None):
+
+        # reposts maps re-posted links to the earlier listing, see get_reposts()
+        reposts = reposts or {}
         
         counter = 1
         for key, value in link_dict.items():
@@ -91,7 +215,10 @@ class LinkHandler:
 
             else:
                 for link in value:
-                    print(f"{counter} : {link}")
+                    if link in reposts:
+                        print(f"{counter} : {link}   (REPOST of {reposts[link]})")
+                    else:
+                        print(f"{counter} : {link}")
                     counter += 1
             print("*"*50)
 
@@ -105,19 +232,26 @@ class LinkHandler:
 
         This ensures more consistent data, since the json is created at the very end of a scrape run,
         i.e. if the run fails for any reason, the json file will not be created.
+
+        The newest failed run is kept if it has a journal (<yyyy-mm-dd-hh>.journal), it is resumed.
         """
 
         json_files = [os.path.basename(file) for file in self.all_json_files]
         path = os.path.join("page_source_folder", self.config_folder_name)
 
-        list_of_folders = os.listdir(path)
-        
-        if "item_html_files" in list_of_folders:
-            list_of_folders.remove("item_html_files")
+        # only yyyy-mm-dd-hh folders are snapshots, files like seen_index.sqlite and folders shared
+        # by all snapshots (item_html_files/, objects/, listings/) stay where they are
+        list_of_folders = [os.path.basename(folder) for folder in snapshot_folders(path)]
 
 
         list_of_folders = list(set(list_of_folders) - set(json_files) 
                                - set([json_file.replace(".json","") for json_file in json_files]))
+
+        # an interrupted run with a journal is resumed by the next -run, not deleted
+        resumable = resumable_folder(path)
+        if resumable is not None and os.path.basename(resumable) in list_of_folders:
+            print(f"Keeping {resumable}, the next run resumes it.")
+            list_of_folders.remove(os.path.basename(resumable))
         
         
         print("Let's clean up first! \nList of failed-run folders names for this: ",list_of_folders)
@@ -132,6 +266,10 @@ class LinkHandler:
                 
                 # directory will probably not be empty, so we'll use shutil.rmtree
                 shutil.rmtree(folder_path)
+
+                for leftover in (journal_path(folder_path), trace_path(folder_path)):
+                    if os.path.isfile(leftover):
+                        os.remove(leftover)
         else:
             print("No folders deleted.")
 
@@ -155,30 +293,112 @@ class LinkHandler:
         
         return links_dict
     
+    def update_seen_index(self) -> None:
+
+        """
+        Adds all snapshots that are not in the seen-listing index yet. Called at the end of a
+        run, so that the next diff only has to look at the newest snapshot.
+        """
+
+        with self.trace.span("links_seen_index") as fields:
+            seen_index = SeenIndex(self.config_folder_path)
+            added = seen_index.update(self.all_json_files)
+            seen_index.close()
+            fields["snapshots"] = added
+
+        print(f" ---> Seen-listing index updated with {added} snapshot(s).")
+
+
+    def update_repost_index(self) -> None:
+
+        """
+        Fingerprints the listings of all snapshot folders that are not in the repost index yet.
+        Called at the end of a run.
+        """
+
+        from RepostDetector import RepostDetector
+
+        with self.trace.span("links_repost_index") as fields:
+            repost_detector = RepostDetector(self.config_folder_path)
+            added = repost_detector.update(snapshot_folders(self.config_folder_path))
+            repost_detector.close()
+            fields["fingerprints"] = added
+
+        print(f" ---> Repost index updated with {added} listing fingerprint(s).")
+
+
+    def update_listing_store(self) -> None:
+
+        """
+        Adds the structured records (price, surface, rooms ...) of the snapshots that are not in
+        the ListingStore yet, unless the config has "records": {"enabled": false}. Called at
+        the end of a run.
+        """
+
+        from ListingStore import ListingStore
+
+        with open(self.config_file_path, 'r') as file:
+            config = json.load(file)
+        if not config.get("records", {}).get("enabled", True):
+            return
+
+        with self.trace.span("links_listing_store") as fields:
+            listing_store = ListingStore.from_config(self.config_folder_path, config)
+            fields["rows"] = listing_store.update(snapshot_folders(self.config_folder_path))
+
+        print(f" ---> Listing store updated with {fields['rows']} record(s).")
+
+
+    def get_reposts(self, link_dict: dict) -> dict:
+
+        """
+        Finds the links of link_dict that re-post an earlier listing under a new ad id, i.e. whose
+        card text (title, price, surface, area ...) is near-identical to one seen before.
+
+        :return: Dictionary with the re-posted links as keys and the earlier links as values.
+        """
+
+        # the reposts of the current diff were computed at the end of the run
+        if self.summary.is_current(self.all_json_files) and link_dict == self.summary.data["current_diff"]:
+            return self.summary.data["reposts"]
+
+        from RepostDetector import RepostDetector
+
+        with self.trace.span("links_reposts") as fields:
+            repost_detector = RepostDetector(self.config_folder_path)
+            repost_detector.update(snapshot_folders(self.config_folder_path))
+            reposts = repost_detector.find_reposts(link_dict)
+            repost_detector.close()
+            fields["reposts"] = len(reposts)
+
+        return reposts
+
+
+    def hide_reposts(self, link_dict: dict, reposts: dict) -> dict:
+        return {key: [link for link in links if link not in reposts] for key, links in link_dict.items()}
+
+
     def get_current_diff(self)-> dict:
+
+        """
+        Links of the last .json file whose ad id does not appear in any earlier .json file.
+        The earlier files are looked up in the SeenIndex, which only reads snapshots it has not
+        indexed yet, so the cost is proportional to the size of the last snapshot.
+        """
         
+        if self.summary.is_current(self.all_json_files):
+            return self.summary.data["current_diff"]
+
         except_last = self.all_json_files[:-1]
         last = self.all_json_files[-1]
 
-        new_dict = {}
+        with self.trace.span("links_current_diff") as fields:
+            seen_index = SeenIndex(self.config_folder_path)
+            seen_index.update(except_last)
 
-        all_prev_links = []
-
-        for json_file in except_last:
-            with open(json_file, 'r') as f:
-                current_links_dict = json.load(f)
-        
-            current_links = [link for links in current_links_dict.values() for link in links]
-            all_prev_links.extend(current_links)
-
-        
-        with open(last, 'r') as f:
-            last_links_dict = json.load(f)
-        
-        # we'll use pop to prevent the semnatic loss of flattening the list of lists
-            
-        for key, value in last_links_dict.items():
-            new_dict[key] = list(set(value) - set(all_prev_links))
+            new_dict = seen_index.new_links(last)
+            seen_index.close()
+            fields["new_links"] = sum(len(links) for links in new_dict.values())
 
         return new_dict
     
@@ -0,0 +1,337 @@
+import os, re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import partial
+from html.parser import HTMLParser
+
+from SnapshotStore import read_page_source
+
+
+# void elements never get an end tag, the same list BeautifulSoup uses
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+    'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex',
+    'nextid', 'spacer',
+}
+
+# marks a card whose a tag has not been found (yet)
+NO_LINK = object()
+
+# the fields of a listing record are read from the card text with these patterns (first group),
+# the 'records' block of a search config can replace any of them
+RECORD_PATTERNS = {
+    "price": r'(\d{1,3}(?:\.\d{3})+|\d+)\s*(?:€|eur\b|euro\b|lei\b|ron\b)',
+    "surface": r'(\d+(?:[.,]\d+)?)\s*(?:mp\b|m²|m2\b)',
+    "rooms": r'\b(\d+)\s*camer[ae]\b|(garsonier)',
+    "area": None,
+    "posted": r'\b(azi|astazi|ieri|today|yesterday|\d{1,2}[./]\d{1,2}[./]\d{2,4}|\d{1,2} (?:ian|feb|mar|apr|mai|iun|iul|aug|sep|oct|noi|dec)\w*(?: \d{4})?)\b',
+}
+
+MONTHS = ["ian", "feb", "mar", "apr", "mai", "iun", "iul", "aug", "sep", "oct", "noi", "dec"]
+
+# saved files are concatenated page sources, libxml2 stops reading after the first </html>
+DOCUMENT_START = re.compile(r'(?=<!doctype\s|<html[\s>])', flags=re.IGNORECASE)
+
+
+def extract_links_bs4(html_content:str) -> list[str]:
+
+    """
+    The reference backend: BeautifulSoup with the html.parser tree builder.
+    """
+
+    from bs4 import BeautifulSoup
+
+    # Parse the HTML content
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    # Find all li tags with data-adid attribute
+    li_tags = soup.find_all('li', attrs={'data-adid': True})
+
+    # For each li tag, find the a tag within it and get the href attribute
+    urls = []
+
+    for li in li_tags:
+        a_tag = li.find('a')
+        if a_tag:
+            url = a_tag.get('href')
+            urls.append(url)
+
+    return urls
+
+
+def extract_links_lxml(html_content:str) -> list[str]:
+
+    """
+    libxml2 based backend, needs the optional lxml package. libxml2 repairs broken markup its own
+    way, so on badly nested pages the result can differ from the bs4 backend (bench_extractors.py
+    reports this).
+    """
+
+    import lxml.html
+
+    import lxml.etree
+
+    urls = []
+
+    for document in DOCUMENT_START.split(html_content):
+        try:
+            root = lxml.html.document_fromstring(document)
+        except lxml.etree.ParserError:
+            # empty document, e.g. a lone doctype
+            continue
+
+        for li in root.iter('li'):
+            if li.get('data-adid') is None:
+                continue
+            a_tag = li.find('.//a')
+            if a_tag is not None:
+                urls.append(a_tag.get('href'))
+
+    return urls
+
+
+class ListingLinkParser(HTMLParser):
+
+    def __init__(self, collect_text:bool = False):
+
+        """
+        Streaming tokenizer for li[data-adid] ... a[href], no tree is built.
+
+        It keeps only a stack of open tag names and closes tags the same way BeautifulSoup's
+        html.parser builder does (an end tag pops up to the most recent open tag with that name,
+        unknown end tags are ignored), so the first <a> inside a card is the same one
+        li.find('a') returns.
+
+        With collect_text = True the visible text of every card is collected as well.
+        """
+
+        super().__init__(convert_charrefs=True)
+
+        self.collect_text = collect_text
+
+        self.open_tags = []
+        self.open_cards = []  # indexes (in self.cards) of the li[data-adid] cards still open
+        self.cards = []  # href of the first a tag of every card in document order, or NO_LINK
+        self.card_texts = []  # text pieces of every card (collect_text only)
+
+    def _found_a_tag(self, attrs):
+
+        href = None
+        for name, value in attrs:
+            if name == 'href':
+                href = '' if value is None else value
+
+        # the a tag is the first one for every open card that has none yet
+        for card in self.open_cards:
+            if self.cards[card] is NO_LINK:
+                self.cards[card] = href
+
+    def handle_starttag(self, tag, attrs):
+
+        if tag == 'a' and self.open_cards:
+            self._found_a_tag(attrs)
+
+        if tag in VOID_ELEMENTS:
+            return
+
+        if tag == 'li' and any(name == 'data-adid' for name, _ in attrs):
+            self.cards.append(NO_LINK)
+            self.card_texts.append([])
+            self.open_cards.append(len(self.cards) - 1)
+            self.open_tags.append(('li', len(self.cards) - 1))
+        else:
+            self.open_tags.append((tag, None))
+
+    def handle_startendtag(self, tag, attrs):
+        # <tag/> is opened and closed right away, only an a tag can matter
+        if tag == 'a' and self.open_cards:
+            self._found_a_tag(attrs)
+
+    def handle_endtag(self, tag):
+
+        for position in range(len(self.open_tags) - 1, -1, -1):
+            if self.open_tags[position][0] == tag:
+                break
+        else:
+            return
+
+        for _, card in self.open_tags[position:]:
+            if card is not None:
+                self.open_cards.remove(card)
+
+        del self.open_tags[position:]
+
+    def handle_data(self, data):
+
+        if not self.collect_text or not self.open_cards:
+            return
+
+        if self.open_tags and self.open_tags[-1][0] in ('script', 'style'):
+            return
+
+        for card in self.open_cards:
+            self.card_texts[card].append(data)
+
+    def links(self) -> list[str]:
+        return [href for href in self.cards if href is not NO_LINK]
+
+    def link_texts(self) -> list[tuple]:
+        return [(href, ' '.join(' '.join(texts).split()))
+                for href, texts in zip(self.cards, self.card_texts) if href is not NO_LINK]
+
+
+def extract_links_stream(html_content:str) -> list[str]:
+
+    """
+    Pure python backend without a tree, gives the same links as extract_links_bs4.
+    """
+
+    parser = ListingLinkParser()
+    parser.feed(html_content)
+    parser.close()
+
+    return parser.links()
+
+
+def extract_cards(html_content:str) -> list[tuple]:
+
+    """
+    Like extract_links_stream, but also returns the visible text of every card (title, price,
+    surface, area ...), whitespace collapsed.
+
+    :return: List of (link, card text) tuples.
+    """
+
+    parser = ListingLinkParser(collect_text=True)
+    parser.feed(html_content)
+    parser.close()
+
+    return parser.link_texts()
+
+
+def parse_posted(text:str, today:date) -> date:
+
+    """
+    'azi', 'ieri', '31.01.2024' or '31 ian 2024' (without a year: the last 31 ian up to today).
+    """
+
+    text = text.lower()
+    if text in ("azi", "astazi", "today"):
+        return today
+    if text in ("ieri", "yesterday"):
+        return today - timedelta(days=1)
+
+    try:
+        numbers = re.split(r'[./ ]', text)
+        if not numbers[1].isdigit():
+            numbers[1] = MONTHS.index(numbers[1][:3]) + 1
+        if len(numbers) > 2:
+            year = int(numbers[2])
+            return date(year + 2000 if year < 100 else year, int(numbers[1]), int(numbers[0]))
+
+        posted = date(today.year, int(numbers[1]), int(numbers[0]))
+        return posted if posted <= today else posted.replace(year=today.year - 1)
+    except (ValueError, IndexError):
+        return None
+
+
+def extract_records(html_content:str, patterns:dict = None, today:date = None) -> list[dict]:
+
+    """
+    Structured listing records: the link and, from the card text, price, surface, rooms, area
+    and the posting date of every <li data-adid> card. A field whose pattern does not match is
+    None.
+
+    :param patterns: Replaces RECORD_PATTERNS per field (None switches a field off).
+    :param today: Date that 'azi' / 'ieri' refer to, e.g. the date of the snapshot.
+    :return: List of {"link", "price", "surface", "rooms", "area", "posted"} dictionaries.
+    """
+
+    patterns = {**RECORD_PATTERNS, **(patterns or {})}
+    compiled = {field: re.compile(pattern, re.IGNORECASE) for field, pattern in patterns.items() if pattern}
+    today = today or datetime.now().date()
+
+    records = []
+    for link, text in extract_cards(html_content):
+        values = {}
+        for field, pattern in compiled.items():
+            match = pattern.search(text)
+            values[field] = next((group for group in match.groups() if group), match.group(0)) if match else None
+
+        # 1.250 € is a thousand and more, 45,5 mp is a decimal
+        price = values.get("price")
+        surface = values.get("surface")
+        rooms = values.get("rooms")
+        posted = values.get("posted")
+
+        records.append({
+            "link": link,
+            "price": float(price.replace('.', '')) if price else None,
+            "surface": float(surface.replace(',', '.')) if surface else None,
+            "rooms": (1 if not rooms.isdigit() else int(rooms)) if rooms else None,
+            "area": values.get("area").strip().lower() if values.get("area") else None,
+            "posted": parse_posted(posted, today) if posted else None,
+        })
+
+    return records
+
+
+EXTRACTORS = {
+    "bs4": extract_links_bs4,
+    "lxml": extract_links_lxml,
+    "stream": extract_links_stream,
+}
+
+
+def get_extractor(backend:str = "bs4"):
+
+    if backend not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor '{backend}'. Use one of {', '.join(EXTRACTORS)}.")
+
+    return EXTRACTORS[backend]
+
+
+def extract_links(html_content:str, backend:str = "bs4") -> list[str]:
+
+    """
+    Extracts the listing links from a page source (or several concatenated page sources).
+
+    :param html_content: HTML of one or more search result pages.
+    :param backend: 'bs4' (default), 'lxml' or 'stream', see EXTRACTORS.
+    :return: List with the href of the first <a> tag of every <li data-adid> card.
+    """
+
+    return get_extractor(backend)(html_content)
+
+
+def extract_links_from_file(source_file:str, backend:str = "bs4") -> list[str]:
+
+    # Read the HTML content from a file, raw or from the SnapshotStore
+    html_content = read_page_source(source_file)
+
+    return extract_links(html_content, backend)
+
+
+def extract_links_from_files(source_files:list, backend:str = "bs4", workers:int = 1,
+                             chunksize:int = 1) -> list[list[str]]:
+
+    """
+    Extracts the links of many files, spread over several processes if workers > 1.
+
+    :param source_files: Paths of the html files.
+    :param backend: Extractor backend, see extract_links.
+    :param workers: Number of worker processes, 0 means one per cpu core, 1 parses in this process.
+    :param chunksize: Number of files a worker gets at once, larger chunks mean less overhead
+                      for many small files.
+    :return: One list of links per file, in the order of source_files.
+    """
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(source_files))
+
+    if workers <= 1:
+        return [extract_links_from_file(file, backend) for file in source_files]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(partial(extract_links_from_file, backend=backend), source_files,
+                                 chunksize=chunksize))
@@ -0,0 +1,319 @@
+import json, math, os, re, sys
+from array import array
+from datetime import datetime
+
+from ListingExtractor import extract_records
+from RunJournal import write_atomic
+from SnapshotSidecar import ad_key
+from SnapshotStore import page_source_files, page_source_name, read_page_source
+
+try:
+    import numpy as np
+except ImportError:
+    # the store is written without numpy, only the queries need it
+    np = None
+
+
+# page_source_folder/<config>/listings/ - one file per column
+LISTINGS_FOLDER = "listings"
+
+# one row per listing and snapshot, array typecode of every column; missing values are NaN
+# (floats) or -1 (codes, rooms, dates)
+COLUMNS = {
+    "ad_key": "q",  # SnapshotSidecar.ad_key of the link
+    "snapshot": "i",  # index in meta["snapshots"]
+    "feature": "i",  # index in meta["features"]
+    "price": "d",
+    "surface": "d",
+    "rooms": "b",
+    "area": "i",  # index in meta["areas"]
+    "posted": "i",  # date.toordinal() of the posting date
+}
+
+NUMPY_TYPES = {"q": "<i8", "i": "<i4", "d": "<f8", "b": "i1"}
+
+# -f filters: <field><operator><value>, e.g. "ppm<9 rooms>=2 area=centru seen>=3 drop>0"
+FILTER = re.compile(r'^(\w+)\s*(<=|>=|!=|=|<|>)\s*(.+)$')
+
+OPERATORS = {
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "=": lambda column, value: column == value,
+    "!=": lambda column, value: column != value,
+}
+
+
+class ListingStore:
+
+    def __init__(self, config_folder_path:str, patterns:dict = None):
+
+        """
+        Columnar store of the structured listing records of a config (price, surface, rooms,
+        area, posting date, see ListingExtractor.extract_records), one row per listing and
+        snapshot. Every column is a flat little endian file in page_source_folder/<config>/listings/,
+        listings/meta.idx holds the row count and the string tables (snapshots, features, areas).
+        Rows are only appended; a column file is cut back to the row count of meta.idx before
+        it is written to, so a run that died while appending leaves no half rows behind.
+
+        With numpy the columns are loaded as arrays and the filters (price per m², price drop
+        since the listing was last seen, number of snapshots it was in ...) are vectorized.
+
+        functions:
+
+        update() - adds the records of the snapshot folders that are not in the store yet.
+        query() - the listings of the newest snapshot that pass a filter.
+        print_records() - prints a query result.
+        """
+
+        self.folder = os.path.join(config_folder_path, LISTINGS_FOLDER)
+        self.meta_path = os.path.join(self.folder, "meta.idx")
+        self.patterns = patterns
+
+        self.meta = {"rows": 0, "snapshots": [], "features": [], "areas": [], "ads": 0, "ad_link_bytes": 0}
+        if os.path.isfile(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.meta = json.load(f)
+
+    @classmethod
+    def from_config(cls, config_folder_path:str, config:dict):
+
+        """
+        Reads the optional 'records' block of a search config, e.g.
+
+            "records": {"enabled": true, "patterns": {"area": "Timișoara, ([^-]+)"}}
+        """
+
+        return cls(config_folder_path, patterns=config.get("records", {}).get("patterns"))
+
+    def _column_path(self, column:str) -> str:
+        return os.path.join(self.folder, column + ".bin")
+
+    def _append(self, path:str, data:bytes, valid_bytes:int) -> None:
+
+        with open(path, 'ab') as f:
+            f.truncate(valid_bytes)
+            f.write(data)
+
+    def _code(self, table:str, value:str) -> int:
+
+        if value is None:
+            return -1
+
+        codes = self.meta[table]
+        if value not in codes:
+            codes.append(value)
+
+        return codes.index(value)
+
+    def add_snapshot(self, snapshot_folder:str, known_ad_keys:set) -> int:
+
+        """
+        Appends the records of one snapshot folder.
+
+        :param known_ad_keys: Ad keys that already have a link in the store, updated in place.
+        :return: Number of rows added.
+        """
+
+        name = os.path.basename(snapshot_folder.rstrip('/'))
+        today = datetime.strptime(name, "%Y-%m-%d-%H").date()
+
+        columns = {column: array(typecode) for column, typecode in COLUMNS.items()}
+        new_ad_keys, new_links = array('q'), []
+        in_snapshot = set()
+
+        snapshot_code = self._code("snapshots", name)
+        for path in page_source_files(snapshot_folder):
+            # <feat_mods>-part3 -> <feat_mods>
+            feature_code = self._code("features", re.sub(r'-part\d+$', '', page_source_name(path)))
+
+            for record in extract_records(read_page_source(path), self.patterns, today):
+                if not record["link"]:
+                    continue
+
+                key = ad_key(record["link"])
+                # a listing counts once per snapshot, even if several features found it
+                if key in in_snapshot:
+                    continue
+                in_snapshot.add(key)
+
+                if key not in known_ad_keys:
+                    known_ad_keys.add(key)
+                    new_ad_keys.append(key)
+                    new_links.append(record["link"])
+
+                columns["ad_key"].append(key)
+                columns["snapshot"].append(snapshot_code)
+                columns["feature"].append(feature_code)
+                columns["price"].append(record["price"] if record["price"] is not None else math.nan)
+                columns["surface"].append(record["surface"] if record["surface"] is not None else math.nan)
+                columns["rooms"].append(record["rooms"] if record["rooms"] is not None and record["rooms"] < 128 else -1)
+                columns["area"].append(self._code("areas", record["area"]))
+                columns["posted"].append(record["posted"].toordinal() if record["posted"] else -1)
+
+        os.makedirs(self.folder, exist_ok=True)
+
+        for column, data in columns.items():
+            if sys.byteorder != "little":
+                data.byteswap()
+            self._append(self._column_path(column), data.tobytes(), self.meta["rows"] * data.itemsize)
+
+        # the links are only needed to print results, every ad has one line
+        if sys.byteorder != "little":
+            new_ad_keys.byteswap()
+        self._append(self._column_path("ads_key"), new_ad_keys.tobytes(), self.meta["ads"] * 8)
+        link_bytes = ''.join(link + "\n" for link in new_links).encode()
+        self._append(os.path.join(self.folder, "ads_link.txt"), link_bytes, self.meta["ad_link_bytes"])
+
+        self.meta["rows"] += len(columns["ad_key"])
+        self.meta["ads"] += len(new_ad_keys)
+        self.meta["ad_link_bytes"] += len(link_bytes)
+
+        # the rows count once meta.idx says so
+        write_atomic(self.meta_path, json.dumps(self.meta))
+
+        return len(columns["ad_key"])
+
+    def update(self, snapshot_folders:list) -> int:
+
+        """
+        Adds the finished snapshots (the ones with a .json) that are not in the store yet.
+
+        :return: Number of rows added.
+        """
+
+        stored = set(self.meta["snapshots"])
+        to_add = [folder for folder in sorted(snapshot_folders)
+                  if os.path.basename(folder.rstrip('/')) not in stored and os.path.isfile(folder.rstrip('/') + '.json')]
+
+        if not to_add:
+            return 0
+
+        known_ad_keys = set(self._read_ad_keys())
+        return sum(self.add_snapshot(folder, known_ad_keys) for folder in to_add)
+
+    def _read_ad_keys(self) -> array:
+
+        keys = array('q')
+        if self.meta["ads"]:
+            with open(self._column_path("ads_key"), 'rb') as f:
+                keys.fromfile(f, self.meta["ads"])
+            if sys.byteorder != "little":
+                keys.byteswap()
+
+        return keys
+
+    def columns(self) -> dict:
+
+        if np is None:
+            raise ImportError("The listing filters need numpy: pip install numpy")
+
+        return {column: np.fromfile(self._column_path(column), dtype=NUMPY_TYPES[typecode], count=self.meta["rows"])
+                for column, typecode in COLUMNS.items()}
+
+    def query(self, filter_expression:str = "") -> list[dict]:
+
+        """
+        Filters the listings of the newest snapshot, e.g. "ppm<9 rooms>=2 seen>=3 drop>0".
+
+        Fields: price, surface, rooms, ppm (price per m²), seen (number of snapshots the listing
+        was in), drop (price drop since the listing was last seen), age (days since it was
+        posted), area and feature (text, = or != only). A listing without a value for a field
+        never passes a filter on it.
+
+        :return: One dictionary per listing, sorted by feature and price per m².
+        """
+
+        if not self.meta["rows"]:
+            return []
+
+        c = self.columns()
+        rows = self.meta["rows"]
+
+        # snapshots in name (= time) order, whatever order they were added in
+        names = self.meta["snapshots"]
+        rank = np.empty(len(names), dtype=np.int32)
+        rank[np.argsort(names)] = np.arange(len(names), dtype=np.int32)
+        snapshot_rank = rank[c["snapshot"]]
+
+        # the rows of every listing in time order, the previous row of a row is its last sighting
+        order = np.lexsort((snapshot_rank, c["ad_key"]))
+        same_ad = c["ad_key"][order][1:] == c["ad_key"][order][:-1]
+        previous_price = np.full(rows, np.nan)
+        previous_price[order[1:]] = np.where(same_ad, c["price"][order][:-1], np.nan)
+
+        _, inverse, counts = np.unique(c["ad_key"], return_inverse=True, return_counts=True)
+
+        latest_name = max(names)
+        snapshot_day = datetime.strptime(latest_name, "%Y-%m-%d-%H").date().toordinal()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fields = {
+                "price": c["price"],
+                "surface": c["surface"],
+                "rooms": np.where(c["rooms"] >= 0, c["rooms"], np.nan),
+                "ppm": c["price"] / c["surface"],
+                "seen": counts[inverse.reshape(-1)],
+                "drop": previous_price - c["price"],
+                "age": np.where(c["posted"] >= 0, snapshot_day - c["posted"], np.nan),
+            }
+
+        mask = snapshot_rank == rank[names.index(latest_name)]
+
+        for condition in filter_expression.replace(',', ' ').split():
+            match = FILTER.match(condition)
+            if match is None:
+                raise ValueError(f"Cannot read the filter '{condition}', use e.g. price<400 or area=centru.")
+            field, operator, value = match.groups()
+
+            if field in ("area", "feature"):
+                if operator not in ("=", "!="):
+                    raise ValueError(f"'{field}' can only be compared with = or !=.")
+                # areas are stored in lower case, a value that is not in the table matches nothing
+                value = value.lower() if field == "area" else value
+                table = self.meta[field + "s"]
+                mask &= OPERATORS[operator](c[field], table.index(value) if value in table else -2)
+            elif field in fields:
+                with np.errstate(invalid='ignore'):
+                    mask &= OPERATORS[operator](fields[field], float(value))
+            else:
+                raise ValueError(f"Unknown filter field '{field}', use one of "
+                                 f"{', '.join(list(fields) + ['area', 'feature'])}.")
+
+        selected = np.flatnonzero(mask)
+        selected = selected[np.lexsort((fields["ppm"][selected], c["feature"][selected]))]
+
+        ad_keys = self._read_ad_keys()
+        with open(os.path.join(self.folder, "ads_link.txt"), 'r') as f:
+            links = f.read().split("\n")
+        wanted = {int(c["ad_key"][row]) for row in selected}
+        link_of = {key: link for key, link in zip(ad_keys, links) if key in wanted}
+
+        def rounded(number):
+            # NaN is a missing value
+            return None if number != number else round(float(number), 2)
+
+        return [{
+            "link": link_of.get(int(c["ad_key"][row])),
+            "feature": self.meta["features"][c["feature"][row]],
+            "area": self.meta["areas"][c["area"][row]] if c["area"][row] >= 0 else None,
+            **{field: rounded(fields[field][row]) for field in fields},
+        } for row in selected]
+
+    def print_records(self, records:list) -> None:
+
+        feature = None
+        for counter, record in enumerate(records, start=1):
+            if record["feature"] != feature:
+                feature = record["feature"]
+                print(f"\nFeature : {feature}\n")
+                print(f" {'':>5} {'price':>8} {'m²':>6} {'rooms':>5} {'€/m²':>7} {'seen':>5} {'drop':>7}  link")
+
+            def show(value, digits=0):
+                return "-" if value is None else f"{value:.{digits}f}"
+
+            print(f" {counter:>4}: {show(record['price']):>8} {show(record['surface'], 1):>6} {show(record['rooms']):>5} "
+                  f"{show(record['ppm'], 2):>7} {show(record['seen']):>5} {show(record['drop']):>7}  {record['link']}")
+
+        print(f"\n ---> {len(records)} listings match.\n")
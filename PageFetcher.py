@@ -0,0 +1,569 @@
+import gzip, http.client, http.cookiejar, random, threading, time, urllib.request, zlib
+from collections import namedtuple
+from urllib.parse import urljoin, urlsplit
+
+
+# shown by the site when a search has no results
+NO_RESULTS_MARKER = "Nu am găsit ceea ce cauți."
+
+# what every fetcher returns for a page load; retry_after is the Retry-After header of a throttled
+# response, failure and attempts are filled in by RetryPolicy.fetch()
+FetchResult = namedtuple("FetchResult", ["page_source", "current_url", "status", "elapsed", "size",
+                                         "retry_after", "failure", "attempts"], defaults=[None, None, 1])
+
+# responses that mean "slow down"
+THROTTLED_STATUSES = (429, 503)
+
+
+def has_listings(page_source:str) -> bool:
+
+    """
+    A page is usable if it contains listing cards or the explicit 'no results' marker.
+    Anything else (empty body, js-only shell, captcha ...) is a candidate for the Selenium fallback.
+    """
+
+    return 'data-adid' in page_source or NO_RESULTS_MARKER in page_source
+
+
+def classify_failure(result:FetchResult = None, error:Exception = None, expect_listings:bool = False) -> str:
+
+    """
+    :param result: The response, None if the fetch raised error.
+    :param expect_listings: The url is a listing page, a page that fails the has_listings() check
+                            is not usable either. Selenium has no status code, a captcha or a
+                            half loaded page is only recognizable by its content.
+    :return: None for a usable page, else 'throttled' (429 / 503), 'timeout', 'error' (other
+             exceptions and status codes from 400 up) or 'empty' (no page source at all, or a
+             listing page without listings and without the 'no results' marker).
+    """
+
+    if error is not None:
+        # socket timeouts and selenium's TimeoutException
+        if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+            return "timeout"
+        return "error"
+
+    if result.status in THROTTLED_STATUSES:
+        return "throttled"
+    if result.status is not None and result.status >= 400:
+        return "error"
+    if result.page_source == "":
+        return "empty"
+    if expect_listings and not has_listings(result.page_source):
+        return "empty"
+
+    return None
+
+
+class RetryPolicy:
+
+    def __init__(self, max_retries:int = 3, backoff_seconds:float = 1.0, max_backoff_seconds:float = 30.0):
+
+        """
+        Retries single pages: a failed fetch (see classify_failure) is tried again after a
+        jittered exponential backoff, a random time between 0 and backoff_seconds * 2^retry
+        (at most max_backoff_seconds), or the Retry-After of a throttled response if that is
+        longer. Every attempt goes through the host limiter and is reported to it, so an
+        adaptive rate slows down on the failures (see AimdRate).
+
+        functions:
+
+        fetch() - fetches a page with retries.
+        """
+
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self.retries = 0
+        self.failures = {}  # failure -> count, retried ones included
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config:dict):
+
+        """
+        Reads the optional 'retry' block of a search config, e.g.
+
+            "retry": {"max_retries": 3, "backoff_seconds": 1, "max_backoff_seconds": 30}
+        """
+
+        retry = config.get("retry", {})
+
+        return cls(
+            max_retries=retry.get("max_retries", 3),
+            backoff_seconds=retry.get("backoff_seconds", 1.0),
+            max_backoff_seconds=retry.get("max_backoff_seconds", 30.0),
+        )
+
+    def backoff(self, retry:int, result:FetchResult = None) -> float:
+
+        delay = random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** retry))
+        if result is not None and result.retry_after is not None:
+            delay = max(delay, min(self.max_backoff_seconds, result.retry_after))
+
+        return delay
+
+    def fetch(self, session, url:str, limiter, expect_listings:bool = False) -> FetchResult:
+
+        """
+        :param limiter: The HostLimiter every attempt waits for.
+        :param expect_listings: The url is a listing page, see classify_failure().
+        :return: The last response, with its failure (None = usable page) and the number of
+                 attempts. If every attempt raised, an empty page with the failure.
+        """
+
+        for attempt in range(1, self.max_retries + 2):
+            start = time.perf_counter()
+            result, error = None, None
+
+            try:
+                with limiter.slot(url):
+                    result = session.fetch(url)
+            except Exception as e:
+                # http.client / socket errors, selenium's WebDriverException ...
+                error = e
+
+            failure = classify_failure(result, error, expect_listings)
+            limiter.record(url, failure, result.elapsed if result is not None else None)
+
+            if result is None:
+                result = FetchResult("", url, None, time.perf_counter() - start, 0)
+            result = result._replace(failure=failure, attempts=attempt)
+
+            if failure is None:
+                return result
+
+            with self.lock:
+                self.failures[failure] = self.failures.get(failure, 0) + 1
+
+            if attempt > self.max_retries:
+                break
+
+            delay = self.backoff(attempt - 1, result)
+            print(f' -- > {failure} response for {url} (status {result.status}{", " + repr(error) if error else ""}), '
+                  f'retry {attempt}/{self.max_retries} in {delay:.1f}s')
+            with self.lock:
+                self.retries += 1
+            time.sleep(delay)
+
+        return result
+
+
+# wait for these before reading a page in the lean browser
+LISTING_SELECTOR = "li[data-adid]"
+
+# true once the listings (or the 'no results' marker) are in the DOM
+READY_SCRIPT = """
+return document.querySelector(arguments[0]) !== null
+    || (document.body !== null && document.body.textContent.indexOf(arguments[1]) !== -1);
+"""
+
+# performance.now() and the bytes transferred for the page so far
+TRANSFER_SCRIPT = """
+var bytes = 0;
+var entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+for (var i = 0; i < entries.length; i++) { bytes += entries[i].transferSize || 0; }
+return [performance.now(), bytes];
+"""
+
+LOAD_EVENT_SCRIPT = """
+var navigation = performance.getEntriesByType('navigation')[0];
+return navigation ? navigation.loadEventEnd : 0;
+"""
+
+
+class SeleniumFetcher:
+
+    def __init__(self, headless:bool = True, max_pages_per_driver:int = 200, lean_browser:dict = None):
+
+        """
+        Fetches pages with warm Firefox sessions from a DriverPool.
+        Selenium is only imported (and the pool only created) when a session is actually opened.
+
+        :param lean_browser: The 'lean_browser' config block, e.g.
+                             {"enabled": true, "wait_timeout": 10, "block_patterns": [...], "sample_every": 20}
+                             see DriverPool and SeleniumSession.
+        """
+
+        self.headless = headless
+        self.max_pages_per_driver = max_pages_per_driver
+        self.lean = lean_browser if lean_browser and lean_browser.get("enabled", True) else None
+        self.driver_pool = None
+
+    def session(self):
+
+        if self.driver_pool is None:
+            from DriverPool import DriverPool
+            self.driver_pool = DriverPool(headless=self.headless, max_pages_per_driver=self.max_pages_per_driver,
+                                          lean=self.lean)
+
+        return SeleniumSession(self.driver_pool)
+
+    def stats(self) -> dict:
+
+        pool = self.driver_pool
+        if pool is None:
+            return {}
+
+        return {"browser_launches": pool.launches, "browser_reuses": pool.reuses, "browser_recycles": pool.recycles,
+                "browser_crashes": pool.crashes, "browser_startup_seconds": round(pool.startup_seconds, 3),
+                "lean_pages": pool.lean_pages, "lean_bytes": pool.lean_bytes,
+                "lean_saved_seconds": round(pool.lean_saved_seconds, 3)}
+
+    def close(self) -> None:
+        # quit the warm browsers and report how much startup time the pool saved
+        if self.driver_pool is not None:
+            self.driver_pool.close()
+
+
+class SeleniumSession:
+
+    def __init__(self, driver_pool):
+
+        """
+        One browser for one feature; the driver is taken from the pool on the first fetch
+        and handed back (reset) on release().
+
+        With a lean pool, get() returns as soon as the DOM is ready and the session then waits
+        (at most wait_timeout seconds) for a listing card or the 'no results' marker, instead
+        of for every image, font and tracker. Every sample_every-th page of the run (counted by
+        the pool) it also waits for the load event, to measure how much time that saves.
+        """
+
+        self.driver_pool = driver_pool
+        self.driver = None
+
+    def fetch(self, url:str) -> FetchResult:
+
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+
+        if self.driver is None:
+            self.driver = self.driver_pool.acquire()
+
+        start = time.perf_counter()
+        try:
+            self.driver.get(url)
+        except TimeoutException:
+            # a slow page, not a broken browser; RetryPolicy tries again after a backoff
+            raise
+        except WebDriverException:
+            # the browser crashed: the next fetch starts a fresh one. The page is retried by
+            # RetryPolicy, with a backoff and a new token of the host limiter
+            print(f' -- > Browser session crashed, restarting it...')
+            self.driver_pool.discard(self.driver)
+            self.driver = None
+            raise
+
+        if self.driver_pool.lean is not None:
+            self._wait_until_ready(start)
+
+        page_source = self.driver.page_source
+        current_url = self.driver.current_url
+        elapsed = time.perf_counter() - start
+
+        self.driver = self.driver_pool.count_page(self.driver)
+
+        # the browser does not expose the status code
+        return FetchResult(page_source, current_url, None, elapsed, len(page_source))
+
+    def _wait_until_ready(self, start:float) -> None:
+
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        lean = self.driver_pool.lean
+        timeout = lean.get("wait_timeout", 10)
+        sample = self.driver_pool.is_lean_sample(lean.get("sample_every", 20))
+
+        try:
+            WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(
+                lambda driver: driver.execute_script(READY_SCRIPT, lean.get("wait_selector", LISTING_SELECTOR),
+                                                     NO_RESULTS_MARKER)
+            )
+        except TimeoutException:
+            # take what is there, the page checks of the scraper decide what to do with it
+            print(f' -- > No listings after {timeout}s, reading the page anyway...')
+
+        ready_seconds = time.perf_counter() - start
+
+        try:
+            ready_ms, transferred_bytes = self.driver.execute_script(TRANSFER_SCRIPT)
+
+            saved_seconds = None
+            if sample:
+                # what a default browser would have waited for: the load event
+                WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(
+                    lambda driver: driver.execute_script(LOAD_EVENT_SCRIPT) > 0
+                )
+                saved_seconds = max(0.0, self.driver.execute_script(LOAD_EVENT_SCRIPT) - ready_ms) / 1000
+
+            self.driver_pool.record_lean_page(ready_seconds, int(transferred_bytes), saved_seconds)
+
+        except (TimeoutException, WebDriverException):
+            # statistics only, never worth failing a page for
+            self.driver_pool.record_lean_page(ready_seconds, 0)
+
+    def release(self) -> None:
+        if self.driver is not None:
+            self.driver_pool.release(self.driver)
+            self.driver = None
+
+
+class HttpFetcher:
+
+    def __init__(self, timeout:float = 30, max_redirects:int = 5, max_idle_per_host:int = 8,
+                 user_agent:str = "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0"):
+
+        """
+        Plain HTTP fetcher with keep-alive connection pooling, gzip/deflate decoding and a cookie
+        jar. Connections and cookies are shared by all sessions (and threads) of a run.
+        """
+
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.max_idle_per_host = max_idle_per_host
+        self.headers = {
+            "User-Agent": user_agent,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Encoding": "gzip, deflate",
+            "Accept-Language": "ro-RO,ro;q=0.9,en;q=0.8",
+            "Connection": "keep-alive",
+        }
+
+        self.cookie_jar = http.cookiejar.CookieJar()
+        self.idle_connections = {}  # (scheme, netloc) -> list of open connections
+        self.lock = threading.Lock()
+
+        # statistics for the report at the end of a run
+        self.requests = 0
+        self.connections_opened = 0
+        self.bytes_received = 0
+        self.retries = 0
+
+    def session(self):
+        # keep-alive connections and cookies are shared, so a session is just the fetcher itself
+        return HttpSession(self)
+
+    def _get_connection(self, scheme:str, netloc:str):
+
+        with self.lock:
+            idle = self.idle_connections.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+
+        return self._new_connection(scheme, netloc), False
+
+    def _new_connection(self, scheme:str, netloc:str):
+
+        with self.lock:
+            self.connections_opened += 1
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _put_connection(self, scheme:str, netloc:str, connection) -> None:
+
+        with self.lock:
+            idle = self.idle_connections.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _request(self, url:str):
+
+        parts = urlsplit(url)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+
+        # let the cookie jar decide which cookies belong to this url
+        request = urllib.request.Request(url, headers=self.headers)
+        self.cookie_jar.add_cookie_header(request)
+        headers = dict(request.header_items())
+
+        connection, reused = self._get_connection(parts.scheme, parts.netloc)
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if not reused:
+                raise
+            # the server closed an idle keep-alive connection, retry once on a fresh one
+            with self.lock:
+                self.retries += 1
+            connection = self._new_connection(parts.scheme, parts.netloc)
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+
+        self.cookie_jar.extract_cookies(response, request)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._put_connection(parts.scheme, parts.netloc, connection)
+
+        return response, body
+
+    def fetch(self, url:str) -> FetchResult:
+
+        start = time.perf_counter()
+        size = 0
+
+        for _ in range(self.max_redirects + 1):
+            response, body = self._request(url)
+            size += len(body)
+
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            break
+
+        encoding = (response.getheader("Content-Encoding") or "").lower()
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+
+        charset = response.headers.get_content_charset() or "utf-8"
+        page_source = body.decode(charset, errors="replace")
+
+        with self.lock:
+            self.requests += 1
+            self.bytes_received += size
+
+        # seconds; the http date form of the header is not worth parsing here
+        retry_after = response.getheader("Retry-After")
+        retry_after = float(retry_after) if retry_after and retry_after.strip().isdigit() else None
+
+        return FetchResult(page_source, url, response.status, time.perf_counter() - start, size, retry_after)
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "connections_opened": self.connections_opened,
+                "bytes_received": self.bytes_received, "retries": self.retries}
+
+    def close(self) -> None:
+
+        with self.lock:
+            connections = [c for idle in self.idle_connections.values() for c in idle]
+            self.idle_connections = {}
+
+        for connection in connections:
+            connection.close()
+
+        print(
+            f"\n --- HTTP fetcher: {self.requests} requests over {self.connections_opened} connections, "
+            f"{self.bytes_received / 1024:.0f} KiB received.\n"
+        )
+
+
+class HttpSession:
+
+    def __init__(self, http_fetcher:HttpFetcher):
+        self.http_fetcher = http_fetcher
+
+    def fetch(self, url:str) -> FetchResult:
+        return self.http_fetcher.fetch(url)
+
+    def release(self) -> None:
+        pass
+
+
+class FallbackFetcher:
+
+    def __init__(self, http_fetcher:HttpFetcher, selenium_fetcher:SeleniumFetcher,
+                 selenium_url_patterns:list = None):
+
+        """
+        Fetches with plain HTTP and only falls back to Selenium if the response fails the
+        has_listings() check, or if the url contains one of selenium_url_patterns. Throttled
+        responses (429 / 503) are returned as they are, they are retried after a backoff.
+        """
+
+        self.http_fetcher = http_fetcher
+        self.selenium_fetcher = selenium_fetcher
+        self.selenium_url_patterns = selenium_url_patterns or []
+        self.fallbacks = 0
+        self.lock = threading.Lock()
+
+    def session(self):
+        return FallbackSession(self)
+
+    def stats(self) -> dict:
+        return {**self.http_fetcher.stats(), **self.selenium_fetcher.stats(), "selenium_fallbacks": self.fallbacks}
+
+    def close(self) -> None:
+        print(f"\n --- Selenium fallback used for {self.fallbacks} pages.")
+        self.http_fetcher.close()
+        self.selenium_fetcher.close()
+
+
+class FallbackSession:
+
+    def __init__(self, fallback_fetcher:FallbackFetcher):
+        self.fallback_fetcher = fallback_fetcher
+        self.selenium_session = None
+
+    def _fetch_with_selenium(self, url:str) -> FetchResult:
+        if self.selenium_session is None:
+            self.selenium_session = self.fallback_fetcher.selenium_fetcher.session()
+        with self.fallback_fetcher.lock:
+            self.fallback_fetcher.fallbacks += 1
+        return self.selenium_session.fetch(url)
+
+    def fetch(self, url:str) -> FetchResult:
+
+        if any(pattern in url for pattern in self.fallback_fetcher.selenium_url_patterns):
+            return self._fetch_with_selenium(url)
+
+        try:
+            result = self.fallback_fetcher.http_fetcher.fetch(url)
+        except (http.client.HTTPException, OSError) as e:
+            print(f' -- > HTTP fetch failed ({e}), falling back to Selenium...')
+            return self._fetch_with_selenium(url)
+
+        # the site asks to slow down: a browser would hit the same limit, RetryPolicy backs off
+        if result.status in THROTTLED_STATUSES:
+            return result
+
+        if result.status == 200 and has_listings(result.page_source):
+            return result
+
+        return self._fetch_with_selenium(url)
+
+    def release(self) -> None:
+        if self.selenium_session is not None:
+            self.selenium_session.release()
+            self.selenium_session = None
+
+
+def make_fetcher(kind:str = "selenium", headless:bool = True, max_pages_per_driver:int = 200,
+                 selenium_url_patterns:list = None, lean_browser:dict = None):
+
+    """
+    Builds the fetcher backend selected by the 'fetcher' key of a search config.
+
+    :param kind: 'selenium' (default, a browser for every page), 'http' (plain HTTP only) or
+                 'auto' (plain HTTP, Selenium only for pages that fail the has_listings() check).
+    :param lean_browser: 'lean_browser' config block for the Selenium sessions, None for a default browser.
+    :return: Fetcher with session() and close().
+    """
+
+    if kind == "selenium":
+        return SeleniumFetcher(headless=headless, max_pages_per_driver=max_pages_per_driver, lean_browser=lean_browser)
+
+    if kind == "http":
+        return HttpFetcher()
+
+    if kind == "auto":
+        return FallbackFetcher(
+            HttpFetcher(),
+            SeleniumFetcher(headless=headless, max_pages_per_driver=max_pages_per_driver, lean_browser=lean_browser),
+            selenium_url_patterns=selenium_url_patterns,
+        )
+
+    raise ValueError(f"Unknown fetcher '{kind}'. Use 'selenium', 'http' or 'auto'.")
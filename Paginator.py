@@ -0,0 +1,167 @@
+import hashlib, math, re, threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ad ids straight from the markup, much cheaper than parsing the page
+AD_ID_ATTRIBUTE = re.compile(r'data-adid\s*=\s*["\']?([^"\'\s>]+)')
+
+
+class Paginator:
+
+    def __init__(self, total_results_pattern:str = None, page_size:int = None, next_page_pattern:str = None,
+                 fingerprint:bool = True, prefetch_pages:int = 0):
+
+        """
+        Decides which pages of a feature exist, from the page itself instead of waiting for the
+        site to send us back to page 1:
+
+        - total_results_pattern + page_size: a regex whose first group is the total number of
+          results (e.g. "([\\d.]+) anunțuri"), page count = ceil(total / page_size).
+        - next_page_pattern: a regex that matches the 'next page' link; a page without it is the last.
+        - fingerprint: a page with the same ad ids as the previous page or page 1 is a repeat,
+          the feature is finished.
+
+        Without any of them the old behaviour stays: a page whose url lost its 'pag=' is the
+        redirect back to page 1 and ends the feature.
+
+        With a known page count, up to prefetch_pages pages are fetched ahead in parallel
+        (still through the per-host limiter).
+        """
+
+        self.total_results_pattern = re.compile(total_results_pattern) if total_results_pattern else None
+        self.page_size = page_size
+        self.next_page_pattern = re.compile(next_page_pattern) if next_page_pattern else None
+        self.fingerprint_pages = fingerprint
+        self.prefetch_pages = prefetch_pages
+
+    @classmethod
+    def from_config(cls, config:dict):
+
+        """
+        Reads the optional 'pagination' block of a search config, e.g.
+
+            "pagination": {"total_results_pattern": "([\\\\d.]+) anunțuri", "page_size": 20,
+                           "next_page_pattern": "rel=\\"next\\"", "prefetch_pages": 2}
+        """
+
+        pagination = config.get("pagination", {})
+
+        return cls(
+            total_results_pattern=pagination.get("total_results_pattern"),
+            page_size=pagination.get("page_size"),
+            next_page_pattern=pagination.get("next_page_pattern"),
+            fingerprint=pagination.get("fingerprint", True),
+            prefetch_pages=pagination.get("prefetch_pages", 0),
+        )
+
+    def page_url(self, feat_url:str, page:int) -> str:
+
+        # the 1st page does not have a page number, the others get '&pag=N'
+        feat_url = feat_url.split('&pag=')[0]
+        if page == 1:
+            return feat_url
+
+        separator = '&' if '?' in feat_url else '?'
+        return f'{feat_url}{separator}pag={page}'
+
+    def is_reloop(self, current_url:str, page:int) -> bool:
+        # after the last page the site sends us back to the 1st page, which has no 'pag='
+        return page > 1 and "pag=" not in current_url
+
+    def page_count(self, page_source:str) -> int:
+
+        """
+        :return: Number of pages of the feature, None if the page does not tell.
+        """
+
+        if self.total_results_pattern is None or not self.page_size:
+            return None
+
+        match = self.total_results_pattern.search(page_source)
+        if not match:
+            return None
+
+        total = int(re.sub(r'\D', '', match.group(1)) or 0)
+        return max(1, math.ceil(total / self.page_size))
+
+    def has_next_page(self, page_source:str) -> bool:
+
+        """
+        :return: False if the page has no 'next page' link, None if next_page_pattern is not set.
+        """
+
+        if self.next_page_pattern is None:
+            return None
+
+        return self.next_page_pattern.search(page_source) is not None
+
+    def fingerprint(self, page_source:str) -> str:
+
+        """
+        :return: Hash of the ad ids on the page, None if there are none (or fingerprinting is off).
+        """
+
+        if not self.fingerprint_pages:
+            return None
+
+        ad_ids = AD_ID_ATTRIBUTE.findall(page_source)
+        if not ad_ids:
+            return None
+
+        return hashlib.blake2b(' '.join(sorted(ad_ids)).encode(), digest_size=16).hexdigest()
+
+
+class PagePrefetcher:
+
+    def __init__(self, fetcher, limiter, workers:int, retry = None):
+
+        """
+        Fetches pages of a feature ahead of time on a few threads, each with its own fetcher
+        session. Every request still goes through the per-host limiter, and through the
+        RetryPolicy if one is given.
+        """
+
+        self.fetcher = fetcher
+        self.limiter = limiter
+        self.retry = retry
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}  # page -> future
+
+        self.local = threading.local()
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def _fetch(self, url:str):
+
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = self.fetcher.session()
+            with self.lock:
+                self.sessions.append(session)
+
+        if self.retry is not None:
+            return self.retry.fetch(session, url, self.limiter, expect_listings=True)
+
+        with self.limiter.slot(url):
+            return session.fetch(url)
+
+    def submit(self, page:int, url:str) -> None:
+        if page not in self.futures:
+            self.futures[page] = self.executor.submit(self._fetch, url)
+
+    def take(self, page:int):
+
+        """
+        :return: The result of a prefetched page (waits for it), None if it was not prefetched.
+        """
+
+        future = self.futures.pop(page, None)
+        return future.result() if future is not None else None
+
+    def close(self) -> None:
+
+        # pages that were not needed any more (e.g. incremental stop) are not fetched
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+        for session in self.sessions:
+            session.release()
@@ -0,0 +1,372 @@
+import json, multiprocessing, os, shutil, socket, threading, time, uuid
+
+from CrawlTrace import CrawlTrace
+from FeatPageScraper import FeatPageScraper
+from WorkQueue import STAGING_FOLDER, SharedHostLimiter, WorkQueue
+
+
+def work_queue_settings(configs:list) -> dict:
+
+    """
+    Reads the optional 'work_queue' blocks of the search configs, e.g.
+
+        "work_queue": {"local_workers": 3, "lease_seconds": 60, "max_attempts": 3,
+                       "poll_seconds": 1, "idle_exit_seconds": null}
+
+    Several configs: the most local workers, the longest lease and the most attempts.
+    """
+
+    blocks = [config.get("work_queue", {}) for config in configs]
+    idle_exits = [block["idle_exit_seconds"] for block in blocks if block.get("idle_exit_seconds") is not None]
+
+    return {
+        "local_workers": max(block.get("local_workers", 0) for block in blocks),
+        "lease_seconds": max(block.get("lease_seconds", 60) for block in blocks),
+        "max_attempts": max(block.get("max_attempts", 3) for block in blocks),
+        "poll_seconds": min(block.get("poll_seconds", 1) for block in blocks),
+        # None = a -worker waits for new items until it is stopped
+        "idle_exit_seconds": max(idle_exits) if idle_exits else None,
+    }
+
+
+def read_configs(config_file_paths:list) -> list[dict]:
+
+    configs = []
+    for path in config_file_paths:
+        with open(path, 'r') as file:
+            configs.append(json.load(file))
+
+    return configs
+
+
+class QueueWorker:
+
+    def __init__(self, config_file_paths:list = None, sleeper:int = 1, headless:bool = True,
+                 poll_seconds:float = 1, idle_exit_seconds:float = None):
+
+        """
+        A generic_jacker.py -worker process: claims feature urls from the WorkQueue, fetches their
+        pages with a FeatPageScraper of the item's config and completes them. One feature at a
+        time; start more workers for more parallelism. The request rate of every host is shared
+        by all workers (SharedHostLimiter), so N workers together stay at the 'politeness' rate.
+
+        The pages go to a staging folder of the item and attempt in the snapshot folder, the
+        coordinator (QueueCrawl) moves them into place. A worker whose lease was lost (it was too
+        slow, or the coordinator thought it dead) throws its result away.
+
+        functions:
+
+        run() - works on items until the queue is idle for idle_exit_seconds (None = forever) or
+        until() is True.
+        process() - fetches one item.
+        """
+
+        self.config_file_paths = config_file_paths
+        self.sleeper = sleeper
+        self.headless = headless
+        self.poll_seconds = poll_seconds
+        self.idle_exit_seconds = idle_exit_seconds
+
+        self.queue = WorkQueue()
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.scrapers = {}  # config file path -> FeatPageScraper
+
+    @classmethod
+    def from_configs(cls, config_file_paths:list, sleeper:int = 1, headless:bool = True):
+
+        """
+        A worker for the items of these configs, with the settings of their 'work_queue' blocks.
+        """
+
+        settings = work_queue_settings(read_configs(config_file_paths))
+
+        return cls(config_file_paths, sleeper=sleeper, headless=headless, poll_seconds=settings["poll_seconds"],
+                   idle_exit_seconds=settings["idle_exit_seconds"])
+
+    def scraper(self, config_file_path:str) -> FeatPageScraper:
+
+        scraper = self.scrapers.get(config_file_path)
+        if scraper is None:
+            scraper = FeatPageScraper(config_file_path, sleeper=self.sleeper, headless=self.headless)
+
+            # the coordinator keeps the journal of the snapshot, the fetcher stays warm for the next item
+            scraper.checkpoints = False
+            scraper.close_fetcher = False
+
+            limiter = scraper.scheduler.limiter
+            scraper.scheduler.limiter = SharedHostLimiter(self.queue.path, limiter.requests_per_second,
+                                                          limiter.burst, limiter.max_in_flight, limiter.adaptive)
+            self.scrapers[config_file_path] = scraper
+
+        return scraper
+
+    def process(self, item:dict) -> bool:
+
+        """
+        :return: True if the item was completed.
+        """
+
+        print(f" \n\n -----> Worker {self.owner}: item {item['id']} (attempt {item['attempt']})\n"
+              f"Link : {item['feature']}\n\n")
+
+        staging = os.path.join(item["snapshot"], STAGING_FOLDER, f"{item['id']}-{item['attempt']}")
+        os.makedirs(staging, exist_ok=True)
+
+        try:
+            scraper = self.scraper(item["config"])
+        except (OSError, ValueError) as e:
+            # e.g. the config is not on this machine
+            print(f' -----> Cannot read the config {item["config"]}: {e}')
+            self.queue.fail(item, self.owner, str(e))
+            return False
+
+        scraper.current_config_folder_path = staging
+        scraper.link_dict = {}
+        scraper.failed_features = []
+        scraper.trace = CrawlTrace(os.path.join(staging, "trace.jsonl")) if scraper.tracing else CrawlTrace()
+
+        # the lease is extended every third of its time, until the feature is done
+        done = threading.Event()
+        lost = threading.Event()
+
+        def heartbeat():
+            while not done.wait(item["lease_seconds"] / 3):
+                try:
+                    if not self.queue.heartbeat(item, self.owner):
+                        lost.set()
+                        return
+                except Exception as e:
+                    print(f" -----> Heartbeat of item {item['id']} failed: {e}")
+
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+
+        requests_before = scraper.scheduler.limiter.requests
+        waited_before = scraper.scheduler.limiter.seconds_waited
+        error = None
+        start = time.perf_counter()
+        try:
+            paths = scraper.save_page_source(item["feature"])
+            if scraper.failed_features:
+                error = "page could not be retrieved"
+        except Exception as e:
+            # one broken feature must not stop the worker
+            paths, error = None, repr(e)
+        finally:
+            done.set()
+            beat.join()
+            scraper.trace.close()
+
+        if lost.is_set():
+            print(f" -----> Lease of item {item['id']} lost, another worker has it now.")
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+
+        if error is not None:
+            state = self.queue.fail(item, self.owner, error)
+            print(f" -----> Item {item['id']} failed ({error}), it is {state} now.")
+            return False
+
+        result = {
+            "staging": staging,
+            # names in the staging folder = names in the snapshot folder
+            "paths": [os.path.basename(path) for path in paths] if paths is not None else None,
+            "links": scraper.link_dict,
+            "requests": scraper.scheduler.limiter.requests - requests_before,
+            "rate_limit_seconds": round(scraper.scheduler.limiter.seconds_waited - waited_before, 3),
+            "seconds": round(time.perf_counter() - start, 3),
+            "worker": self.owner,
+        }
+
+        if not self.queue.complete(item, self.owner, result):
+            print(f" -----> Lease of item {item['id']} lost, another worker has it now.")
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+
+        print(f' -----> Finished item {item["id"]}\n' + "-" * 50)
+        return True
+
+    def run(self, until=None) -> int:
+
+        """
+        :param until: Function, the worker stops once it returns True (checked between items).
+        :return: Number of completed items.
+        """
+
+        completed = 0
+        idle_since = time.monotonic()
+
+        try:
+            while until is None or not until():
+                item = self.queue.claim(self.owner, self.config_file_paths)
+
+                if item is None:
+                    if self.idle_exit_seconds is not None and time.monotonic() - idle_since >= self.idle_exit_seconds:
+                        break
+                    time.sleep(self.poll_seconds)
+                    continue
+
+                completed += self.process(item)
+                idle_since = time.monotonic()
+        finally:
+            self.close()
+
+        print(f"\n ---> Worker {self.owner}: {completed} items completed.\n")
+        return completed
+
+    def close(self) -> None:
+        for scraper in self.scrapers.values():
+            scraper.fetcher.close()
+        self.scrapers = {}
+
+
+def run_local_worker(config_file_paths:list, snapshots:list, sleeper:int, headless:bool, poll_seconds:float) -> None:
+
+    # the workers a coordinator starts itself (work_queue.local_workers) stop with its crawl
+    worker = QueueWorker(config_file_paths, sleeper=sleeper, headless=headless, poll_seconds=poll_seconds)
+    worker.run(until=lambda: worker.queue.finished(snapshots))
+
+
+class QueueCrawl:
+
+    def __init__(self, config_file_paths:list, sleeper:int = 1, headless:bool = True, testing:bool = False):
+
+        """
+        The coordinator of a queue crawl (generic_jacker.py -queue): puts the feature urls of the
+        configs into the WorkQueue (page_source_folder/work_queue.sqlite), works on them itself
+        together with any generic_jacker.py -worker processes (and the work_queue.local_workers
+        it starts), then assembles the usual snapshot folders and .json files.
+
+        An item is a feature url with all its pages: the pages of a feature are fetched in order,
+        as the end of a feature is found by looking at its pages.
+
+        If features failed (max_attempts per feature), the snapshot gets no .json and stays
+        resumable: the next -queue only queues the failed features again.
+
+        functions:
+
+        run() - queues, crawls and assembles all configs.
+        """
+
+        self.scrapers = [FeatPageScraper(path, sleeper=sleeper, headless=headless, testing=testing)
+                         for path in config_file_paths]
+        self.config_file_paths = config_file_paths
+        self.sleeper = sleeper
+        self.headless = headless
+        self.settings = work_queue_settings(read_configs(config_file_paths))
+        self.queue = WorkQueue()
+
+    def enqueue(self) -> list:
+
+        """
+        :return: The FeatPageScraper of every config that got a snapshot.
+        """
+
+        scrapers = []
+        for scraper in self.scrapers:
+            scraper.generate_links_from_config_json()
+            if scraper.start_snapshot() is None:
+                continue
+
+            scrapers.append(scraper)
+            to_fetch = self.queue.enqueue(scraper.config_file_path, scraper.current_config_folder_path,
+                                          scraper.feat_links, lease_seconds=self.settings["lease_seconds"],
+                                          max_attempts=self.settings["max_attempts"])
+            print(f" ---> {scraper.config_file_path}: {to_fetch}/{len(scraper.feat_links)} feature URLs queued")
+
+        return scrapers
+
+    def assemble(self, scraper:FeatPageScraper, elapsed:float) -> None:
+
+        """
+        Moves the staged files of the completed items into the snapshot folder, in feat_links
+        order, merges their links and traces and writes the .json.
+        """
+
+        snapshot = scraper.current_config_folder_path
+        requests, waited, workers = 0, 0.0, set()
+
+        for item in self.queue.items(snapshot):
+            if item["state"] != "done":
+                print(f" ---> Failed after {item['attempts']} attempts: {item['feature']} "
+                      f"({(item['result'] or {}).get('error')})")
+                scraper.failed_features.append(item["feature"])
+                continue
+
+            result = item["result"]
+            for name in result["paths"] or []:
+                path = os.path.join(snapshot, name)
+                # already moved by an assembly that ended with failed features
+                if os.path.isfile(os.path.join(result["staging"], name)):
+                    os.replace(os.path.join(result["staging"], name), path)
+                scraper.page_source_paths.append(path)
+
+            scraper.link_dict.update(result["links"])
+
+            staged_trace = os.path.join(result["staging"], "trace.jsonl")
+            scraper.trace.merge(staged_trace)
+            if os.path.isfile(staged_trace):
+                os.remove(staged_trace)
+
+            # streaming mode: the links of every page, as a -run writes them
+            staged_links_log = os.path.join(result["staging"], "links.jsonl")
+            if os.path.isfile(staged_links_log):
+                with open(staged_links_log, 'r') as source, open(os.path.join(snapshot, "links.jsonl"), 'a') as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(staged_links_log)
+
+            requests += result["requests"]
+            waited += result["rate_limit_seconds"]
+            workers.add(result["worker"])
+
+        scraper.trace.event("run", seconds=round(elapsed, 3), features=len(scraper.feat_links), requests=requests,
+                            rate_limit_seconds=round(waited, 3), workers=len(workers), fetcher={})
+
+        if not scraper.failed_features:
+            shutil.rmtree(os.path.join(snapshot, STAGING_FOLDER), ignore_errors=True)
+
+        scraper.get_links_from_html_folder()
+
+        if not scraper.failed_features:
+            self.queue.remove(snapshot)
+
+    def run(self) -> list:
+
+        """
+        :return: The FeatPageScraper of every config that got a snapshot.
+        """
+
+        scrapers = self.enqueue()
+        snapshots = [scraper.current_config_folder_path for scraper in scrapers]
+        if not snapshots:
+            return scrapers
+
+        start = time.perf_counter()
+
+        workers = [multiprocessing.Process(target=run_local_worker,
+                                           args=(self.config_file_paths, snapshots, self.sleeper, self.headless,
+                                                 self.settings["poll_seconds"]))
+                   for _ in range(self.settings["local_workers"])]
+        for process in workers:
+            process.start()
+
+        print(f"\n --- Queue crawl: {len(snapshots)} snapshot(s), {len(workers)} local worker(s) and the coordinator, "
+              f"-worker processes can join --- \n")
+
+        # the coordinator works too; once nothing is pending it waits for the leases of the others,
+        # an item of a dead worker comes back when its lease runs out
+        coordinator = QueueWorker(self.config_file_paths, sleeper=self.sleeper, headless=self.headless,
+                                  poll_seconds=self.settings["poll_seconds"])
+        coordinator.run(until=lambda: self.queue.finished(snapshots))
+
+        for process in workers:
+            process.join()
+
+        elapsed = time.perf_counter() - start
+        print(f" ---> Queue crawl finished in {elapsed:.1f}s: {self.queue.counts(snapshots)}")
+
+        # the fetchers of these scrapers were never used, the workers fetched everything
+        for scraper in scrapers:
+            self.assemble(scraper, elapsed)
+
+        return scrapers
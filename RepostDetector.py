@@ -0,0 +1,223 @@
+import hashlib, os, random, re, sqlite3, struct, unicodedata
+
+from ListingExtractor import extract_cards
+from RunJournal import journal_path
+from SeenIndex import ad_id_from_link
+from SnapshotStore import page_source_files, read_page_source
+
+
+# MinHash over 64 permutations, split into 16 LSH bands of 4 rows: two listings with a Jaccard
+# similarity of 0.8 share a band with a probability of ~99.9%, at 0.3 only with ~12%
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+_random = random.Random(1337)
+PERMUTATIONS = [(_random.randrange(1, MERSENNE_PRIME), _random.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+
+# posting times and dates change with every re-post, they must not count
+POSTING_DATE = re.compile(
+    r'\b(?:azi|astazi|ieri|today|yesterday|reactualizat|actualizat)\b'
+    r'|\b\d{1,2}:\d{2}\b'
+    r'|\b\d{1,2}[./]\d{1,2}[./]\d{2,4}\b'
+    r'|\b\d{1,2} (?:ian|feb|mar|apr|mai|iun|iul|aug|sep|oct|noi|dec)\w*(?: \d{4})?\b'
+)
+
+
+def shingles(text:str, size:int = 3) -> set:
+
+    """
+    Word n-grams of a listing text. Case, diacritics, punctuation and posting dates are ignored,
+    so 'Apartament 2 camere, 350 €, Azi 10:32' and 'apartament 2 camere 350€ ieri 18:00' give
+    the same shingles.
+    """
+
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = POSTING_DATE.sub(' ', text)
+    words = re.findall(r'\w+', text)
+
+    if len(words) < size:
+        return {' '.join(words)} if words else set()
+
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text:str) -> list[int]:
+
+    """
+    :return: MinHash signature (NUM_PERM values) of the shingles of text, None for empty text.
+    """
+
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), 'little')
+              for shingle in shingles(text)]
+    if not hashes:
+        return None
+
+    return [min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes) for a, b in PERMUTATIONS]
+
+
+def similarity(signature_a:list, signature_b:list) -> float:
+    # share of equal MinHash values = estimated Jaccard similarity of the shingle sets
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERM
+
+
+def band_keys(signature:list) -> list[bytes]:
+    return [hashlib.blake2b(struct.pack(f'<{ROWS}I', *signature[band * ROWS:(band + 1) * ROWS]),
+                            digest_size=8, person=bytes([band])).digest()
+            for band in range(BANDS)]
+
+
+class RepostDetector:
+
+    def __init__(self, config_folder_path:str, threshold:float = 0.8):
+
+        """
+        Finds listings that were re-posted under a new ad id. Every listing card (title, price,
+        surface, area ... as shown on the search page) gets a MinHash signature, stored with its
+        LSH band keys in page_source_folder/<config>/repost_index.sqlite. Looking up similar
+        listings only touches the listings that share a band key, not the whole history.
+
+        functions:
+
+        index_snapshot() - fingerprints the listings of a snapshot folder (its html files).
+        update() - indexes every snapshot folder that is not indexed yet.
+        find_reposts() - maps links to the earlier listing they re-post.
+        """
+
+        self.threshold = threshold
+        self.config_folder_path = config_folder_path
+        self.connection = sqlite3.connect(os.path.join(config_folder_path, "repost_index.sqlite"))
+
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                ad_id TEXT PRIMARY KEY,
+                link TEXT NOT NULL,
+                first_seen TEXT NOT NULL,
+                signature BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                band_key BLOB NOT NULL,
+                ad_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS bands_by_key ON bands (band_key);
+            CREATE TABLE IF NOT EXISTS indexed_snapshots (
+                name TEXT PRIMARY KEY
+            );
+        """)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def index_snapshot(self, snapshot_folder:str) -> int:
+
+        """
+        Adds the listings of a snapshot folder that are not indexed yet.
+
+        :return: Number of new fingerprints.
+        """
+
+        name = os.path.basename(snapshot_folder.rstrip('/'))
+        added = 0
+
+        with self.connection:
+            for html_file in page_source_files(snapshot_folder):
+                cards = extract_cards(read_page_source(html_file))
+
+                for link, text in cards:
+                    if not link:
+                        continue
+
+                    ad_id = ad_id_from_link(link)
+                    if self.connection.execute("SELECT 1 FROM fingerprints WHERE ad_id = ?", (ad_id,)).fetchone():
+                        continue
+
+                    signature = minhash(text)
+                    if signature is None:
+                        continue
+
+                    self.connection.execute(
+                        "INSERT INTO fingerprints (ad_id, link, first_seen, signature) VALUES (?, ?, ?, ?)",
+                        (ad_id, link, name, struct.pack(f'<{NUM_PERM}I', *signature))
+                    )
+                    self.connection.executemany(
+                        "INSERT INTO bands (band_key, ad_id) VALUES (?, ?)",
+                        [(key, ad_id) for key in band_keys(signature)]
+                    )
+                    added += 1
+
+            self.connection.execute("INSERT OR IGNORE INTO indexed_snapshots (name) VALUES (?)", (name,))
+
+        return added
+
+    def update(self, snapshot_folders:list) -> int:
+
+        """
+        Indexes the finished snapshots (a .json and no journal, see RunJournal) that are not
+        indexed yet. An interrupted run is indexed once its resumed run is complete.
+
+        :return: Number of fingerprints added.
+        """
+
+        indexed = {row[0] for row in self.connection.execute("SELECT name FROM indexed_snapshots")}
+
+        added = 0
+        for folder in sorted(snapshot_folders):
+            folder = folder.rstrip('/')
+            if os.path.basename(folder) in indexed:
+                continue
+            if not os.path.isfile(folder + '.json') or os.path.isfile(journal_path(folder)):
+                continue
+            added += self.index_snapshot(folder)
+
+        return added
+
+    def find_original(self, ad_id:str):
+
+        """
+        :return: (link, similarity) of the most similar listing that was seen before ad_id
+                 under another ad id, None if ad_id is not a repost (or not indexed).
+        """
+
+        row = self.connection.execute(
+            "SELECT first_seen, signature FROM fingerprints WHERE ad_id = ?", (ad_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        first_seen, signature = row[0], list(struct.unpack(f'<{NUM_PERM}I', row[1]))
+        keys = band_keys(signature)
+
+        candidates = self.connection.execute(f"""
+            SELECT DISTINCT f.ad_id, f.link, f.signature FROM bands b JOIN fingerprints f ON f.ad_id = b.ad_id
+            WHERE b.band_key IN ({','.join('?' * len(keys))}) AND f.ad_id != ? AND f.first_seen < ?
+        """, keys + [ad_id, first_seen]).fetchall()
+
+        best = None
+        for _, link, candidate_signature in candidates:
+            score = similarity(signature, struct.unpack(f'<{NUM_PERM}I', candidate_signature))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (link, score)
+
+        return best
+
+    def find_reposts(self, link_dict:dict) -> dict:
+
+        """
+        :param link_dict: Dictionary with features as keys and lists of links as values.
+        :return: Dictionary with the re-posted links as keys and the link of the earlier listing
+                 as values.
+        """
+
+        reposts = {}
+        for links in link_dict.values():
+            for link in links:
+                original = self.find_original(ad_id_from_link(link))
+                if original is not None:
+                    reposts[link] = original[0]
+
+        return reposts
@@ -0,0 +1,131 @@
+import json, os, threading
+
+
+def journal_path(snapshot_folder:str) -> str:
+    # page_source_folder/<config>/2024-01-31-18/ -> page_source_folder/<config>/2024-01-31-18.journal
+    return snapshot_folder.rstrip('/') + '.journal'
+
+
+def write_atomic(path:str, data) -> None:
+
+    """
+    Writes data (str or bytes) to path through a temporary file that replaces it in one step, so
+    a reader never sees a half written file, even if the run dies while writing.
+    """
+
+    with open(path + ".tmp", 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def resumable_folder(config_folder_path:str) -> str:
+
+    """
+    :return: The newest snapshot folder of a config that has a journal but no .json yet, i.e.
+             a run that was interrupted, None if there is none.
+    """
+
+    if not os.path.isdir(config_folder_path):
+        return None
+
+    for name in sorted(os.listdir(config_folder_path), reverse=True):
+        if not name.endswith('.journal'):
+            continue
+
+        folder = os.path.join(config_folder_path, name[:-len('.journal')])
+        if os.path.isdir(folder) and not os.path.isfile(folder + '.json'):
+            return folder
+
+    return None
+
+
+class RunJournal:
+
+    def __init__(self, snapshot_folder:str):
+
+        """
+        Checkpoints of a scrape run, appended to <yyyy-mm-dd-hh>.journal next to the snapshot
+        folder (one json object per line):
+
+            {"event": "page", "feature": <feat url>, "page": 3, "writer": {...}, "links": [...], ...}
+            {"event": "feature_done", "feature": <feat url>, "paths": [...], "links": {...}}
+
+        A page entry is written after the page is on disk; it holds the state of the feature's
+        PageSourceWriter (file and byte offset) and of the pagination, so an interrupted run
+        continues with the next page instead of starting over. The journal is deleted once the
+        snapshot .json is written.
+
+        functions:
+
+        record_page() - checkpoint after a page was saved.
+        record_feature() - a feature is finished.
+        feature_state() - what an earlier, interrupted run did for a feature.
+        """
+
+        self.path = journal_path(snapshot_folder)
+        self.lock = threading.Lock()
+
+        self.last_pages = {}  # feat url -> last page entry
+        self.page_links = {}  # feat url -> [(part name, links of the page), ...] (streaming mode)
+        self.done = {}  # feat url -> feature_done entry
+
+        if os.path.isfile(self.path):
+            self._load()
+
+        self.file = open(self.path, 'a')
+
+    def _load(self) -> None:
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        # the last line of a killed run can be cut off, it is dropped so new entries start on a
+        # line of their own
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(len(complete))
+
+        for line in complete.decode().splitlines():
+            entry = json.loads(line)
+
+            if entry["event"] == "page":
+                self.last_pages[entry["feature"]] = entry
+                if entry["links"] is not None:
+                    self.page_links.setdefault(entry["feature"], []).append((entry["part"], entry["links"]))
+            elif entry["event"] == "feature_done":
+                self.done[entry["feature"]] = entry
+
+    def _append(self, entry:dict) -> None:
+
+        line = json.dumps(entry)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def record_page(self, feat_url:str, page:int, part_name:str, writer_state:dict, links:list = None,
+                    **pagination) -> None:
+        self._append({"event": "page", "feature": feat_url, "page": page, "part": part_name,
+                      "writer": writer_state, "links": links, **pagination})
+
+    def record_feature(self, feat_url:str, paths:list, links:dict = None) -> None:
+        self._append({"event": "feature_done", "feature": feat_url, "paths": paths, "links": links or {}})
+
+    def feature_state(self, feat_url:str):
+
+        """
+        :return: ("done", feature_done entry), ("partial", last page entry) or (None, None).
+        """
+
+        if feat_url in self.done:
+            return "done", self.done[feat_url]
+        if feat_url in self.last_pages:
+            return "partial", self.last_pages[feat_url]
+
+        return None, None
+
+    def close(self, remove:bool = False) -> None:
+
+        self.file.close()
+        if remove:
+            os.remove(self.path)
@@ -0,0 +1,89 @@
+import json, os
+
+from RunJournal import write_atomic
+
+
+# page_source_folder/<config>/summary.idx - not .json, only snapshots may end in .json
+SUMMARY_FILE_NAME = "summary.idx"
+
+
+def snapshot_signature(json_file:str) -> list:
+    # -reparse keeps the mtime of a rewritten .json, its ctime changes
+    stat = os.stat(json_file)
+    return [os.path.basename(json_file), stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size]
+
+
+class RunSummary:
+
+    def __init__(self, config_folder_path:str):
+
+        """
+        Precomputed answers of the query flags of a config, written at the end of every -run
+        (LinkHandler.update_summary) to page_source_folder/<config>/summary.idx:
+
+            {"snapshots": [[<name>.json, mtime_ns, ctime_ns, size], ...], "timetable": [...],
+             "current_diff": {...}, "reposts": {...}}
+
+        The summary only counts while the snapshot .json files are exactly the ones it was built
+        from (names, mtimes, ctimes and sizes). After -reparse, a deleted or a new snapshot it is stale
+        and the flags fall back to reading the snapshots.
+
+        functions:
+
+        is_current() - True if the summary matches the given snapshot .json files.
+        save() - writes the summary.
+        """
+
+        self.path = os.path.join(config_folder_path, SUMMARY_FILE_NAME)
+        self.data = None
+
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError):
+                # a broken summary is rebuilt by the next run
+                self.data = None
+
+    def is_current(self, json_files:list) -> bool:
+
+        if self.data is None or len(self.data["snapshots"]) != len(json_files):
+            return False
+
+        try:
+            return all(snapshot_signature(json_file) == snapshot
+                       for json_file, snapshot in zip(json_files, self.data["snapshots"]))
+        except FileNotFoundError:
+            return False
+
+    def timetable_rows(self, json_files:list) -> dict:
+
+        """
+        :return: The timetable rows of the summary that are still valid for the given (mtime
+                 ordered) json files, keyed by snapshot name, so that only new snapshots have to
+                 be counted.
+        """
+
+        if self.data is None:
+            return {}
+
+        rows = {}
+        for json_file, snapshot, row in zip(json_files, self.data["snapshots"], self.data["timetable"]):
+            # a changed snapshot changes its own row and the rows after it
+            if not os.path.isfile(json_file) or snapshot_signature(json_file) != snapshot:
+                break
+            rows[snapshot[0]] = row
+
+        return rows
+
+    def save(self, json_files:list, timetable:list, current_diff:dict, reposts:dict) -> None:
+
+        self.data = {
+            "snapshots": [snapshot_signature(json_file) for json_file in json_files],
+            "timetable": timetable,
+            "current_diff": current_diff,
+            "reposts": reposts,
+        }
+
+        # the query flags may read it at any time
+        write_atomic(self.path, json.dumps(self.data))
@@ -0,0 +1,275 @@
+import hashlib, json, os, re, sqlite3
+from urllib.parse import urlsplit
+
+
+# listing urls end in '...-ID<id>.html' or in a long number
+AD_ID_PATTERNS = [
+    re.compile(r'-ID([0-9A-Za-z]+)(?:\.html?)?$'),
+    re.compile(r'(\d{5,})(?:\.html?)?$'),
+]
+
+
+def ad_id_from_link(link:str) -> str:
+
+    """
+    Returns the ad id of a listing link. Links without a recognizable id are identified by
+    their url without query string and fragment.
+    """
+
+    parts = urlsplit(link)
+    path = parts.path.rstrip('/')
+
+    for pattern in AD_ID_PATTERNS:
+        match = pattern.search(path)
+        if match:
+            return match.group(1)
+
+    return parts.netloc + path
+
+
+# snapshot folders are named after the hour of the run
+SNAPSHOT_FOLDER_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}-\d{2}$')
+
+
+def snapshot_folders(config_folder_path:str) -> list[str]:
+
+    # page_source_folder/<config>/<yyyy-mm-dd-hh>/ folders, oldest first
+    if not os.path.isdir(config_folder_path):
+        return []
+
+    return sorted(
+        os.path.join(config_folder_path, folder) for folder in os.listdir(config_folder_path)
+        if SNAPSHOT_FOLDER_PATTERN.match(folder) and os.path.isdir(os.path.join(config_folder_path, folder))
+    )
+
+
+def snapshot_name(json_file:str) -> str:
+    # page_source_folder/<config>/2024-01-31-18.json -> 2024-01-31-18
+    return os.path.basename(json_file).replace('.json', '')
+
+
+def file_digest(path:str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+# stay below sqlite's limit of host parameters per statement
+SQLITE_CHUNK_SIZE = 500
+
+
+def in_chunks(values) -> iter:
+
+    """
+    Splits values for sqlite 'IN (...)' queries.
+
+    :return: Iterator over (chunk, placeholders) pairs, placeholders being '?,?,...' for the chunk.
+    """
+
+    values = list(values)
+    for start in range(0, len(values), SQLITE_CHUNK_SIZE):
+        chunk = values[start:start + SQLITE_CHUNK_SIZE]
+        yield chunk, ",".join("?" * len(chunk))
+
+
+# bumped when the tables change; an index of an older version is dropped and rebuilt by update()
+SCHEMA_VERSION = 2
+
+
+class SeenIndex:
+
+    def __init__(self, config_folder_path:str):
+
+        """
+        Persistent index of every listing ever seen for one config, stored in
+        page_source_folder/<config>/seen_index.sqlite. Every ad id has the link it was seen with
+        and the first and last snapshot (yyyy-mm-dd-hh) it appeared in.
+
+        Snapshots are added incrementally: update() only reads the .json files that are not in
+        the index yet (or changed since), so the cost of a diff does not grow with the history.
+        A snapshot counts as changed if its mtime, ctime or size differ and its content hash does
+        too (-reparse rewrites a .json but keeps its mtime). The ad ids of every snapshot are kept
+        in the sightings table, so a changed snapshot replaces its old rows instead of adding to them.
+
+        functions:
+
+        update() - adds new or changed snapshot .json files to the index.
+        new_links() - links of a snapshot whose ad id was not seen in any earlier snapshot.
+        first_seen_counts() - number of never seen ad ids per snapshot.
+        """
+
+        self.db_path = os.path.join(config_folder_path, "seen_index.sqlite")
+        self.connection = sqlite3.connect(self.db_path)
+
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.connection.executescript(f"""
+                DROP TABLE IF EXISTS listings;
+                DROP TABLE IF EXISTS snapshots;
+                DROP TABLE IF EXISTS sightings;
+                PRAGMA user_version = {SCHEMA_VERSION};
+            """)
+
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS listings (
+                ad_id TEXT PRIMARY KEY,
+                link TEXT NOT NULL,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                name TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                ctime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                link_count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sightings (
+                snapshot TEXT NOT NULL,
+                ad_id TEXT NOT NULL,
+                PRIMARY KEY (snapshot, ad_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS sightings_ad_id ON sightings (ad_id);
+        """)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def is_indexed(self, json_file:str) -> bool:
+
+        name = snapshot_name(json_file)
+        row = self.connection.execute(
+            "SELECT mtime_ns, ctime_ns, size, digest FROM snapshots WHERE name = ?", (name,)
+        ).fetchone()
+
+        if row is None:
+            return False
+
+        stat = os.stat(json_file)
+        if (stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size) == row[:3]:
+            return True
+
+        # touched since it was indexed (rewritten, copied, renamed): only the content counts
+        if stat.st_size != row[2] or file_digest(json_file) != row[3]:
+            return False
+
+        with self.connection:
+            self.connection.execute("UPDATE snapshots SET mtime_ns = ?, ctime_ns = ? WHERE name = ?",
+                                    (stat.st_mtime_ns, stat.st_ctime_ns, name))
+        return True
+
+    def add_snapshot(self, json_file:str, link_dict:dict = None) -> None:
+
+        """
+        Indexes a snapshot. If it was indexed before, its old ad ids are replaced: ads that are no
+        longer in it get their first and last snapshot from the remaining sightings (or are
+        dropped if it was their only one).
+        """
+
+        name = snapshot_name(json_file)
+        stat = os.stat(json_file)
+        digest = file_digest(json_file)
+
+        if link_dict is None:
+            with open(json_file, 'r') as f:
+                link_dict = json.load(f)
+
+        rows = [(ad_id_from_link(link), link, name, name) for links in link_dict.values() for link in links]
+        ad_ids = {row[0] for row in rows}
+
+        with self.connection:
+            old_ad_ids = {row[0] for row in self.connection.execute(
+                "SELECT ad_id FROM sightings WHERE snapshot = ?", (name,)
+            )}
+            self.connection.execute("DELETE FROM sightings WHERE snapshot = ?", (name,))
+            self.connection.executemany("INSERT INTO sightings (snapshot, ad_id) VALUES (?, ?)",
+                                        [(name, ad_id) for ad_id in ad_ids])
+
+            self.connection.executemany("""
+                INSERT INTO listings (ad_id, link, first_seen, last_seen) VALUES (?, ?, ?, ?)
+                ON CONFLICT (ad_id) DO UPDATE SET
+                    first_seen = min(first_seen, excluded.first_seen),
+                    last_seen = max(last_seen, excluded.last_seen)
+            """, rows)
+
+            for chunk, placeholders in in_chunks(old_ad_ids - ad_ids):
+                self.connection.execute(
+                    f"DELETE FROM listings WHERE ad_id IN ({placeholders}) "
+                    "AND NOT EXISTS (SELECT 1 FROM sightings WHERE sightings.ad_id = listings.ad_id)", chunk
+                )
+                self.connection.execute(f"""
+                    UPDATE listings SET
+                        first_seen = (SELECT min(snapshot) FROM sightings WHERE sightings.ad_id = listings.ad_id),
+                        last_seen = (SELECT max(snapshot) FROM sightings WHERE sightings.ad_id = listings.ad_id)
+                    WHERE ad_id IN ({placeholders})
+                """, chunk)
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO snapshots (name, mtime_ns, ctime_ns, size, digest, link_count) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size, digest, len(rows))
+            )
+
+    def update(self, json_files:list) -> int:
+
+        """
+        Adds every snapshot that is not indexed yet.
+
+        :return: Number of snapshots that were read.
+        """
+
+        added = 0
+        for json_file in json_files:
+            if not self.is_indexed(json_file):
+                self.add_snapshot(json_file)
+                added += 1
+
+        return added
+
+    def seen_before(self, ad_ids:list, name:str) -> set:
+
+        """
+        :return: The ad ids that appeared in a snapshot older than the snapshot name.
+        """
+
+        seen = set()
+        for chunk, placeholders in in_chunks(ad_ids):
+            seen.update(row[0] for row in self.connection.execute(
+                f"SELECT ad_id FROM listings WHERE first_seen < ? AND ad_id IN ({placeholders})",
+                [name] + chunk
+            ))
+
+        return seen
+
+    def first_seen_counts(self) -> dict:
+
+        """
+        :return: Snapshot name -> number of ad ids that appeared for the first time in it.
+        """
+
+        return dict(self.connection.execute("SELECT first_seen, COUNT(*) FROM listings GROUP BY first_seen"))
+
+    def new_links(self, json_file:str) -> dict:
+
+        """
+        Computes the diff of a snapshot against all earlier snapshots. Only the snapshot itself is
+        read; the earlier ones have to be in the index already (see update()).
+
+        :return: Dictionary with the features as keys and the links with unseen ad ids as values.
+        """
+
+        with open(json_file, 'r') as f:
+            link_dict = json.load(f)
+
+        name = snapshot_name(json_file)
+        all_ad_ids = {ad_id_from_link(link) for links in link_dict.values() for link in links}
+        seen = self.seen_before(all_ad_ids, name)
+
+        new_dict = {}
+        for key, value in link_dict.items():
+            new_dict[key] = list({link for link in value if ad_id_from_link(link) not in seen})
+
+        # index this snapshot too, so the next diff does not have to read it again
+        if not self.is_indexed(json_file):
+            self.add_snapshot(json_file, link_dict)
+
+        return new_dict
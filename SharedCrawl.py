@@ -0,0 +1,159 @@
+import json, os, shutil, time
+
+from ConfigExpander import dedup_key
+from CrawlScheduler import CrawlScheduler
+from FeatPageScraper import FeatPageScraper
+from PageFetcher import make_fetcher
+
+
+class SharedCrawl:
+
+    def __init__(self, config_file_paths:list, sleeper:int = 1, headless:bool = True, testing:bool = False):
+
+        """
+        Runs several search configs as one crawl: the feature urls of all configs are merged into
+        one queue without duplicates, which runs on one fetcher and one scheduler (the strictest
+        per-host limits of all configs, see CrawlScheduler.from_configs). Every config still gets
+        its own snapshot folder and .json; a url that several configs share is fetched once, by
+        the first config that has it, and its files and links are copied to the others.
+
+        The per-feature settings (pagination, incremental, streaming) of that first config apply
+        to a shared url.
+
+        functions:
+
+        run() - scrapes all configs and writes their snapshot .json files.
+        """
+
+        self.scrapers = [FeatPageScraper(path, sleeper=sleeper, headless=headless, testing=testing)
+                         for path in config_file_paths]
+
+        configs = []
+        for path in config_file_paths:
+            with open(path, 'r') as file:
+                configs.append(json.load(file))
+
+        # one browser pool / connection pool for everything: a browser as soon as one config needs it
+        kinds = [config.get("fetcher", "selenium") for config in configs]
+        kind = "selenium" if "selenium" in kinds else "auto" if "auto" in kinds else "http"
+        url_patterns = [pattern for config in configs for pattern in config.get("selenium_url_patterns", [])]
+        lean_browser = next((config["lean_browser"] for config in configs if config.get("lean_browser")), None)
+
+        self.fetcher = make_fetcher(kind, headless=headless, selenium_url_patterns=url_patterns,
+                                    lean_browser=lean_browser)
+        self.scheduler = CrawlScheduler.from_configs(configs, sleeper=sleeper)
+
+        for scraper in self.scrapers:
+            scraper.fetcher = self.fetcher
+            scraper.scheduler = self.scheduler
+
+    def _copy_feature(self, owner:FeatPageScraper, owner_url:str, paths:list,
+                      scraper:FeatPageScraper, feat_url:str) -> list[str]:
+
+        """
+        Gives a scraper the result of a feature url that another config fetched.
+
+        :return: Paths of the copied html files, None if the feature had no results or failed.
+        """
+
+        if owner_url in owner.failed_features:
+            scraper.failed_features.append(feat_url)
+            return None
+
+        owner_mods = owner.feat_mods(owner_url)
+        feat_mods = scraper.feat_mods(feat_url)
+
+        def renamed(name:str) -> str:
+            return feat_mods + name[len(owner_mods):]
+
+        copied = None
+        if paths is not None:
+            copied = []
+            for path in paths:
+                copy = os.path.join(scraper.current_config_folder_path, renamed(os.path.basename(path)))
+                shutil.copyfile(path, copy)
+                copied.append(copy)
+
+        # links of streaming mode, keyed <feat_mods> or <feat_mods>-partN
+        links = {renamed(key): list(value) for key, value in list(owner.link_dict.items())
+                 if key == owner_mods or key.startswith(owner_mods + '-part')}
+        scraper.link_dict.update(links)
+
+        if scraper.journal:
+            scraper.journal.record_feature(feat_url, copied, links)
+
+        return copied
+
+    def run(self) -> list:
+
+        """
+        :return: The FeatPageScraper of every config that got a snapshot.
+        """
+
+        scrapers = []
+        queue = {}  # dedup key -> [(scraper, its feature url), ...], the first one fetches
+        total = 0
+
+        for scraper in self.scrapers:
+            scraper.generate_links_from_config_json()
+            if scraper.start_snapshot() is None:
+                continue
+
+            scrapers.append(scraper)
+            for feat_url in scraper.feat_links:
+                queue.setdefault(dedup_key(feat_url), []).append((scraper, feat_url))
+                total += 1
+
+        print(f"\n --- Shared crawl: {len(scrapers)} configs, {total} feature URLs, {len(queue)} unique --- \n")
+
+        items = list(queue.items())
+
+        def process_feat_link(numbered_item) -> tuple:
+
+            counter, (key, owners) = numbered_item
+            owner, owner_url = owners[0]
+
+            print(f" \n\n -----> Processing feature URL {counter}/{len(items)}\n"
+                  f"Link : {owner_url}\n\n")
+
+            paths = owner.save_page_source(owner_url)
+            results = {(id(owner), owner_url): paths}
+
+            for scraper, feat_url in owners[1:]:
+                state, _ = scraper.journal.feature_state(feat_url) if scraper.journal else (None, None)
+                if state == "done":
+                    # copied before an interruption, the journal has it
+                    results[(id(scraper), feat_url)] = scraper.save_page_source(feat_url)
+                else:
+                    results[(id(scraper), feat_url)] = self._copy_feature(owner, owner_url, paths, scraper, feat_url)
+
+            print(f' -----> Finished processing {owner_url}\n' + "-" * 50)
+
+            return results
+
+        start = time.perf_counter()
+        fetcher_stats = self.fetcher.stats()
+
+        results = {}
+        for feature_results in self.scheduler.map(process_feat_link, enumerate(items, start=1)):
+            results.update(feature_results)
+
+        # every config gets its paths in its own feat_links order
+        for scraper in scrapers:
+            for feat_url in scraper.feat_links:
+                paths = results.get((id(scraper), feat_url))
+                if paths is not None:
+                    scraper.page_source_paths.extend(paths)
+
+        self.scheduler.print_report(time.perf_counter() - start)
+
+        # every config's trace gets the numbers of the whole shared crawl
+        for scraper in scrapers:
+            scraper.trace_run(time.perf_counter() - start, fetcher_stats)
+
+        self.fetcher.close()
+
+        for scraper in scrapers:
+            scraper.get_links_from_html_folder()
+
+        return scrapers
@@ -0,0 +1,174 @@
+import hashlib, json, os, struct, sys
+from array import array
+
+from RunJournal import write_atomic
+from SeenIndex import ad_id_from_link
+
+try:
+    import numpy as np
+except ImportError:
+    # the sidecars still work without numpy, the set operations just run in pure python
+    np = None
+
+
+MAGIC = b"GJADIDS1"
+
+
+def ad_key(link:str) -> int:
+
+    """
+    64 bit integer key of a listing link: a hash of its ad id (see SeenIndex.ad_id_from_link).
+    """
+
+    digest = hashlib.blake2b(ad_id_from_link(link).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def sidecar_path(json_file:str) -> str:
+    # page_source_folder/<config>/2024-01-31-18.json -> page_source_folder/<config>/2024-01-31-18.adids
+    return json_file[:-len('.json')] + '.adids'
+
+
+def write_sidecar(json_file:str, link_dict:dict = None) -> str:
+
+    """
+    Writes the compact sidecar of a snapshot .json file:
+
+        8 bytes    magic 'GJADIDS1'
+        8 bytes    header length (little endian)
+        header     json: feature -> [start, end], 'all' -> [start, end], link count, json mtime/size
+        padding    up to a multiple of 8 bytes
+        data       int64 little endian: the sorted ad keys of every feature, then the sorted
+                   unique ad keys of the whole snapshot ('all')
+
+    The data part can be memory-mapped with numpy.memmap.
+
+    :return: Path of the sidecar.
+    """
+
+    if link_dict is None:
+        with open(json_file, 'r') as f:
+            link_dict = json.load(f)
+
+    data = array('q')
+    features = {}
+
+    for feature, links in link_dict.items():
+        keys = sorted({ad_key(link) for link in links})
+        features[feature] = [len(data), len(data) + len(keys)]
+        data.extend(keys)
+
+    all_keys = sorted(set(data))
+    header = {
+        "features": features,
+        "all": [len(data), len(data) + len(all_keys)],
+        "link_count": sum(len(links) for links in link_dict.values()),
+        "json_mtime_ns": os.stat(json_file).st_mtime_ns,
+        "json_size": os.path.getsize(json_file),
+    }
+    data.extend(all_keys)
+
+    if sys.byteorder != "little":
+        data.byteswap()
+
+    header_bytes = json.dumps(header).encode()
+    padding = b"\0" * (-(16 + len(header_bytes)) % 8)
+
+    path = sidecar_path(json_file)
+    write_atomic(path, MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes + padding + data.tobytes())
+
+    return path
+
+
+class SnapshotSidecar:
+
+    def __init__(self, path:str):
+
+        """
+        Read-only view of a sidecar. With numpy the ad keys are a memory-mapped int64 array,
+        without numpy they are read into an array('q').
+        """
+
+        with open(path, 'rb') as f:
+            if f.read(8) != MAGIC:
+                raise ValueError(f"{path} is not a snapshot sidecar.")
+            header_length = struct.unpack("<Q", f.read(8))[0]
+            self.header = json.loads(f.read(header_length))
+
+        self.path = path
+        self.data_offset = 16 + header_length + (-(16 + header_length) % 8)
+        self.count = self.header["all"][1]
+        self.link_count = self.header["link_count"]
+
+        if np is not None:
+            if self.count:
+                self.data = np.memmap(path, dtype='<i8', mode='r', offset=self.data_offset, shape=(self.count,))
+            else:
+                self.data = np.zeros(0, dtype='<i8')
+        else:
+            self.data = array('q')
+            with open(path, 'rb') as f:
+                f.seek(self.data_offset)
+                self.data.fromfile(f, self.count)
+            if sys.byteorder != "little":
+                self.data.byteswap()
+
+    def is_fresh(self, json_file:str) -> bool:
+        return (self.header["json_mtime_ns"] == os.stat(json_file).st_mtime_ns
+                and self.header["json_size"] == os.path.getsize(json_file))
+
+    def all_keys(self):
+        # sorted and unique
+        start, end = self.header["all"]
+        return self.data[start:end]
+
+
+def load_sidecar(json_file:str) -> SnapshotSidecar:
+
+    """
+    Returns the sidecar of a snapshot .json file, (re)building it first if it is missing or
+    older than the json.
+    """
+
+    path = sidecar_path(json_file)
+
+    if os.path.isfile(path):
+        sidecar = SnapshotSidecar(path)
+        if sidecar.is_fresh(json_file):
+            return sidecar
+
+    return SnapshotSidecar(write_sidecar(json_file))
+
+
+def count_new(current_keys, previous_keys) -> int:
+
+    """
+    Number of keys in current_keys that are not in previous_keys (both sorted and unique).
+    """
+
+    if np is not None:
+        return int(np.setdiff1d(current_keys, previous_keys, assume_unique=True).size)
+
+    previous_keys = set(previous_keys)
+    return sum(1 for key in current_keys if key not in previous_keys)
+
+
+def new_keys(current_keys, previous_keys):
+
+    if np is not None:
+        return np.setdiff1d(current_keys, previous_keys, assume_unique=True)
+
+    previous_keys = set(previous_keys)
+    return [key for key in current_keys if key not in previous_keys]
+
+
+def merge_keys(history_keys, current_keys):
+
+    """
+    Sorted unique union of two sorted unique key arrays.
+    """
+
+    if np is not None:
+        return np.union1d(history_keys, current_keys)
+
+    return sorted(set(history_keys).union(current_keys))
@@ -0,0 +1,331 @@
+import glob, gzip, hashlib, json, os, re, time
+from datetime import datetime, timedelta
+
+from RunJournal import journal_path, write_atomic
+from SeenIndex import SNAPSHOT_FOLDER_PATTERN, snapshot_folders
+
+try:
+    import zstandard
+except ImportError:
+    # gzip is always there, zstd is used only if the package is installed
+    zstandard = None
+
+
+# page_source_folder/<config>/objects/ - the compressed pages of all snapshots of a config
+STORE_FOLDER = "objects"
+
+# <feat_mods>.pages / <feat_mods>-partN.pages: the manifest that replaces an .html file
+MANIFEST_EXTENSION = ".pages"
+
+COMPRESSED_EXTENSIONS = (".gz", ".zst")
+
+# the saved files are page sources written one after the other, every page starts here
+PAGE_START = re.compile(rb'(?:<!doctype[^>]*>\s*)?<html[\s>]', re.IGNORECASE)
+
+
+def split_pages(data:bytes) -> list[bytes]:
+
+    # lossless: the pages joined together are the file again
+    starts = [match.start() for match in PAGE_START.finditer(data)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+
+    return [data[start:end] for start, end in zip(starts, starts[1:] + [len(data)]) if end > start]
+
+
+def page_source_files(folder:str) -> list[str]:
+
+    """
+    The page sources of a snapshot folder, raw (.html) or in the store (.pages), sorted.
+    """
+
+    files = glob.glob(os.path.join(folder, '*.html')) + glob.glob(os.path.join(folder, '*' + MANIFEST_EXTENSION))
+    return sorted(files)
+
+
+def page_source_name(path:str) -> str:
+    # page_source_folder/<config>/2024-01-31-18/<feat_mods>-part2.pages -> <feat_mods>-part2
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def read_page_source(path:str) -> str:
+
+    """
+    The content of a page source file, whether it is a raw .html file or a manifest whose pages
+    are in the store of its config.
+    """
+
+    if not path.endswith(MANIFEST_EXTENSION):
+        with open(path, 'r') as f:
+            return f.read()
+
+    # page_source_folder/<config>/<snapshot>/<name>.pages -> page_source_folder/<config>
+    store = SnapshotStore(os.path.dirname(os.path.dirname(os.path.abspath(path))))
+    return b''.join(store.get(name) for name in store.read_manifest(path)).decode()
+
+
+class SnapshotStore:
+
+    def __init__(self, config_folder_path:str, compression:str = "gzip", level:int = None,
+                 keep_snapshots:int = None, keep_days:float = None):
+
+        """
+        Compressed, content-addressed storage for the page sources of a config. Every page is
+        stored once, as objects/<2 hex>/<blake2b of the page>.gz (or .zst), however many
+        snapshots contain it. A snapshot keeps one small manifest per html file,
+        <feat_mods>.pages / <feat_mods>-partN.pages, with the object names of its pages in order.
+
+        read_page_source() / page_source_files() read both stored and raw snapshots, so the
+        parsers do not care which one they get.
+
+        functions:
+
+        pack_folder() - moves the .html files of a finished snapshot into the store.
+        drop_page_sources() - deletes the manifests of a snapshot, its .json stays.
+        collect_garbage() - deletes objects that no manifest refers to any more.
+        compact() - packs old raw snapshots, applies the retention and collects the garbage.
+        """
+
+        if compression == "zstd" and zstandard is None:
+            print(" ---> zstandard is not installed, the page sources are stored with gzip.")
+            compression = "gzip"
+
+        self.config_folder_path = config_folder_path
+        self.folder = os.path.join(config_folder_path, STORE_FOLDER)
+        self.compression = compression
+        self.extension = ".zst" if compression == "zstd" else ".gz"
+        self.level = level
+
+        # retention of compact(): the page sources of older snapshots are dropped
+        self.keep_snapshots = keep_snapshots
+        self.keep_days = keep_days
+
+    @classmethod
+    def from_config(cls, config_folder_path:str, config:dict):
+
+        """
+        Reads the optional 'snapshot_store' block of a search config, e.g.
+
+            "snapshot_store": {"enabled": true, "compression": "zstd", "keep_snapshots": 48, "keep_days": 14}
+        """
+
+        store = config.get("snapshot_store", {})
+
+        return cls(
+            config_folder_path,
+            compression=store.get("compression", "gzip"),
+            level=store.get("level"),
+            keep_snapshots=store.get("keep_snapshots"),
+            keep_days=store.get("keep_days"),
+        )
+
+    def object_path(self, name:str) -> str:
+        return os.path.join(self.folder, name[:2], name)
+
+    def compress(self, page:bytes) -> bytes:
+
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=self.level or 10).compress(page)
+        return gzip.compress(page, compresslevel=self.level or 6)
+
+    def put(self, page:bytes) -> tuple:
+
+        """
+        :return: The object name of the page and the number of bytes newly written (0 if the
+                 page was already stored).
+        """
+
+        digest = hashlib.blake2b(page, digest_size=20).hexdigest()
+
+        # the same page may have been stored with the other compression
+        for extension in COMPRESSED_EXTENSIONS:
+            existing = self.object_path(digest + extension)
+            if os.path.isfile(existing):
+                # until the manifest of the new snapshot is written nothing refers to the old object,
+                # a fresh mtime keeps collect_garbage() from deleting it in between
+                try:
+                    os.utime(existing)
+                except FileNotFoundError:
+                    continue
+                return digest + extension, 0
+
+        name = digest + self.extension
+        path = self.object_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data = self.compress(page)
+
+        write_atomic(path, data)
+
+        return name, len(data)
+
+    def get(self, name:str) -> bytes:
+
+        with open(self.object_path(name), 'rb') as f:
+            data = f.read()
+
+        if name.endswith(".zst"):
+            if zstandard is None:
+                raise ImportError(f"{name} is zstd compressed, install zstandard to read it.")
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+        return gzip.decompress(data)
+
+    def read_manifest(self, path:str) -> list[str]:
+        with open(path, 'r') as f:
+            return json.load(f)["pages"]
+
+    def pack_file(self, html_path:str) -> dict:
+
+        """
+        Replaces an .html file with its manifest.
+
+        :return: Pages of the file, its size and the bytes the store grew by.
+        """
+
+        with open(html_path, 'rb') as f:
+            data = f.read()
+
+        names, written = [], 0
+        for page in split_pages(data):
+            name, size = self.put(page)
+            names.append(name)
+            written += size
+
+        manifest_path = html_path[:-len('.html')] + MANIFEST_EXTENSION
+        manifest = json.dumps({"size": len(data), "pages": names})
+
+        # the manifest is complete before the html file goes
+        write_atomic(manifest_path, manifest)
+        os.remove(html_path)
+
+        return {"pages": len(names), "raw_bytes": len(data), "stored_bytes": written + len(manifest)}
+
+    def pack_folder(self, snapshot_folder:str) -> dict:
+
+        """
+        Moves all .html files of a snapshot folder into the store. Only for finished snapshots:
+        the .html files of a running or interrupted run are still written to.
+
+        :return: Files, pages, raw bytes and the bytes the store grew by.
+        """
+
+        # the .html files are deleted once packed, never touch a folder that is not a snapshot
+        if not SNAPSHOT_FOLDER_PATTERN.match(os.path.basename(os.path.normpath(snapshot_folder or ""))):
+            raise ValueError(f"Not a snapshot folder: {snapshot_folder!r}")
+
+        totals = {"files": 0, "pages": 0, "raw_bytes": 0, "stored_bytes": 0}
+
+        for html_path in sorted(glob.glob(os.path.join(snapshot_folder, '*.html'))):
+            packed = self.pack_file(html_path)
+            totals["files"] += 1
+            for key in ("pages", "raw_bytes", "stored_bytes"):
+                totals[key] += packed[key]
+
+        return totals
+
+    def manifests(self) -> list[str]:
+        return glob.glob(os.path.join(self.config_folder_path, '*', '*' + MANIFEST_EXTENSION))
+
+    def size(self) -> int:
+
+        total = 0
+        for root, _, files in os.walk(self.folder):
+            total += sum(os.path.getsize(os.path.join(root, file)) for file in files)
+
+        return total
+
+    def drop_page_sources(self, snapshot_folder:str) -> int:
+
+        """
+        Retention: deletes the page sources (manifests and raw .html files) of a snapshot. Its
+        .json and the indexes built from it stay, only -reparse can no longer re-read it.
+        The objects are deleted by the next collect_garbage().
+
+        :return: Number of deleted files.
+        """
+
+        files = page_source_files(snapshot_folder)
+        for path in files:
+            os.remove(path)
+
+        return len(files)
+
+    def collect_garbage(self, min_age_seconds:float = 3600) -> tuple:
+
+        """
+        Deletes the objects no manifest refers to. Objects younger than min_age_seconds are kept,
+        they may belong to a snapshot that is being packed right now.
+
+        :return: Number and bytes of the deleted objects.
+        """
+
+        referenced = set()
+        for manifest in self.manifests():
+            referenced.update(self.read_manifest(manifest))
+
+        removed, removed_bytes = 0, 0
+        oldest_allowed = time.time() - min_age_seconds
+
+        for path in glob.glob(os.path.join(self.folder, '*', '*')):
+            name = os.path.basename(path)
+            if name in referenced or os.path.getmtime(path) > oldest_allowed:
+                continue
+
+            removed_bytes += os.path.getsize(path)
+            os.remove(path)
+            removed += 1
+
+        return removed, removed_bytes
+
+    def compact(self) -> None:
+
+        """
+        Packs the raw .html files of all finished snapshots (e.g. from before the store
+        existed), drops the page sources of the snapshots beyond the retention and deletes the
+        objects nobody needs any more.
+
+        Retention: the page sources of the keep_snapshots newest snapshots and of those of the
+        last keep_days days are kept (None = no limit by that rule). A snapshot is dropped only if
+        it is outside of both.
+        """
+
+        size_before = self.size()
+
+        # a snapshot is finished once it has its .json and no journal, see RunJournal
+        finished = [folder for folder in snapshot_folders(self.config_folder_path)
+                    if os.path.isfile(folder + '.json') and not os.path.isfile(journal_path(folder))]
+
+        packed = {"files": 0, "pages": 0, "raw_bytes": 0, "stored_bytes": 0}
+        for folder in finished:
+            for key, value in self.pack_folder(folder).items():
+                packed[key] += value
+
+        # a snapshot kept by either rule is kept, only those every set rule lets go are expired
+        expired = None
+        if self.keep_snapshots is not None:
+            expired = set(finished[:max(0, len(finished) - self.keep_snapshots)])
+        if self.keep_days is not None:
+            oldest_allowed = datetime.now() - timedelta(days=self.keep_days)
+            too_old = {folder for folder in finished
+                       if datetime.strptime(os.path.basename(folder), "%Y-%m-%d-%H") < oldest_allowed}
+            expired = too_old if expired is None else expired & too_old
+        expired = sorted(expired or [])
+
+        dropped = sum(self.drop_page_sources(folder) for folder in expired)
+        removed, removed_bytes = self.collect_garbage()
+
+        raw_total = 0
+        for manifest in self.manifests():
+            with open(manifest, 'r') as f:
+                raw_total += json.load(f)["size"]
+
+        size_after = self.size()
+
+        print(f"\n --- Compacted {self.config_folder_path} --- \n")
+        print(f" ---> {packed['files']} html files ({packed['raw_bytes'] / 1048576:.1f} MiB, {packed['pages']} pages) "
+              f"packed into {packed['stored_bytes'] / 1048576:.1f} MiB")
+        print(f" ---> page sources of {len(expired)} snapshot(s) dropped ({dropped} files), "
+              f"{removed} unused objects deleted ({removed_bytes / 1048576:.1f} MiB)")
+        print(f" ---> store: {size_before / 1048576:.1f} MiB -> {size_after / 1048576:.1f} MiB, "
+              f"holding {raw_total / 1048576:.1f} MiB of page sources")
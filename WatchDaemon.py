@@ -0,0 +1,245 @@
+import heapq, json, os, random, time, urllib.request
+from datetime import datetime, timedelta
+
+from FeatPageScraper import FeatPageScraper
+from LinkHandler import LinkHandler
+from PageFetcher import make_fetcher
+
+
+def parse_cron_field(field:str, low:int, high:int) -> set:
+
+    """
+    One field of a cron expression: '*', '5', '1,15', '9-17', '*/10' or '0-30/5'.
+    """
+
+    values = set()
+    for part in field.split(','):
+        part, _, step = part.partition('/')
+        step = int(step) if step else 1
+
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-'))
+        else:
+            start = end = int(part)
+
+        if start < low or end > high or start > end:
+            raise ValueError(f"Cron field '{field}' is out of range {low}-{high}.")
+
+        values.update(range(start, end + 1, step))
+
+    return values
+
+
+class CronSchedule:
+
+    def __init__(self, expression:str):
+
+        """
+        Minimal 5 field cron schedule: 'minute hour day-of-month month day-of-week', e.g.
+        '15 7-22 * * *' (every hour from 7:15 to 22:15) or '*/30 * * * 1-5'.
+        Day of week is 0-6, 0 = Sunday. Like cron, a restricted day of month and day of week
+        match if either of them matches.
+        """
+
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{expression}' must have 5 fields.")
+
+        self.minutes = parse_cron_field(fields[0], 0, 59)
+        self.hours = parse_cron_field(fields[1], 0, 23)
+        self.days = parse_cron_field(fields[2], 1, 31)
+        self.months = parse_cron_field(fields[3], 1, 12)
+        self.weekdays = {day % 7 for day in parse_cron_field(fields[4], 0, 7)}
+
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment:datetime) -> bool:
+
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment:datetime) -> datetime:
+
+        # skip whole months / days / hours that cannot match instead of testing every minute
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+
+        raise ValueError("Cron expression never matches.")
+
+
+class WatchDaemon:
+
+    def __init__(self, config_file_paths:list, after_run=None, headless:bool = True):
+
+        """
+        Stays resident and scrapes every config on its own schedule, the 'watch' block of a
+        search config:
+
+            "watch": {"interval_minutes": 60, "jitter_seconds": 120, "notify_url": "http://..."}
+            "watch": {"cron": "15 7-22 * * *"}
+
+        The fetchers (warm browsers, pooled HTTP connections) are kept open between runs and
+        shared by the configs with the same fetcher settings. Every run starts up to
+        jitter_seconds after its scheduled time, so configs with the same schedule do not burst.
+        Snapshots are written as with -run; since the folders are named after the hour, a config
+        never runs twice in the same hour. After every run the new links are printed, and
+        POSTed as json to notify_url if there is one.
+
+        functions:
+
+        run_forever() - runs the schedule until Ctrl-C.
+        """
+
+        self.config_file_paths = config_file_paths
+        self.after_run = after_run
+        self.headless = headless
+
+        self.watch_settings = {}
+        for path in config_file_paths:
+            with open(path, 'r') as file:
+                config = json.load(file)
+            self.watch_settings[path] = (config.get("watch", {}), config)
+
+        self.fetchers = {}  # (fetcher kind, selenium url patterns, lean browser) -> warm fetcher
+        self.last_run_hour = {}  # config path -> '%Y-%m-%d-%H' of its last run
+
+    def _fetcher_for(self, config:dict):
+
+        kind = config.get("fetcher", "selenium")
+        key = (kind, tuple(config.get("selenium_url_patterns", [])),
+               json.dumps(config.get("lean_browser"), sort_keys=True))
+
+        if key not in self.fetchers:
+            self.fetchers[key] = make_fetcher(kind, headless=self.headless,
+                                              selenium_url_patterns=config.get("selenium_url_patterns", []),
+                                              lean_browser=config.get("lean_browser"))
+        return self.fetchers[key]
+
+    def next_run(self, config_file_path:str, after:datetime) -> datetime:
+
+        watch, _ = self.watch_settings[config_file_path]
+
+        if "cron" in watch:
+            scheduled = CronSchedule(watch["cron"]).next_after(after)
+        else:
+            scheduled = after + timedelta(minutes=watch.get("interval_minutes", 60))
+
+        # one snapshot folder per hour: a second run in the same hour waits for the next one
+        if scheduled.strftime("%Y-%m-%d-%H") == self.last_run_hour.get(config_file_path):
+            scheduled = scheduled.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+        return scheduled + timedelta(seconds=random.uniform(0, watch.get("jitter_seconds", 0)))
+
+    def run_config(self, config_file_path:str) -> dict:
+
+        """
+        One scrape of a config with the warm fetcher.
+
+        :return: The new links of the run, None if no snapshot was written.
+        """
+
+        _, config = self.watch_settings[config_file_path]
+
+        scraper = FeatPageScraper(config_file_path, headless=self.headless)
+        scraper.fetcher = self._fetcher_for(config)
+        scraper.close_fetcher = False
+
+        self.last_run_hour[config_file_path] = time.strftime("%Y-%m-%d-%H")
+
+        scraper.generate_links_from_config_json()
+        scraper.scrape_and_save_search_sources()
+        if not scraper.current_config_folder_path:
+            return None
+        scraper.get_links_from_html_folder()
+
+        if not os.path.isfile(scraper.current_config_folder_path + ".json"):
+            return None
+
+        if self.after_run is not None:
+            self.after_run(config_file_path)
+
+        link_handler = LinkHandler(config_file_path)
+        diff = link_handler.get_current_diff()
+        reposts = link_handler.get_reposts(diff)
+        link_handler.print_links(diff, reposts)
+
+        return {"config": config_file_path, "snapshot": os.path.basename(scraper.current_config_folder_path),
+                "new_links": diff, "reposts": reposts}
+
+    def notify(self, notify_url:str, result:dict) -> None:
+
+        request = urllib.request.Request(notify_url, data=json.dumps(result).encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                print(f" ---> Diff sent to {notify_url} ({response.status})")
+        except OSError as e:
+            # the next run sends its own diff, a failed notification is not retried
+            print(f" ---> Could not send the diff to {notify_url}: {e}")
+
+    def run_forever(self, cycles:int = None) -> None:
+
+        """
+        :param cycles: Stop after this many runs (None = until Ctrl-C).
+        """
+
+        queue = []
+        now = datetime.now()
+        for counter, path in enumerate(self.config_file_paths):
+            watch, _ = self.watch_settings[path]
+            # the first runs are spread out over the jitter window instead of all starting now
+            first = now + timedelta(seconds=random.uniform(0, watch.get("jitter_seconds", 0)))
+            heapq.heappush(queue, (first, counter, path))
+
+        print(f"\n --- Watching {len(self.config_file_paths)} config(s), Ctrl-C to stop --- \n")
+
+        runs = 0
+        try:
+            while queue and (cycles is None or runs < cycles):
+                scheduled, counter, path = heapq.heappop(queue)
+
+                wait = (scheduled - datetime.now()).total_seconds()
+                if wait > 0:
+                    print(f" ---> Next run: {path} at {scheduled:%Y-%m-%d %H:%M:%S}")
+                    time.sleep(wait)
+
+                print(f"\n------- > Watch run of {path} .....")
+                try:
+                    result = self.run_config(path)
+                except Exception as e:
+                    # one failed run must not stop the daemon, an interrupted run is resumed next time
+                    print(f" ---> Run of {path} failed: {e!r}")
+                    result = None
+
+                watch, _ = self.watch_settings[path]
+                if result is not None and watch.get("notify_url"):
+                    self.notify(watch["notify_url"], result)
+
+                runs += 1
+                heapq.heappush(queue, (self.next_run(path, datetime.now()), counter, path))
+
+        except KeyboardInterrupt:
+            print("\n ---> Watch stopped.")
+
+        finally:
+            for fetcher in self.fetchers.values():
+                fetcher.close()
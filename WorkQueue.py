@@ -0,0 +1,313 @@
+import json, os, sqlite3, threading, time
+from contextlib import contextmanager
+
+from CrawlScheduler import HostLimiter
+
+
+# page_source_folder/work_queue.sqlite - shared by the coordinator and all -worker processes
+QUEUE_FILE_NAME = "work_queue.sqlite"
+
+# page_source_folder/<config>/<yyyy-mm-dd-hh>/.work/<item id>-<attempt>/ - what a worker fetched
+# for one item, moved into the snapshot folder by the coordinator
+STAGING_FOLDER = ".work"
+
+
+def queue_path() -> str:
+    return os.path.join("page_source_folder", QUEUE_FILE_NAME)
+
+
+def connect(path:str) -> sqlite3.Connection:
+
+    # autocommit, transactions are opened explicitly with BEGIN IMMEDIATE; the timeout covers the
+    # other processes holding the write lock
+    return sqlite3.connect(path, timeout=60, isolation_level=None)
+
+
+class WorkQueue:
+
+    def __init__(self, path:str = None):
+
+        """
+        SQLite work queue of a queue crawl (see QueueCrawl), one item per feature url:
+
+            pending -> leased (by a worker, until lease_until) -> done / failed
+
+        A worker claims an item with a lease and keeps extending it (heartbeat) while it fetches
+        the pages. If the worker dies, the lease runs out and the next claim hands the item to
+        another worker; an item that was claimed max_attempts times is failed. A worker can only
+        complete an item it still holds, a late result of a lost lease is thrown away.
+
+        Every call opens its own connection, so the queue can be used from any thread and any
+        number of processes. Workers on other machines need page_source_folder on a shared file
+        system with working file locks.
+
+        functions:
+
+        enqueue() - adds the feature urls of a snapshot.
+        claim() - leases the next item to a worker.
+        heartbeat() - extends a lease.
+        complete() / fail() - the result of an item.
+        finished() - True once no item of the given snapshots is pending or leased.
+        items() / remove() - the items of a snapshot, for the coordinator.
+        """
+
+        self.path = path or queue_path()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        with self.connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    config TEXT NOT NULL,
+                    snapshot TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    feature TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    lease_seconds REAL NOT NULL,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    result TEXT,
+                    UNIQUE (snapshot, feature)
+                );
+                CREATE INDEX IF NOT EXISTS items_state ON items (state, id);
+                CREATE TABLE IF NOT EXISTS rate_limit (
+                    host TEXT PRIMARY KEY,
+                    next_slot REAL NOT NULL
+                );
+            """)
+
+    @contextmanager
+    def connection(self):
+        connection = connect(self.path)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def transaction(self):
+
+        # BEGIN IMMEDIATE takes the write lock right away, two workers can never claim the same item
+        with self.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def enqueue(self, config:str, snapshot:str, feat_urls:list, lease_seconds:float = 60,
+                max_attempts:int = 3) -> int:
+
+        """
+        Adds the feature urls of a snapshot. Urls that are already queued for it keep their state,
+        failed ones get a new set of attempts (a resumed queue crawl).
+
+        :return: Number of items that have to be (re)fetched.
+        """
+
+        config = os.path.normpath(config)
+
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO items (config, snapshot, position, feature, lease_seconds, max_attempts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(config, snapshot, position, feat_url, lease_seconds, max_attempts)
+                 for position, feat_url in enumerate(feat_urls)]
+            )
+            connection.execute("UPDATE items SET state = 'pending', attempts = 0, owner = NULL "
+                               "WHERE snapshot = ? AND state = 'failed'", (snapshot,))
+            return connection.execute("SELECT COUNT(*) FROM items WHERE snapshot = ? AND state != 'done'",
+                                      (snapshot,)).fetchone()[0]
+
+    def claim(self, owner:str, configs:list = None) -> dict:
+
+        """
+        Leases the oldest pending item, or one whose lease ran out.
+
+        :param configs: Only items of these config files, default: any.
+        :return: The item as a dictionary, None if there is nothing to do.
+        """
+
+        now = time.time()
+        only_configs = ""
+        parameters = [now]
+        if configs is not None:
+            only_configs = f" AND config IN ({','.join('?' * len(configs))})"
+            parameters += [os.path.normpath(config) for config in configs]
+
+        with self.transaction() as connection:
+            # the worker of these items died (or hung) on their last attempt
+            connection.execute("UPDATE items SET state = 'failed', owner = NULL, result = ? "
+                               "WHERE state = 'leased' AND lease_until < ? AND attempts >= max_attempts",
+                               (json.dumps({"error": "lease expired"}), now))
+
+            row = connection.execute(
+                "SELECT id, config, snapshot, feature, lease_seconds, attempts FROM items "
+                "WHERE (state = 'pending' OR (state = 'leased' AND lease_until < ?))" + only_configs +
+                " ORDER BY id LIMIT 1", parameters
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            item_id, config, snapshot, feature, lease_seconds, attempts = row
+            connection.execute("UPDATE items SET state = 'leased', owner = ?, lease_until = ?, attempts = ? "
+                               "WHERE id = ?", (owner, now + lease_seconds, attempts + 1, item_id))
+
+        return {"id": item_id, "config": config, "snapshot": snapshot, "feature": feature,
+                "lease_seconds": lease_seconds, "attempt": attempts + 1}
+
+    def heartbeat(self, item:dict, owner:str) -> bool:
+
+        """
+        :return: False if the lease was lost, i.e. the item belongs to another worker now.
+        """
+
+        with self.transaction() as connection:
+            return connection.execute(
+                "UPDATE items SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                (time.time() + item["lease_seconds"], item["id"], owner)
+            ).rowcount == 1
+
+    def complete(self, item:dict, owner:str, result:dict) -> bool:
+
+        """
+        :return: False if the lease was lost, the result is not recorded then.
+        """
+
+        with self.transaction() as connection:
+            return connection.execute(
+                "UPDATE items SET state = 'done', result = ?, lease_until = NULL "
+                "WHERE id = ? AND owner = ? AND state = 'leased'",
+                (json.dumps(result), item["id"], owner)
+            ).rowcount == 1
+
+    def fail(self, item:dict, owner:str, error:str) -> str:
+
+        """
+        Gives an item back: it is tried again until it was claimed max_attempts times.
+
+        :return: The new state of the item, None if the lease was lost.
+        """
+
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE items SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, lease_until = NULL, result = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                (json.dumps({"error": error}), item["id"], owner)
+            )
+            if cursor.rowcount != 1:
+                return None
+            return connection.execute("SELECT state FROM items WHERE id = ?", (item["id"],)).fetchone()[0]
+
+    def counts(self, snapshots:list) -> dict:
+
+        placeholders = ','.join('?' * len(snapshots))
+        with self.connection() as connection:
+            return dict(connection.execute(
+                f"SELECT state, COUNT(*) FROM items WHERE snapshot IN ({placeholders}) GROUP BY state", snapshots
+            ).fetchall())
+
+    def finished(self, snapshots:list) -> bool:
+        counts = self.counts(snapshots)
+        return not counts.get("pending") and not counts.get("leased")
+
+    def items(self, snapshot:str) -> list[dict]:
+
+        """
+        :return: The items of a snapshot in the order of its feature urls, with their results.
+        """
+
+        with self.connection() as connection:
+            rows = connection.execute("SELECT id, feature, state, attempts, result FROM items "
+                                      "WHERE snapshot = ? ORDER BY position", (snapshot,)).fetchall()
+
+        return [{"id": item_id, "feature": feature, "state": state, "attempts": attempts,
+                 "result": json.loads(result) if result else None}
+                for item_id, feature, state, attempts, result in rows]
+
+    def remove(self, snapshot:str) -> None:
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM items WHERE snapshot = ?", (snapshot,))
+
+
+class SharedTokenBucket:
+
+    def __init__(self, path:str, host:str, rate:float, burst:int = 1):
+
+        """
+        TokenBucket (same acquire()) whose state is a row of the rate_limit table of the work
+        queue, so all processes share one request rate per host. The row holds the next free
+        request slot (epoch seconds); taking a token reserves a slot in a transaction and sleeps
+        until it comes. Up to burst slots can be taken ahead, as with TokenBucket.
+        A rate of 0 (or less) means unlimited.
+        """
+
+        self.path = path
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate:float) -> None:
+        with self.lock:
+            self.rate = rate
+
+    def acquire(self) -> float:
+
+        """
+        Blocks until the reserved slot comes.
+
+        :return: Seconds spent waiting.
+        """
+
+        if self.rate <= 0:
+            return 0.0
+
+        interval = 1 / self.rate
+
+        connection = connect(self.path)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT next_slot FROM rate_limit WHERE host = ?", (self.host,)).fetchone()
+            now = time.time()
+            next_slot = max(now, row[0] if row else now)
+            connection.execute("INSERT OR REPLACE INTO rate_limit (host, next_slot) VALUES (?, ?)",
+                               (self.host, next_slot + interval))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+        # the first burst - 1 slots may be used before their time
+        wait = next_slot - (self.burst - 1) * interval - now
+        if wait > 0:
+            time.sleep(wait)
+
+        return max(wait, 0.0)
+
+
+class SharedHostLimiter(HostLimiter):
+
+    def __init__(self, path:str, requests_per_second:float = 1.0, burst:int = 1, max_in_flight:int = 1,
+                 adaptive:dict = None):
+
+        """
+        HostLimiter whose request rate holds across processes (SharedTokenBucket in the work queue
+        database), used by the -worker processes of a queue crawl. max_in_flight and the adaptive
+        rate (the spacing of the slots a worker reserves) still count per process.
+        """
+
+        super().__init__(requests_per_second, burst, max_in_flight, adaptive)
+        self.path = path
+
+    def _host_state(self, host:str):
+
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = SharedTokenBucket(self.path, host, self.requests_per_second, self.burst)
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_in_flight)
+            return self.buckets[host], self.semaphores[host]
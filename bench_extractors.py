@@ -0,0 +1,146 @@
+import argparse, glob, multiprocessing, os, re, resource, shutil, tempfile, time, tracemalloc
+
+from ListingExtractor import EXTRACTORS, get_extractor
+from SnapshotStore import MANIFEST_EXTENSION, read_page_source
+
+
+def find_page_sources(folders:list) -> list[str]:
+
+    """
+    Collects all saved page sources (.html and -partN.html files, or their .pages manifests in
+    the SnapshotStore) below the given folders.
+    """
+
+    files = []
+    for folder in folders:
+        files.extend(glob.glob(os.path.join(folder, '**', '*.html'), recursive=True))
+        files.extend(glob.glob(os.path.join(folder, '**', '*' + MANIFEST_EXTENSION), recursive=True))
+
+    return sorted(files)
+
+
+def count_pages(html_content:str) -> int:
+    # saved files are several page sources concatenated
+    return max(1, len(re.findall(r'<html[\s>]', html_content, flags=re.IGNORECASE)))
+
+
+def run_backend(backend:str, files:list, result_queue) -> None:
+
+    """
+    Runs in a fresh process, so the peak RSS belongs to this backend alone.
+    The files are read before the clock starts, only the extraction is timed.
+    """
+
+    extract = get_extractor(backend)
+
+    sources = [read_page_source(file) for file in files]
+
+    pages = sum(count_pages(source) for source in sources)
+
+    try:
+        # warm up (imports, caches)
+        extract(sources[0])
+    except ImportError as e:
+        result_queue.put((backend, None, str(e)))
+        return
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    links = [extract(source) for source in sources]
+    elapsed = time.perf_counter() - start
+
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # second pass for the python heap peak, tracemalloc slows things down so it is not timed
+    tracemalloc.start()
+    for source in sources:
+        extract(source)
+    heap_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result_queue.put((backend, {
+        "pages": pages,
+        "seconds": elapsed,
+        "rss_growth_kib": rss_peak - rss_before,
+        "heap_peak_kib": heap_peak // 1024,
+        "links": links,
+    }, None))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the link extraction backends on saved page sources.")
+    parser.add_argument("folders", nargs="*", default=["page_source_folder"],
+                        help="folders with saved page sources (default: page_source_folder)")
+    parser.add_argument("-b", "--backends", nargs="+", default=list(EXTRACTORS), choices=list(EXTRACTORS))
+    parser.add_argument("--fake-pages", type=int, default=0,
+                        help="benchmark on N pages generated by FakeListingSite instead of saved files")
+    args = parser.parse_args()
+
+    if args.fake_pages:
+        from FakeListingSite import FakeListingSite
+
+        site = FakeListingSite(listings_per_feature=args.fake_pages * 20, page_size=20)
+        folder = tempfile.mkdtemp(prefix="bench_extractors_")
+
+        # 25 pages per file, like the -partN.html files of the scraper
+        for part in range(0, args.fake_pages, 25):
+            pages = range(part + 1, min(part + 25, args.fake_pages) + 1)
+            with open(os.path.join(folder, f"fake-part{part // 25 + 1}.html"), 'w') as f:
+                f.write(''.join(site.render_page("/fake?", page) for page in pages))
+        site.server.server_close()
+
+        args.folders = [folder]
+
+    try:
+        benchmark(find_page_sources(args.folders), args.backends)
+    finally:
+        if args.fake_pages:
+            shutil.rmtree(args.folders[0])
+
+
+def benchmark(files:list, backends:list) -> None:
+
+    if not files:
+        print(f"No page sources found. Run a scrape first or use --fake-pages N.")
+        return
+
+    size = sum(os.path.getsize(file) for file in files)
+    print(f"\n --- Benchmarking {len(files)} files ({size / 1024 / 1024:.1f} MiB) --- \n")
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+
+    for backend in backends:
+        result_queue = context.Queue()
+        process = context.Process(target=run_backend, args=(backend, files, result_queue))
+        process.start()
+        name, result, error = result_queue.get()
+        process.join()
+
+        if error:
+            print(f" {backend:>7} : skipped ({error})")
+            continue
+        results[name] = result
+
+    reference = results.get("bs4")
+
+    for backend, result in results.items():
+        pages_per_second = result["pages"] / result["seconds"] if result["seconds"] else float("inf")
+
+        if reference is None or backend == "bs4":
+            identical = "reference" if backend == "bs4" else "n/a"
+        else:
+            mismatched = [file for file, a, b in zip(files, result["links"], reference["links"]) if a != b]
+            identical = "identical" if not mismatched else f"DIFFERS in {len(mismatched)} files"
+
+        print(
+            f" {backend:>7} : {pages_per_second:8.1f} pages/s  {result['seconds']:7.2f}s  "
+            f"peak rss +{result['rss_growth_kib'] / 1024:6.1f} MiB  "
+            f"peak python heap {result['heap_peak_kib'] / 1024:6.1f} MiB  links: {identical}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import argparse, contextlib, glob, io, json, os, resource, shutil, statistics, tempfile, time
+from datetime import datetime, timedelta
+
+from CrawlTrace import percentile, read_trace, trace_path
+from FakeListingSite import FakeListingSite
+from FeatPageScraper import FeatPageScraper
+from LinkHandler import LinkHandler
+from generic_jacker import after_run
+
+
+def bench_config(site:FakeListingSite, args) -> dict:
+
+    """
+    Search config of the benchmark: args.features feature urls with listings and
+    args.empty_features without any, on the fake site.
+    """
+
+    link_mods = [f"apartamente-{i}/timis/" for i in range(args.features)]
+    link_mods += [f"empty-{i}/timis/" for i in range(args.empty_features)]
+
+    config = {
+        "base_link": site.base_url + "/",
+        "link_mods": link_mods,
+        "spec_mods": {"?area=": {"apply_to_all": ["centru"]}},
+        "fetcher": args.fetcher,
+        "extractor": args.extractor,
+        "streaming": args.streaming,
+        "politeness": {"max_concurrent_features": args.concurrency, "max_in_flight": args.concurrency,
+                       "requests_per_second": args.rps},
+    }
+
+    # e.g. --config '{"incremental": {"enabled": true}}'
+    config.update(json.loads(args.config))
+
+    return config
+
+
+def rename_snapshot(config_folder_path:str, snapshot_folder:str, name:str) -> str:
+
+    """
+    Snapshot folders are named after the hour, so every round is moved to an hour of its own
+    (with its .json, .adids and .trace.jsonl), the next round can then start a new snapshot.
+    """
+
+    new_folder = os.path.join(config_folder_path, name)
+    for path in glob.glob(snapshot_folder + '*'):
+        os.rename(path, new_folder + path[len(snapshot_folder):])
+
+    return new_folder
+
+
+def run_round(config_file_path:str, site:FakeListingSite, round_name:str) -> dict:
+
+    """
+    One -run of the config: expansion, fetch, parse, index and diff, each phase timed.
+    """
+
+    requests_before, errors_before, throttled_before = site.requests, site.errors, site.throttled
+    timings = {}
+
+    start = time.perf_counter()
+    scraper = FeatPageScraper(config_file_path)
+    scraper.generate_links_from_config_json()
+    timings["expand"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scraper.scrape_and_save_search_sources()
+    timings["crawl"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    link_dict = scraper.get_links_from_html_folder()
+    timings["parse"] = time.perf_counter() - start
+
+    snapshot = rename_snapshot(scraper.config_folder_path, scraper.current_config_folder_path, round_name)
+
+    start = time.perf_counter()
+    after_run(config_file_path)
+    timings["index"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    diff = LinkHandler(config_file_path).get_current_diff()
+    timings["diff"] = time.perf_counter() - start
+
+    fetches = [event for event in read_trace(trace_path(snapshot)) if event["event"] == "fetch"]
+    latencies = [event["fetch_seconds"] for event in fetches]
+
+    return {
+        "timings": timings,
+        "seconds": sum(timings.values()),
+        "requests": site.requests - requests_before,
+        "errors": site.errors - errors_before,
+        "throttled": site.throttled - throttled_before,
+        "pages": len(fetches),
+        "bytes": sum(event.get("bytes", 0) for event in fetches),
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p90": percentile(latencies, 0.9),
+        "latency_p99": percentile(latencies, 0.99),
+        "links": len({link for links in link_dict.values() for link in links}),
+        "new_links": sum(len(links) for links in diff.values()),
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def expected_results(args) -> list:
+
+    """
+    The links and new links every round has to find, one (links, new_links) pair per round.
+    Without incremental mode every round has all listings of the site. In incremental mode a
+    round stops paginating a feature after stop_after_known_pages pages in a row with only
+    listings of the last lookback_snapshots rounds, so the rounds are replayed page by page for
+    one feature (every feature with listings looks the same, new listings come first).
+    """
+
+    incremental = json.loads(args.config).get("incremental", {})
+    enabled = incremental.get("enabled", False)
+    lookback = incremental.get("lookback_snapshots", 1)
+    threshold = incremental.get("known_threshold", 1.0)
+    known_pages = incremental.get("stop_after_known_pages", 1)
+    min_pages = incremental.get("min_pages", 1)
+
+    # the listing numbers (see FakeListingSite.render_listing) every round fetched
+    snapshots, seen, expected = [], set(), []
+    for counter in range(args.rounds):
+        numbers = [index - counter * args.new_per_round for index in range(args.listings)]
+        known = set().union(*snapshots[-lookback:]) if enabled else set()
+
+        fetched, known_pages_in_a_row = [], 0
+        for page, start in enumerate(range(0, len(numbers), args.page_size), start=1):
+            page_numbers = numbers[start:start + args.page_size]
+            fetched.extend(page_numbers)
+            if not known:
+                continue
+
+            if sum(1 for number in page_numbers if number in known) >= threshold * len(page_numbers):
+                known_pages_in_a_row += 1
+            else:
+                known_pages_in_a_row = 0
+            if known_pages_in_a_row >= known_pages and page >= min_pages:
+                break
+
+        fetched = set(fetched)
+        expected.append((args.features * len(fetched), args.features * len(fetched - seen)))
+        snapshots.append(fetched)
+        seen |= fetched
+
+    return expected
+
+
+def print_results(results:list, expected:list) -> None:
+
+    print(f"\n {'round':>5} {'time':>7} {'expand':>7} {'crawl':>7} {'parse':>7} {'index':>7} {'diff':>7} "
+          f"{'req':>6} {'pages':>6} {'pg/s':>7} {'MiB':>6} {'p50':>6} {'p90':>6} {'p99':>6} "
+          f"{'links':>6} {'new':>5} {'rss':>7}")
+
+    for counter, result in enumerate(results, start=1):
+        timings = result["timings"]
+        pages_per_second = result["pages"] / timings["crawl"] if timings["crawl"] else 0.0
+        print(f" {counter:>5} {result['seconds']:>6.2f}s {timings['expand']:>6.3f}s {timings['crawl']:>6.2f}s "
+              f"{timings['parse']:>6.2f}s {timings['index']:>6.2f}s {timings['diff']:>6.3f}s "
+              f"{result['requests']:>6} {result['pages']:>6} {pages_per_second:>7.1f} "
+              f"{result['bytes'] / 1048576:>6.1f} {result['latency_p50'] * 1000:>4.0f}ms "
+              f"{result['latency_p90'] * 1000:>4.0f}ms {result['latency_p99'] * 1000:>4.0f}ms "
+              f"{result['links']:>6} {result['new_links']:>5} {result['peak_rss_mib']:>5.0f}MiB")
+
+    # every round has to find the listings it fetched and the added ones, see expected_results()
+    print()
+    errors, throttled = sum(result["errors"] for result in results), sum(result["throttled"] for result in results)
+    if errors or throttled:
+        print(f" ---> The site answered {errors} requests with a 500 and throttled {throttled} (429)")
+    for counter, (result, (expected_links, expected_new)) in enumerate(zip(results, expected), start=1):
+        if result["links"] != expected_links or result["new_links"] != expected_new:
+            print(f" ---> Round {counter}: expected {expected_links} links and {expected_new} new ones, "
+                  f"got {result['links']} and {result['new_links']}   <-- WRONG RESULT")
+
+    if len(results) > 1:
+        later = [result["seconds"] for result in results[1:]]
+        print(f" ---> Rounds after the first: median {statistics.median(later):.2f}s per run")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the whole -run pipeline (expansion, fetch, parse, diff) against a local "
+                    "FakeListingSite, no request leaves the machine.")
+    parser.add_argument("--features", type=int, default=10, help="feature urls with listings (default: 10)")
+    parser.add_argument("--empty-features", type=int, default=2,
+                        help="feature urls without results (default: 2)")
+    parser.add_argument("--listings", type=int, default=200, help="listings per feature (default: 200)")
+    parser.add_argument("--page-size", type=int, default=20, help="listings per page (default: 20)")
+    parser.add_argument("--latency", type=float, default=50, help="server latency in ms (default: 50)")
+    parser.add_argument("--jitter", type=float, default=20, help="up to this many ms more (default: 20)")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="share of requests the site answers with a 500 (default: 0)")
+    parser.add_argument("--max-rps", type=float, default=None,
+                        help="the site answers 429 above this many requests per second (default: no limit)")
+    parser.add_argument("--past-last-page", default="reloop", choices=["reloop", "repeat"],
+                        help="what the site serves after the last page (default: reloop to page 1)")
+    parser.add_argument("--rounds", type=int, default=3, help="runs of the config (default: 3)")
+    parser.add_argument("--new-per-round", type=int, default=5,
+                        help="listings added on top of every feature between rounds (default: 5)")
+    parser.add_argument("--fetcher", default="http", choices=["http", "auto", "selenium"])
+    parser.add_argument("--extractor", default="bs4")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=4, help="features fetched at once (default: 4)")
+    parser.add_argument("--rps", type=float, default=0, help="requests per second per host, 0 = unlimited")
+    parser.add_argument("--config", default="{}", help="json merged into the benchmark config")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the scraper")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary folder with the snapshots")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    site = FakeListingSite(listings_per_feature=args.listings, page_size=args.page_size,
+                           past_last_page=args.past_last_page,
+                           latency=args.latency / 1000, latency_jitter=args.jitter / 1000,
+                           error_rate=args.error_rate, max_requests_per_second=args.max_rps).start()
+
+    # the pipeline works relative to the current folder (search_configs/, page_source_folder/)
+    folder = tempfile.mkdtemp(prefix="bench_pipeline_")
+    working_directory = os.getcwd()
+    os.chdir(folder)
+
+    try:
+        os.makedirs("search_configs")
+        config_file_path = os.path.join("search_configs", "bench.json")
+        with open(config_file_path, 'w') as f:
+            json.dump(bench_config(site, args), f, indent=4)
+
+        print(f"\n --- Benchmarking {args.rounds} runs of {args.features} + {args.empty_features} features, "
+              f"{args.listings} listings each ({args.page_size} per page), {args.latency:.0f}+{args.jitter:.0f} ms "
+              f"latency, fetcher {args.fetcher} --- \n")
+
+        results = []
+        first_hour = datetime(2000, 1, 1)
+        for counter in range(args.rounds):
+            if counter:
+                site.add_listings(args.new_per_round)
+
+            output = None if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with output or contextlib.nullcontext():
+                result = run_round(config_file_path, site,
+                                   (first_hour + timedelta(hours=counter)).strftime("%Y-%m-%d-%H"))
+            results.append(result)
+            print(f" ---> Round {counter + 1}/{args.rounds}: {result['seconds']:.2f}s")
+
+        print_results(results, expected_results(args))
+
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump({"arguments": vars(args), "rounds": results}, f, indent=4)
+            print(f" ---> Results written to {json_path}")
+
+    finally:
+        os.chdir(working_directory)
+        site.stop()
+        if args.keep:
+            print(f" ---> Snapshots kept in {folder}")
+        else:
+            shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
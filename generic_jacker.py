@@ -1,9 +1,13 @@
 
-from pprint import pprint
 import sys, os, glob
 
-from FeatPageScraper import FeatPageScraper
+from CrawlTrace import print_stats
 from LinkHandler import LinkHandler
+from RunJournal import journal_path
+from SeenIndex import snapshot_folders
+
+# the scraping stack (fetchers, selenium, html parsers) is imported by the flags that need it,
+# so that the query flags (-t, -ca, -cd ...) start without it
 
 
 def check_cli_args(config_file_names) -> list:
@@ -42,11 +46,46 @@ def check_cli_args(config_file_names) -> list:
     return config_file_names
 
 
+def after_run(config:str) -> None:
+
+    # only a finished snapshot is indexed: after failed features the run keeps its journal and
+    # has no .json yet, indexing would diff (and fetch details) against the previous snapshot
+    link_handler = LinkHandler(config)
+    snapshots = snapshot_folders(link_handler.config_folder_path)
+    if not snapshots or not os.path.isfile(snapshots[-1] + ".json") or os.path.isfile(journal_path(snapshots[-1])):
+        print(f"\n---> {config}: the snapshot is incomplete, it was not indexed. "
+              f"Run the crawl again to resume it.")
+        return
+
+    from DetailFetcher import DetailFetcher
+
+    # index the new snapshot, so that -cd only has to read the newest json
+    link_handler.start_trace()
+    link_handler.update_seen_index()
+    link_handler.update_repost_index()
+    link_handler.update_listing_store()
+
+    # timetable, diff and reposts precomputed for the query flags
+    link_handler.update_summary()
+
+    # detail pages of the new listings, if the config asks for them ('details' block)
+    detail_fetcher = DetailFetcher(config)
+    if detail_fetcher.enabled:
+        new_links = link_handler.get_current_diff()
+        with link_handler.trace.span("details", links=sum(len(links) for links in new_links.values())):
+            detail_fetcher.fetch_details(new_links)
+    detail_fetcher.close()
+    link_handler.trace.close()
+
+
 def main():
     try:
 
         flag = sys.argv[1]
-        config_files = check_cli_args(sys.argv[2:])
+
+        # -f takes the filter first: generic_jacker.py -f "ppm<9 rooms>=2" [file_1][...]
+        filter_expression = sys.argv[2] if flag == "-f" else None
+        config_files = check_cli_args(sys.argv[3:] if flag == "-f" else sys.argv[2:])
    
     except FileNotFoundError as e:
         print(str(e))
@@ -60,6 +99,8 @@ def main():
 
     if flag == "-run":
 
+        from FeatPageScraper import FeatPageScraper
+
         for config in config_files:
         
             print(f"\n------- > Processing search config {config} .....")
@@ -74,6 +115,87 @@ def main():
             feat_page_scraper.scrape_and_save_search_sources()
             feat_page_scraper.get_links_from_html_folder()
 
+            after_run(config)
+
+    elif flag == "-run-shared":
+
+        from SharedCrawl import SharedCrawl
+
+        # all configs as one crawl: one queue without duplicate urls, one fetcher, one rate budget
+        for config in config_files:
+            LinkHandler(config).clean_failed_runs()
+
+        SharedCrawl(config_files).run()
+
+        for config in config_files:
+            after_run(config)
+
+    elif flag == "-queue":
+
+        from QueueCrawl import QueueCrawl
+
+        # queue the feature urls, crawl them with the -worker processes, assemble the snapshots
+        for config in config_files:
+            LinkHandler(config).clean_failed_runs()
+
+        QueueCrawl(config_files).run()
+
+        for config in config_files:
+            after_run(config)
+
+    elif flag == "-worker":
+
+        from QueueCrawl import QueueWorker
+
+        # claim and fetch queued feature urls of these configs, under the shared rate limit
+        QueueWorker.from_configs(config_files).run()
+
+    elif flag == "-watch":
+
+        from WatchDaemon import WatchDaemon
+
+        # stay resident, run every config on its 'watch' schedule with warm fetchers
+        WatchDaemon(config_files, after_run=after_run).run_forever()
+
+    elif flag == "-details":
+
+        from DetailFetcher import DetailFetcher
+
+        # fetch the detail pages of the new listings of the last snapshot, ads fetched before are skipped
+        for config in config_files:
+            link_handler = LinkHandler(config)
+            detail_fetcher = DetailFetcher(config)
+            detail_fetcher.fetch_details(link_handler.get_current_diff())
+            detail_fetcher.close()
+
+    elif flag == "-reparse":
+
+        from FeatPageScraper import FeatPageScraper
+
+        # re-extract the links of all saved snapshots, nothing is scraped
+        for config in config_files:
+            feat_page_scraper = FeatPageScraper(config)
+            feat_page_scraper.reparse_snapshots()
+
+    elif flag == "-f":
+
+        from ListingStore import ListingStore
+
+        # filter the listings of the last snapshot by their records, e.g. price per m², price drops
+        for config in config_files:
+            link_handler = LinkHandler(config)
+            listing_store = ListingStore(link_handler.config_folder_path)
+            listing_store.print_records(listing_store.query(filter_expression))
+
+    elif flag == "-compact":
+
+        from FeatPageScraper import FeatPageScraper
+
+        # pack raw snapshots into the page source store, apply its retention, delete unused pages
+        for config in config_files:
+            feat_page_scraper = FeatPageScraper(config)
+            feat_page_scraper.store.compact()
+
     else:
 
         for config in config_files:
@@ -81,7 +203,7 @@ def main():
             link_handler = LinkHandler(config)
             
             if flag == "-t":
-                link_handler.timetable()
+                link_handler.print_timetable()
             
             elif flag == "-ca":
                 to_print = link_handler.get_last_link_json()
@@ -89,7 +211,18 @@ def main():
 
             elif flag == "-cd":
                 to_print = link_handler.get_current_diff()
-                link_handler.print_links(to_print)
+                reposts = link_handler.get_reposts(to_print)
+                link_handler.print_links(to_print, reposts)
+
+            elif flag == "-cdx":
+                # current diff without the listings that are just re-posted old ones
+                to_print = link_handler.get_current_diff()
+                reposts = link_handler.get_reposts(to_print)
+                link_handler.print_links(link_handler.hide_reposts(to_print, reposts))
+
+            elif flag == "-stats":
+                # timings, throughput and regressions of the traced runs
+                print_stats(link_handler.config_folder_path)
 
             elif flag == "-cao":
                 to_open = link_handler.get_last_link_json()
@@ -106,8 +239,11 @@ def main():
             else:
                 print(
                     f"Invalid flag. Use: \n -t for timetable \n -ca for current all \n -cd for current"
-                    " diff \n -cao for current all open \n -cdo for current diff open. \n -s for specific"
-                    " json file, but this is not recommended.\n"
+                    " diff (reposts are flagged) \n -cdx for current diff without reposts \n -cao for current all open \n -cdo for current diff open. \n -s for specific"
+                    " json file, but this is not recommended.\n -run to scrape \n -run-shared to scrape all configs as one crawl \n -queue to scrape through the work queue \n -worker to fetch queued features \n -watch to keep scraping on a schedule \n -stats for run statistics \n -reparse to re-extract the links"
+                    " of all saved snapshots without scraping.\n -details to fetch the detail pages of the current diff.\n"
+                    " -compact to compress old page sources and apply the retention of 'snapshot_store'.\n"
+                    " -f \"<filter>\" to filter the last snapshot by price, surface, rooms, ppm, seen, drop, age, area.\n"
                     )
                 sys.exit(1)
         
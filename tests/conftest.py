@@ -0,0 +1,69 @@
+import json, os, re, sys
+
+import pytest
+
+# the modules live in the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FakeListingSite import FakeListingSite
+
+
+@pytest.fixture
+def start_site():
+
+    """
+    Starts FakeListingSite instances with the given options, all of them are stopped after the test.
+    """
+
+    sites = []
+
+    def start(**options) -> FakeListingSite:
+        site = FakeListingSite(**options).start()
+        sites.append(site)
+        return site
+
+    yield start
+
+    for site in sites:
+        site.stop()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    # the pipeline works relative to the current folder (search_configs/, page_source_folder/)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("search_configs")
+    return tmp_path
+
+
+def write_config(site:FakeListingSite, link_mods:list, name:str = "test", **options) -> str:
+
+    """
+    Search config of link_mods on the fake site, fetched with plain HTTP and without a rate limit.
+
+    :return: Path of the config file.
+    """
+
+    config = {
+        "base_link": site.base_url + "/",
+        "link_mods": link_mods,
+        "spec_mods": {"?area=": {"apply_to_all": ["centru"]}},
+        "fetcher": "http",
+        "politeness": {"requests_per_second": 0},
+        **options,
+    }
+
+    path = os.path.join("search_configs", name + ".json")
+    with open(path, 'w') as f:
+        json.dump(config, f)
+
+    return path
+
+
+def expected_links(site:FakeListingSite, link_mod:str) -> set:
+
+    # every listing link the site shows for the feature of link_mod (see write_config)
+    feature = f"/{link_mod}?area=centru"
+    cards = "".join(site.render_listing(feature, index) for index in range(site.listing_count(feature)))
+    return set(re.findall(r'href="([^"]+)"', cards))
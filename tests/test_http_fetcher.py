@@ -0,0 +1,109 @@
+from CrawlScheduler import HostLimiter
+from PageFetcher import FetchResult, HttpFetcher, RetryPolicy, classify_failure, has_listings
+
+
+FEATURE = "/apartamente-1/timis/?area=centru"
+
+
+def test_fetch_page(start_site):
+
+    site = start_site(listings_per_feature=30, page_size=20)
+    fetcher = HttpFetcher(timeout=5)
+
+    result = fetcher.fetch(site.base_url + FEATURE)
+    fetcher.close()
+
+    assert result.status == 200
+    assert result.current_url == site.base_url + FEATURE
+    assert result.page_source.count("data-adid") == 20
+    assert has_listings(result.page_source)
+    assert classify_failure(result) is None
+    assert result.retry_after is None
+    # the body came gzip compressed
+    assert 0 < result.size < len(result.page_source.encode())
+    assert [cookie.name for cookie in fetcher.cookie_jar] == ["session"]
+
+
+def test_keep_alive(start_site):
+
+    site = start_site()
+    fetcher = HttpFetcher(timeout=5)
+    session = fetcher.session()
+
+    for page in range(1, 4):
+        assert session.fetch(f"{site.base_url}{FEATURE}&pag={page}").status == 200
+    fetcher.close()
+
+    assert fetcher.stats()["requests"] == 3
+    assert fetcher.connections_opened == 1
+    assert site.requests == 3
+
+
+def test_redirect_past_last_page(start_site):
+
+    site = start_site(listings_per_feature=30, page_size=20)
+    fetcher = HttpFetcher(timeout=5)
+
+    result = fetcher.fetch(f"{site.base_url}{FEATURE}&pag=3")
+    fetcher.close()
+
+    # sent back to page 1, the url lost its 'pag='
+    assert result.status == 200
+    assert result.current_url == site.base_url + FEATURE
+    assert site.requests == 2
+
+
+def test_no_results(start_site):
+
+    site = start_site()
+    fetcher = HttpFetcher(timeout=5)
+
+    result = fetcher.fetch(site.base_url + "/empty-1/timis/?area=centru")
+    fetcher.close()
+
+    assert "data-adid" not in result.page_source
+    assert has_listings(result.page_source)
+    assert classify_failure(result, expect_listings=True) is None
+
+
+def test_throttled(start_site):
+
+    site = start_site(max_requests_per_second=1)
+    fetcher = HttpFetcher(timeout=5)
+
+    first = fetcher.fetch(site.base_url + FEATURE)
+    second = fetcher.fetch(site.base_url + FEATURE)
+    fetcher.close()
+
+    assert first.status == 200
+    assert second.status == 429
+    assert second.retry_after == 1.0
+    assert classify_failure(second) == "throttled"
+    assert site.throttled == 1
+
+
+def test_retry_policy_gives_up(start_site):
+
+    site = start_site(error_rate=1.0)
+    fetcher = HttpFetcher(timeout=5)
+    retry = RetryPolicy(max_retries=2, backoff_seconds=0.01, max_backoff_seconds=0.05)
+
+    result = retry.fetch(fetcher.session(), site.base_url + FEATURE, HostLimiter(requests_per_second=0),
+                         expect_listings=True)
+    fetcher.close()
+
+    assert result.status == 500
+    assert result.failure == "error"
+    assert result.attempts == 3
+    assert retry.retries == 2
+    assert retry.failures == {"error": 3}
+    assert site.requests == site.errors == 3
+
+
+def test_expect_listings():
+
+    # a page without status code (Selenium) that is neither a result page nor 'no results'
+    captcha = FetchResult("<html><body>Are you a robot?</body></html>", "https://site/x", None, 0.1, 100)
+
+    assert classify_failure(captcha) is None
+    assert classify_failure(captcha, expect_listings=True) == "empty"
@@ -0,0 +1,95 @@
+import math
+
+import pytest
+
+from FeatPageScraper import FeatPageScraper
+from Paginator import Paginator
+from conftest import expected_links, write_config
+
+
+PAGE_SIZE = 20
+
+TOTAL_PATTERN = {"total_results_pattern": "(\\d+) anunțuri", "page_size": PAGE_SIZE}
+NEXT_LINK_PATTERN = {"next_page_pattern": "rel=\"next\""}
+
+
+def crawl(config_file_path:str) -> dict:
+
+    scraper = FeatPageScraper(config_file_path)
+    scraper.generate_links_from_config_json()
+    scraper.scrape_and_save_search_sources()
+    return scraper.get_links_from_html_folder()
+
+
+# (site options, pagination block, requests the site sees beyond the pages of the feature)
+STRATEGIES = {
+    # sent back to page 1 after the last page: one more page and its redirect
+    "reloop": ({"past_last_page": "reloop"}, {}, 2),
+    # the last page again after the last page: one more page, a repeat of the one before
+    "repeat": ({"past_last_page": "repeat"}, {}, 1),
+    "total": ({"show_next_link": False}, TOTAL_PATTERN, 0),
+    "total-prefetch": ({"show_next_link": False}, {**TOTAL_PATTERN, "prefetch_pages": 2}, 0),
+    "next-link": ({"show_total": False}, NEXT_LINK_PATTERN, 0),
+}
+
+
+@pytest.mark.parametrize("listings", [50, 60])
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_past_last_page(workdir, start_site, strategy, listings):
+
+    site_options, pagination, extra_requests = STRATEGIES[strategy]
+    site = start_site(listings_per_feature=listings, page_size=PAGE_SIZE, **site_options)
+    config = write_config(site, ["apartamente-1/timis/"], pagination=pagination)
+
+    link_dict = crawl(config)
+
+    assert {link for links in link_dict.values() for link in links} == expected_links(site, "apartamente-1/timis/")
+    assert site.requests == math.ceil(listings / PAGE_SIZE) + extra_requests
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_no_results(workdir, start_site, strategy):
+
+    site_options, pagination, _ = STRATEGIES[strategy]
+    site = start_site(page_size=PAGE_SIZE, **site_options)
+    config = write_config(site, ["empty-1/timis/"], pagination=pagination)
+
+    link_dict = crawl(config)
+
+    assert not any(link_dict.values())
+    assert site.requests == 1
+
+
+def test_several_features(workdir, start_site):
+
+    site = start_site(listings_per_feature=45, page_size=PAGE_SIZE, show_next_link=False)
+    link_mods = ["apartamente-1/timis/", "apartamente-2/timis/", "empty-1/timis/"]
+    config = write_config(site, link_mods, pagination=TOTAL_PATTERN,
+                          politeness={"requests_per_second": 0, "max_concurrent_features": 2, "max_in_flight": 2})
+
+    link_dict = crawl(config)
+
+    assert {link for links in link_dict.values() for link in links} == \
+        expected_links(site, link_mods[0]) | expected_links(site, link_mods[1])
+    assert site.requests == 3 + 3 + 1
+
+
+def test_paginator_signals():
+
+    paginator = Paginator(total_results_pattern="([\\d.]+) anunțuri", page_size=20, next_page_pattern="rel=\"next\"")
+
+    assert paginator.page_count("<h1>1.234 anunțuri</h1>") == 62
+    assert paginator.page_count("<h1>0 anunțuri</h1>") == 1
+    assert paginator.page_count("<h1>no total</h1>") is None
+    assert paginator.has_next_page('<a rel="next" href="?pag=2">') is True
+    assert paginator.has_next_page('<a href="?pag=2">') is False
+    assert Paginator().has_next_page('<a rel="next">') is None
+
+    assert paginator.page_url("https://site/x/?area=centru&pag=3", 1) == "https://site/x/?area=centru"
+    assert paginator.page_url("https://site/x/?area=centru", 4) == "https://site/x/?area=centru&pag=4"
+    assert paginator.is_reloop("https://site/x/?area=centru", 5)
+    assert not paginator.is_reloop("https://site/x/?area=centru&pag=5", 5)
+
+    page = '<li data-adid="2"></li><li data-adid="1"></li>'
+    assert paginator.fingerprint(page) == paginator.fingerprint('<li data-adid="1"></li><li data-adid="2"></li>')
+    assert paginator.fingerprint("<p>nothing</p>") is None
@@ -0,0 +1,162 @@
+import json, os
+
+import pytest
+
+from FeatPageScraper import PAGES_PER_PART, FeatPageScraper, PageSourceWriter
+from RunJournal import RunJournal, journal_path, resumable_folder
+from SnapshotStore import page_source_files, read_page_source
+from conftest import expected_links, write_config
+from generic_jacker import after_run
+
+
+def page(number:int) -> str:
+    return f'<html><body><li data-adid="{number}">page {number}</li></body></html>'
+
+
+def crawl(config_file_path:str) -> FeatPageScraper:
+
+    scraper = FeatPageScraper(config_file_path)
+    scraper.generate_links_from_config_json()
+    scraper.scrape_and_save_search_sources()
+    scraper.get_links_from_html_folder()
+    return scraper
+
+
+def fail_pages(site, page_query:str) -> list:
+
+    """
+    Answers the requests for one page of every feature (e.g. 'pag=3') with a 500 while the
+    returned switch is on, i.e. [True].
+    """
+
+    failing = [True]
+    handle = site.handle
+
+    def failing_handle(request):
+        if failing[0] and request.path.endswith(page_query):
+            site.send_status(request, 500)
+            return
+        handle(request)
+
+    site.handle = failing_handle
+    return failing
+
+
+def test_restore_cuts_off_the_unrecorded_page(tmp_path):
+
+    writer = PageSourceWriter(str(tmp_path), "feature", streaming=True)
+    writer.add_page(page(1))
+    writer.add_page(page(2))
+    state = writer.state()
+    # page 3 reached the file, the run died before its checkpoint
+    writer.add_page(page(3))
+    writer.file.close()
+
+    resumed = PageSourceWriter(str(tmp_path), "feature", streaming=True)
+    resumed.restore(state)
+    with open(tmp_path / "feature.html", 'r') as f:
+        assert f.read() == page(1) + page(2)
+
+    resumed.add_page(page(3))
+    assert resumed.close() == [str(tmp_path / "feature.html")]
+    with open(tmp_path / "feature.html", 'r') as f:
+        assert f.read() == page(1) + page(2) + page(3)
+
+
+def test_restore_undoes_the_part1_rename(tmp_path):
+
+    writer = PageSourceWriter(str(tmp_path), "feature", streaming=True)
+    for number in range(1, PAGES_PER_PART - 1):
+        writer.add_page(page(number))
+    state = writer.state()
+    # the next page turns the feature into parts: feature.html becomes feature-part1.html
+    writer.add_page(page(PAGES_PER_PART - 1))
+    assert not os.path.exists(tmp_path / "feature.html")
+    assert os.path.exists(tmp_path / "feature-part1.html")
+
+    resumed = PageSourceWriter(str(tmp_path), "feature", streaming=True)
+    resumed.restore(state)
+    for number in range(PAGES_PER_PART - 1, PAGES_PER_PART + 2):
+        resumed.add_page(page(number))
+
+    assert resumed.close() == [str(tmp_path / "feature-part1.html"), str(tmp_path / "feature-part2.html")]
+    with open(tmp_path / "feature-part1.html", 'r') as f:
+        assert f.read() == "".join(page(number) for number in range(1, PAGES_PER_PART))
+    with open(tmp_path / "feature-part2.html", 'r') as f:
+        assert f.read() == "".join(page(number) for number in range(PAGES_PER_PART, PAGES_PER_PART + 2))
+
+
+def test_journal_drops_a_cut_off_line(tmp_path):
+
+    snapshot = str(tmp_path / "2024-01-31-18")
+    journal = RunJournal(snapshot)
+    journal.record_page("feature", 1, "feature", {"offset": 10}, fingerprint=None)
+    journal.close()
+    with open(journal_path(snapshot), 'a') as f:
+        f.write('{"event": "page", "feature": "feature", "pa')
+
+    journal = RunJournal(snapshot)
+    assert journal.feature_state("feature")[1]["page"] == 1
+    journal.record_feature("feature", [])
+    journal.close(remove=True)
+    assert not os.path.exists(journal_path(snapshot))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_resume_interrupted_run(workdir, start_site, streaming):
+
+    site = start_site(listings_per_feature=100, page_size=20)
+    link_mods = ["apartamente-1/timis/", "apartamente-2/timis/"]
+    config = write_config(site, link_mods, streaming=streaming, retry={"max_retries": 0})
+    failing = fail_pages(site, "pag=3")
+
+    scraper = crawl(config)
+    snapshot = scraper.current_config_folder_path
+
+    # both features stopped at page 3: no .json, the journal stays, nothing is indexed
+    assert scraper.failed_features
+    assert not os.path.exists(snapshot + ".json")
+    assert os.path.exists(journal_path(snapshot))
+    assert resumable_folder(scraper.config_folder_path) == snapshot
+    after_run(config)
+    assert not os.path.exists(os.path.join(scraper.config_folder_path, "seen_index.sqlite"))
+    assert FeatPageScraper(config).reparse_snapshots() == {}
+    assert not os.path.exists(snapshot + ".json")
+
+    failing[0] = False
+    requests_before = site.requests
+    scraper = crawl(config)
+
+    assert scraper.current_config_folder_path == snapshot
+    # only pages 3-5 and the redirect back to page 1 (2 requests) of each feature
+    assert site.requests - requests_before == 2 * (3 + 2)
+    assert not os.path.exists(journal_path(snapshot))
+
+    with open(snapshot + ".json", 'r') as f:
+        link_dict = json.load(f)
+    assert {link for links in link_dict.values() for link in links} == \
+        expected_links(site, link_mods[0]) | expected_links(site, link_mods[1])
+
+    # every page is in the page sources exactly once
+    assert sum(read_page_source(path).count("data-adid") for path in page_source_files(snapshot)) == 200
+
+
+def test_resume_feature_in_parts(workdir, start_site):
+
+    site = start_site(listings_per_feature=30 * 2, page_size=2)
+    config = write_config(site, ["apartamente-1/timis/"], retry={"max_retries": 0})
+    failing = fail_pages(site, "pag=27")
+
+    scraper = crawl(config)
+    snapshot = scraper.current_config_folder_path
+    assert sorted(os.listdir(snapshot)) == ["apartamente-1-timis-centru-part1.html",
+                                            "apartamente-1-timis-centru-part2.html"]
+
+    failing[0] = False
+    scraper = crawl(config)
+
+    with open(snapshot + ".json", 'r') as f:
+        link_dict = json.load(f)
+    assert sorted(link_dict) == ["apartamente-1-timis-centru-part1", "apartamente-1-timis-centru-part2"]
+    assert {link for links in link_dict.values() for link in links} == expected_links(site, "apartamente-1/timis/")
+    assert not os.path.exists(journal_path(snapshot))
@@ -0,0 +1,162 @@
+import contextlib, io, json, os, time
+from datetime import datetime, timedelta
+
+import pytest
+
+from FeatPageScraper import FeatPageScraper
+from RunJournal import journal_path
+from SnapshotStore import SnapshotStore, page_source_files, read_page_source
+from conftest import write_config
+
+
+PAGE_1 = '<!DOCTYPE html><html><body><li data-adid="1">one</li></body></html>\n'
+PAGE_2 = '<html lang="ro"><body><li data-adid="2">two</li></body></html>\n'
+PAGE_3 = '<html><body><li data-adid="3">three</li></body></html>'
+
+
+def make_snapshot(config_folder_path:str, name:str, pages:dict, finished:bool = True) -> str:
+
+    """
+    A snapshot folder with one .html file per feature (pages: feat_mods -> page sources) and,
+    if finished, its .json.
+    """
+
+    folder = os.path.join(config_folder_path, name)
+    os.makedirs(folder)
+    for feat_mods, sources in pages.items():
+        with open(os.path.join(folder, feat_mods + ".html"), 'w') as f:
+            f.write("".join(sources))
+
+    if finished:
+        with open(folder + ".json", 'w') as f:
+            json.dump({feat_mods: [] for feat_mods in pages}, f)
+
+    return folder
+
+
+def hours_ago(hours:int) -> str:
+    return (datetime.now() - timedelta(hours=hours)).strftime("%Y-%m-%d-%H")
+
+
+def test_pack_and_read_round_trip(tmp_path):
+
+    store = SnapshotStore(str(tmp_path))
+    folder = make_snapshot(str(tmp_path), "2024-01-31-18", {"feature": [PAGE_1, PAGE_2], "other": [PAGE_3]})
+
+    packed = store.pack_folder(folder)
+
+    assert packed["files"] == 2 and packed["pages"] == 3
+    assert sorted(os.listdir(folder)) == ["feature.pages", "other.pages"]
+    files = page_source_files(folder)
+    assert [read_page_source(path) for path in files] == [PAGE_1 + PAGE_2, PAGE_3]
+
+    # the same pages in the next snapshot are not stored again
+    folder = make_snapshot(str(tmp_path), "2024-01-31-19", {"feature": [PAGE_2, PAGE_1]})
+    size = store.size()
+    assert store.pack_folder(folder)["pages"] == 2
+    assert store.size() == size
+    assert read_page_source(os.path.join(folder, "feature.pages")) == PAGE_2 + PAGE_1
+
+
+def test_pack_folder_refuses_other_folders(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    with open("notes.html", 'w') as f:
+        f.write(PAGE_1)
+
+    store = SnapshotStore("page_source_folder/test")
+    for folder in ["", ".", str(tmp_path)]:
+        with pytest.raises(ValueError):
+            store.pack_folder(folder)
+
+    assert os.listdir(tmp_path) == ["notes.html"]
+
+
+def test_second_run_in_the_same_hour(workdir, start_site):
+
+    site = start_site(listings_per_feature=30)
+    config = write_config(site, ["apartamente-1/timis/"])
+    with open("notes.html", 'w') as f:
+        f.write(PAGE_1)
+
+    for _ in range(2):
+        scraper = FeatPageScraper(config)
+        scraper.generate_links_from_config_json()
+        scraper.scrape_and_save_search_sources()
+        scraper.get_links_from_html_folder()
+
+    # the second run has no snapshot folder: nothing is written or packed in the working directory
+    assert scraper.current_config_folder_path == ""
+    assert sorted(os.listdir(".")) == ["notes.html", "page_source_folder", "search_configs"]
+
+
+@pytest.mark.parametrize("keep_snapshots, keep_days, kept", [
+    (2, 1, [1, 2, 3]),  # the last day and the 2 newest, whichever keeps more
+    (2, None, [1, 2]),
+    (None, 1, [1, 2, 3]),
+    (4, 1, [1, 2, 3, 30 * 24]),
+    (None, None, [1, 2, 3, 30 * 24, 31 * 24]),
+])
+def test_compact_retention(tmp_path, keep_snapshots, keep_days, kept):
+
+    store = SnapshotStore(str(tmp_path), keep_snapshots=keep_snapshots, keep_days=keep_days)
+    ages = [1, 2, 3, 30 * 24, 31 * 24]
+    folders = {age: make_snapshot(str(tmp_path), hours_ago(age), {"feature": [f"<html>{age}</html>"]})
+               for age in ages}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        store.compact()
+
+    for age, folder in folders.items():
+        assert bool(page_source_files(folder)) == (age in kept)
+        # the .json always stays
+        assert os.path.isfile(folder + ".json")
+
+    # the objects of the dropped snapshots are older than an hour only in real life
+    assert store.collect_garbage(min_age_seconds=0)[0] == len(ages) - len(kept)
+
+
+def test_compact_skips_unfinished_snapshots(tmp_path):
+
+    store = SnapshotStore(str(tmp_path), keep_snapshots=0)
+    running = make_snapshot(str(tmp_path), hours_ago(1), {"feature": [PAGE_1]}, finished=False)
+    interrupted = make_snapshot(str(tmp_path), hours_ago(2), {"feature": [PAGE_2]})
+    open(journal_path(interrupted), 'w').close()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        store.compact()
+
+    assert os.listdir(running) == ["feature.html"]
+    assert os.listdir(interrupted) == ["feature.html"]
+
+
+def test_collect_garbage_keeps_pages_in_use(tmp_path):
+
+    store = SnapshotStore(str(tmp_path))
+    old = make_snapshot(str(tmp_path), "2024-01-31-18", {"feature": [PAGE_1, PAGE_2]})
+    new = make_snapshot(str(tmp_path), "2024-01-31-19", {"feature": [PAGE_1, PAGE_3]})
+    store.pack_folder(old)
+    store.pack_folder(new)
+
+    page_1, page_2 = store.put(PAGE_1.encode())[0], store.put(PAGE_2.encode())[0]
+
+    store.drop_page_sources(old)
+    assert store.collect_garbage(min_age_seconds=0)[0] == 1
+    assert not os.path.exists(store.object_path(page_2))
+    assert os.path.exists(store.object_path(page_1))
+
+    # PAGE_1 is still referenced by the newer snapshot
+    assert read_page_source(os.path.join(new, "feature.pages")) == PAGE_1 + PAGE_3
+
+
+def test_reused_object_survives_garbage_collection(tmp_path):
+
+    store = SnapshotStore(str(tmp_path))
+    name, _ = store.put(PAGE_1.encode())
+    # an object of a long dropped snapshot that no manifest refers to any more
+    os.utime(store.object_path(name), (time.time() - 7200, time.time() - 7200))
+
+    # a new snapshot stores the same page again, its manifest is not written yet
+    assert store.put(PAGE_1.encode()) == (name, 0)
+    assert store.collect_garbage() == (0, 0)
+    assert store.get(name) == PAGE_1.encode()
@@ -0,0 +1,120 @@
+import json, multiprocessing, os, time
+
+from QueueCrawl import QueueCrawl
+from WorkQueue import WorkQueue
+from conftest import expected_links, write_config
+
+
+SNAPSHOT = "page_source_folder/test/2024-01-31-18"
+
+
+def crash_worker(path:str, owner:str) -> None:
+
+    # claims an item and dies with it, the lease is never given back
+    WorkQueue(path).claim(owner)
+    os._exit(1)
+
+
+def worker(path:str, owner:str, seconds_per_item:float) -> None:
+
+    queue = WorkQueue(path)
+    while not queue.finished([SNAPSHOT]):
+        item = queue.claim(owner)
+        if item is None:
+            time.sleep(0.05)
+            continue
+
+        time.sleep(seconds_per_item)
+        queue.complete(item, owner, {"owner": owner, "attempt": item["attempt"]})
+
+
+def run_processes(target, arguments:list, timeout:float = 60) -> list:
+
+    processes = [multiprocessing.Process(target=target, args=args) for args in arguments]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout)
+        assert not process.is_alive()
+
+    return [process.exitcode for process in processes]
+
+
+def test_lease_expiry_and_reclaim(tmp_path):
+
+    path = str(tmp_path / "work_queue.sqlite")
+    queue = WorkQueue(path)
+    features = [f"https://site/feature-{i}" for i in range(12)]
+    assert queue.enqueue("search_configs/test.json", SNAPSHOT, features, lease_seconds=0.5, max_attempts=3) == 12
+
+    # a worker dies holding the first item
+    assert run_processes(crash_worker, [(path, "crashed")]) == [1]
+    assert queue.counts([SNAPSHOT]) == {"leased": 1, "pending": 11}
+
+    run_processes(worker, [(path, f"worker-{i}", 0.05) for i in range(3)])
+
+    items = queue.items(SNAPSHOT)
+    assert [item["feature"] for item in items] == features
+    assert all(item["state"] == "done" for item in items)
+    assert {item["result"]["owner"] for item in items} <= {"worker-0", "worker-1", "worker-2"}
+
+    # the item of the dead worker came back once its lease ran out
+    assert items[0]["attempts"] == 2 and items[0]["result"]["attempt"] == 2
+    assert all(item["attempts"] == 1 for item in items[1:])
+
+
+def test_failed_after_max_attempts(tmp_path):
+
+    path = str(tmp_path / "work_queue.sqlite")
+    queue = WorkQueue(path)
+    queue.enqueue("search_configs/test.json", SNAPSHOT, ["https://site/feature"], lease_seconds=0.2, max_attempts=2)
+
+    for attempt in range(2):
+        run_processes(crash_worker, [(path, f"crashed-{attempt}")])
+        time.sleep(0.3)
+
+    assert queue.claim("worker") is None
+    [item] = queue.items(SNAPSHOT)
+    assert item["state"] == "failed" and item["attempts"] == 2
+    assert item["result"] == {"error": "lease expired"}
+    assert queue.finished([SNAPSHOT])
+
+    # a resumed queue crawl gives failed items a new set of attempts
+    assert queue.enqueue("search_configs/test.json", SNAPSHOT, ["https://site/feature"]) == 1
+    assert queue.claim("worker")["attempt"] == 1
+
+
+def test_lost_lease(tmp_path):
+
+    queue = WorkQueue(str(tmp_path / "work_queue.sqlite"))
+    queue.enqueue("search_configs/test.json", SNAPSHOT, ["https://site/feature"], lease_seconds=0.1)
+
+    slow = queue.claim("slow")
+    assert queue.heartbeat(slow, "slow")
+    time.sleep(0.2)
+    fast = queue.claim("fast")
+
+    # the late result of the first worker is thrown away
+    assert not queue.heartbeat(slow, "slow")
+    assert not queue.complete(slow, "slow", {"owner": "slow"})
+    assert queue.fail(slow, "slow", "too late") is None
+    assert queue.complete(fast, "fast", {"owner": "fast"})
+    assert queue.items(SNAPSHOT)[0]["result"] == {"owner": "fast"}
+
+
+def test_queue_crawl_with_local_workers(workdir, start_site):
+
+    site = start_site(listings_per_feature=45, page_size=20, latency=0.01)
+    link_mods = [f"apartamente-{i}/timis/" for i in range(6)] + ["empty-1/timis/"]
+    config = write_config(site, link_mods, work_queue={"local_workers": 2, "poll_seconds": 0.1, "lease_seconds": 10})
+
+    [scraper] = QueueCrawl([config]).run()
+    with open(scraper.current_config_folder_path + ".json", 'r') as f:
+        link_dict = json.load(f)
+
+    expected = set().union(*(expected_links(site, link_mod) for link_mod in link_mods))
+    assert {link for links in link_dict.values() for link in links} == expected
+    # every feature was fetched once: 3 pages and the redirect back to page 1, 1 page without results
+    assert site.requests == 6 * (3 + 2) + 1
+
+    assert not os.path.exists(os.path.join(scraper.current_config_folder_path, ".work"))